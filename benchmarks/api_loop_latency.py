@@ -0,0 +1,193 @@
+"""比較 API 執行緒模式與單一事件迴圈模式（API_SINGLE_LOOP）的延遲：請求送出到第一次 channel.send。
+
+不需連線 Discord：以假 bot / 假頻道替換推送目標與頻道快取，請求經由真正的
+handle_send_copy_signal、ingest lane 與發送排程器處理。每種模式在獨立子行程中執行：
+
+    python benchmarks/api_loop_latency.py [--requests 500] [--bot-load-ms 0] [--bot-load-interval-ms 20]
+
+--bot-load-ms 在 bot 事件迴圈上週期性地同步佔用 CPU，模擬 gateway 事件處理的負載。
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+MODES = ("threaded", "single_loop")
+
+# 不寫 outbox、放寬速率限制，只量測事件迴圈之間的交接延遲
+os.environ.setdefault("OUTBOX_PATH", "")
+os.environ.setdefault("DISCORD_GLOBAL_RATE", "1000000")
+os.environ.setdefault("DISCORD_CHANNEL_RATE", "1000000")
+os.environ.setdefault("DISCORD_CHANNEL_BURST", "1000000")
+
+
+class StubChannel:
+    """記錄每次 send 的時間點，並喚醒等待中的用戶端"""
+
+    id = 1
+
+    def __init__(self):
+        self.sent_at = None
+        self.sent = threading.Event()
+
+    async def send(self, **kwargs):
+        self.sent_at = time.perf_counter()
+        self.sent.set()
+
+
+class StubAccessCache:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def get(self, bot, channel_id):
+        from handlers.channel_access import ChannelAccess
+        return ChannelAccess(self.channel, True, True, True)
+
+
+class StubBot:
+    def __init__(self, loop):
+        self.loop = loop
+
+
+def build_app(bot, channel):
+    from fastapi import FastAPI, Request
+    from handlers import copy_signal_handler
+
+    async def push_targets(trader_uid):
+        return [(channel.id, "", "0", "en")]
+
+    copy_signal_handler.get_push_targets = push_targets
+    copy_signal_handler.channel_access = StubAccessCache(channel)
+    copy_signal_handler.can_deliver = lambda bot, channel_id: True
+
+    app = FastAPI()
+
+    @app.post("/api/discord/copy_signal")
+    async def send_copy_signal_to_discord(request: Request):
+        return await copy_signal_handler.handle_send_copy_signal(request, bot)
+
+    return app
+
+
+def run_client(port: int, channel: StubChannel, requests: int):
+    """以獨立執行緒依序送出請求，每筆等待 channel.send 後再送下一筆"""
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    first_send, response = [], []
+    base_time = int(time.time() * 1000)
+    for i in range(requests):
+        body = json.dumps(dict(
+            trader_uid="123", trader_name="Alice", trader_pnl="12.5", trader_pnlpercentage="3.2",
+            trader_detail_url="https://example.com/d", pair="BTCUSDT", base_coin="BTC", quote_coin="USDT",
+            pair_leverage="10", pair_type="buy", price="65000.1", time=base_time + i,
+            trader_url="https://example.com/a.png", pair_side="1", pair_margin_type="1",
+        ))
+        channel.sent.clear()
+        started = time.perf_counter()
+        connection.request("POST", "/api/discord/copy_signal", body, {"Content-Type": "application/json"})
+        result = connection.getresponse()
+        result.read()
+        responded = time.perf_counter()
+        if result.status != 200 or not channel.sent.wait(5):
+            raise RuntimeError(f"第 {i} 筆請求未送達 (HTTP {result.status})")
+        response.append(responded - started)
+        first_send.append(channel.sent_at - started)
+    connection.close()
+    return first_send, response
+
+
+async def bot_load(load_ms: float, interval_ms: float):
+    while True:
+        await asyncio.sleep(interval_ms / 1000)
+        deadline = time.perf_counter() + load_ms / 1000
+        while time.perf_counter() < deadline:
+            pass
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_mode(mode: str, requests: int, load_ms: float, interval_ms: float) -> dict:
+    import uvicorn
+    from handlers.ingest import ingest_queues
+
+    loop = asyncio.get_running_loop()
+    channel = StubChannel()
+    bot = StubBot(loop)
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(build_app(bot, channel), host="127.0.0.1", port=port,
+                                           access_log=False, log_level="warning"))
+    ingest_queues.start()
+    load_task = asyncio.create_task(bot_load(load_ms, interval_ms)) if load_ms > 0 else None
+
+    if mode == "single_loop":
+        # 與 main.run_single_loop 相同：uvicorn 以 task 形式跑在 bot 事件迴圈上
+        api_task = asyncio.create_task(server.serve())
+    else:
+        # 與 main.run_api 相同：uvicorn 在獨立執行緒的事件迴圈上
+        api_thread = threading.Thread(target=server.run, daemon=True)
+        api_thread.start()
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    # 預熱後開始量測
+    await loop.run_in_executor(None, run_client, port, channel, 20)
+    first_send, response = await loop.run_in_executor(None, run_client, port, channel, requests)
+
+    server.should_exit = True
+    if mode == "single_loop":
+        await api_task
+    else:
+        await loop.run_in_executor(None, api_thread.join)
+    if load_task:
+        load_task.cancel()
+    await ingest_queues.stop()
+    return {"first_send": first_send, "response": response}
+
+
+def summarize(samples) -> str:
+    ordered = sorted(samples)
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+    return (f"p50 {statistics.median(ordered) * 1000:7.3f}  p90 {pct(0.9):7.3f}  "
+            f"p99 {pct(0.99):7.3f}  max {ordered[-1] * 1000:7.3f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--bot-load-ms", type=float, default=0.0, help="bot 事件迴圈每次同步佔用的毫秒數")
+    parser.add_argument("--bot-load-interval-ms", type=float, default=20.0, help="bot 事件迴圈負載的間隔毫秒數")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        sys.path.insert(0, os.path.join(ROOT, "src"))
+        result = asyncio.run(run_mode(args.mode, args.requests, args.bot_load_ms, args.bot_load_interval_ms))
+        print(json.dumps(result))
+        return
+
+    print(f"{args.requests} requests, bot load {args.bot_load_ms} ms every {args.bot_load_interval_ms} ms (ms)")
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, __file__, "--mode", mode, "--requests", str(args.requests),
+             "--bot-load-ms", str(args.bot_load_ms), "--bot-load-interval-ms", str(args.bot_load_interval_ms)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:<12} request -> first send  {summarize(result['first_send'])}")
+        print(f"{'':<12} request -> response    {summarize(result['response'])}")
+
+
+if __name__ == "__main__":
+    main()
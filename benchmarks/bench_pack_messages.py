@@ -0,0 +1,51 @@
+"""持倉報告分則裝填：則數與耗時。
+
+以約 100 字的合成持倉區塊測試 pack_message_blocks，並與 ceil(總字數 / 2000) 的下限比較
+（下限忽略區塊不可拆分的限制，實際則數可能略多）：
+
+    python benchmarks/bench_pack_messages.py [--number 200]
+"""
+import argparse
+import math
+import os
+import sys
+import timeit
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from handlers.common import DISCORD_MESSAGE_LIMIT, pack_message_blocks  # noqa: E402
+
+HEADER = "📊 **Alice** Holdings Report"
+FOOTER = "[About Alice, more actions>>](https://example.com/trader/123)"
+
+
+def position_block(index: int) -> str:
+    return (
+        f"**BTC{index:04d}USDT** Cross **20X**\n"
+        f"Direction: Long\n"
+        f"Entry Price: ${65000 + index * 0.1:.1f}\n"
+        f"Current Price: ${65123 + index * 0.1:.1f}\n"
+        f"ROI: {index % 50 - 25}.37%"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=200, help="每種規模的重複次數")
+    args = parser.parse_args()
+
+    print(f"{'positions':>9}{'messages':>10}{'bound':>7}{'avg block':>11}{'ms / report':>13}")
+    for count in (10, 100, 500, 1000):
+        blocks = [position_block(i) for i in range(count)]
+        messages = pack_message_blocks(blocks, HEADER, FOOTER)
+        assert all(len(message) <= DISCORD_MESSAGE_LIMIT for message in messages)
+        total = len("\n\n".join([HEADER, *blocks, FOOTER]))
+        bound = math.ceil(total / DISCORD_MESSAGE_LIMIT)
+        elapsed = timeit.timeit(lambda: pack_message_blocks(blocks, HEADER, FOOTER), number=args.number)
+        average = sum(len(block) for block in blocks) / count
+        print(f"{count:>9}{len(messages):>10}{bound:>7}{average:>11.0f}{elapsed / args.number * 1e3:>13.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""比較各端點驗證耗時：基準版本的手寫驗證（json.loads + validate_*）與 pydantic schema（parse_json + Model.check）。
+
+手寫驗證直接取自 git 歷史中的基準 commit，以確保比較對象未被改動：
+
+    python benchmarks/bench_schemas.py [--ref <commit>] [--number 50000]
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import timeit
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from handlers.schemas import CopySignal, ScalpUpdate, TradeSummary, WeeklyReport, parse_json  # noqa: E402
+
+PAYLOADS = {
+    "copy_signal": (CopySignal, dict(
+        trader_uid="123", trader_name="Alice", trader_pnl="12.5", trader_pnlpercentage="3.2",
+        trader_detail_url="https://example.com/d", pair="BTCUSDT", base_coin="BTC", quote_coin="USDT",
+        pair_leverage="10", pair_type="buy", price="65000.1", time=1700000000000,
+        trader_url="https://example.com/a.png", pair_side="1", pair_margin_type=2,
+    )),
+    "trade_summary": (TradeSummary, dict(
+        trader_uid=123, trader_name="Alice", trader_detail_url="https://example.com/d", pair="BTCUSDT",
+        pair_side=1, pair_margin_type="1", pair_leverage="10", entry_price="1.2", exit_price="1.3",
+        realized_pnl="5", realized_pnl_percentage="2", close_time="1700000000000",
+    )),
+    "scalp_update": (ScalpUpdate, dict(
+        trader_uid="123", trader_name="Alice", trader_detail_url="https://example.com/d", pair="BTCUSDT",
+        pair_side="2", time=1700000000000, tp_price="1.5", previous_tp_price="",
+    )),
+    "weekly_report": (WeeklyReport, dict(
+        trader_uid="123", trader_name="Alice", trader_url="https://example.com/a.png",
+        trader_detail_url="https://example.com/d", total_roi="1.2", total_pnl="3",
+        total_trades=10, win_trades="6", loss_trades=4, win_rate="60",
+    )),
+}
+
+
+def load_baseline_validator(ref: str, kind: str):
+    """自 git 歷史取出基準版本的 validate_<kind> 函式"""
+    source = subprocess.run(
+        ["git", "-C", ROOT, "show", f"{ref}:src/handlers/{kind}_handler.py"],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    match = re.search(rf"^def validate_{kind}\(.*?(?=^(?:async )?def |\Z)", source, re.S | re.M)
+    namespace = {}
+    exec(match.group(0), namespace)
+    return namespace[f"validate_{kind}"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ref", default=subprocess.run(
+        ["git", "-C", ROOT, "rev-list", "--max-parents=0", "HEAD"], capture_output=True, text=True
+    ).stdout.strip(), help="基準 commit（預設為第一個 commit）")
+    parser.add_argument("--number", type=int, default=50000, help="每個端點的重複次數")
+    args = parser.parse_args()
+
+    print(f"{'endpoint':<16}{'baseline (us)':>15}{'schema (us)':>13}{'speedup':>9}")
+    for kind, (model, payload) in PAYLOADS.items():
+        baseline = load_baseline_validator(args.ref, kind)
+        body = json.dumps(payload).encode()
+        old = timeit.timeit(lambda: baseline(json.loads(body)), number=args.number) / args.number * 1e6
+        new = timeit.timeit(lambda: model.check(parse_json(body)), number=args.number) / args.number * 1e6
+        print(f"{kind:<16}{old:>15.2f}{new:>13.2f}{old / new:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
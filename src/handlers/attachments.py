@@ -0,0 +1,120 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import tempfile
+from typing import Optional
+
+import discord
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 報告圖片的公開網址：設定後每張圖片只寫入公開目錄一次，各頻道以 embed 引用此固定網址；未設定時各頻道直接上傳。
+# 不使用 Discord 附件的 CDN 連結，因其為簽章網址、約一天後失效，頻道歷史中的圖片會無法載入。
+# 網址須可由 Discord 從外部存取（例如反向代理到本服務的 /media，或由其他靜態伺服器提供同一目錄）。
+ATTACHMENT_PUBLIC_BASE_URL = os.getenv("ATTACHMENT_PUBLIC_BASE_URL", "").rstrip("/")
+ATTACHMENT_PUBLIC_DIR = os.getenv(
+    "ATTACHMENT_PUBLIC_DIR",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'media'))
+)
+# 公開圖片保留時間（秒），超過後刪除，頻道歷史中更舊的圖片將無法載入；0 表示永久保留
+ATTACHMENT_RETENTION_SECONDS = float(os.getenv("ATTACHMENT_RETENTION_SECONDS", str(90 * 86400)))
+# 清理過期圖片的最短間隔（秒）
+_PRUNE_INTERVAL_SECONDS = 3600
+
+stats = {
+    "staged": 0,
+    "stage_failures": 0,
+    "embed_sends": 0,
+    "direct_uploads": 0,
+    # 引用公開圖片的發送失敗、改為直接上傳的次數
+    "embed_fallbacks": 0,
+    "pruned": 0,
+}
+_last_prune = 0.0
+
+
+def _publish(image_path: str, filename: str) -> str:
+    """以內容雜湊命名寫入公開目錄（相同圖片只存一份），回傳檔名"""
+    with open(image_path, "rb") as f:
+        content = f.read()
+    stem, ext = os.path.splitext(filename)
+    name = f"{stem}-{hashlib.sha256(content).hexdigest()[:32]}{ext or '.png'}"
+    os.makedirs(ATTACHMENT_PUBLIC_DIR, exist_ok=True)
+    target = os.path.join(ATTACHMENT_PUBLIC_DIR, name)
+    if not os.path.exists(target):
+        # 先寫入暫存檔再原子替換，讀取端不會看到寫到一半的檔案
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, target)
+    return name
+
+
+def _prune() -> int:
+    """刪除超過保留時間的公開圖片，回傳刪除數量"""
+    cutoff = time.time() - ATTACHMENT_RETENTION_SECONDS
+    removed = 0
+    for entry in os.scandir(ATTACHMENT_PUBLIC_DIR):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+async def stage_image(image_path: str, filename: str) -> Optional[str]:
+    """將圖片寫入公開目錄一次，回傳其固定網址；未啟用或失敗時回傳 None（呼叫端改為各頻道直接上傳）"""
+    global _last_prune
+    if not ATTACHMENT_PUBLIC_BASE_URL or not image_path or not os.path.exists(image_path):
+        return None
+    try:
+        name = await asyncio.to_thread(_publish, image_path, filename)
+    except OSError as e:
+        stats["stage_failures"] += 1
+        logger.warning(f"[Attachments] 公開圖片寫入失敗，改為直接上傳: {type(e).__name__} - {e}")
+        return None
+    stats["staged"] += 1
+    logger.info(f"[Attachments] 圖片已公開: {name}")
+
+    now = time.monotonic()
+    if ATTACHMENT_RETENTION_SECONDS > 0 and now - _last_prune >= _PRUNE_INTERVAL_SECONDS:
+        _last_prune = now
+        try:
+            stats["pruned"] += await asyncio.to_thread(_prune)
+        except OSError as e:
+            logger.warning(f"[Attachments] 清理過期公開圖片失敗: {e}")
+    return f"{ATTACHMENT_PUBLIC_BASE_URL}/{name}"
+
+
+def image_embed(image_url: str) -> discord.Embed:
+    """以公開圖片網址建立只含圖片的 embed"""
+    embed = discord.Embed()
+    embed.set_image(url=image_url)
+    return embed
+
+
+def temp_image_path(prefix: str) -> str:
+    """為單次推送建立專用的暫存圖片路徑；發送時才讀取檔案，共用固定路徑會被並行的工作覆寫"""
+    with tempfile.NamedTemporaryFile(prefix=prefix, suffix=".png", delete=False) as f:
+        return f.name
+
+
+def remove_image(image_path: Optional[str]) -> None:
+    """推送結束後刪除暫存圖片"""
+    if not image_path:
+        return
+    try:
+        os.remove(image_path)
+    except OSError as e:
+        logger.warning(f"[Attachments] 刪除暫存圖片失敗: {image_path} - {e}")
+
+
+def get_stats() -> dict:
+    return {**stats, "public_base_url": ATTACHMENT_PUBLIC_BASE_URL or None}
@@ -0,0 +1,72 @@
+import logging
+from typing import Dict, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelAccess(NamedTuple):
+    channel: object
+    can_send: bool
+    can_attach: bool
+    can_embed: bool
+
+
+class ChannelAccessCache:
+    """快取每個頻道的 (頻道物件, 可發送, 可附檔, 可嵌入)，避免每次發送都重算權限覆寫。
+
+    頻道、身分組或 bot 自身成員資料變更時由事件清除；僅在 bot 事件迴圈上使用。
+    """
+
+    def __init__(self):
+        self._entries: Dict[int, ChannelAccess] = {}
+        # guild_id -> 該 guild 已快取的頻道 id，用於整個 guild 失效
+        self._by_guild: Dict[int, set] = {}
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, bot, channel_id: int) -> Optional[ChannelAccess]:
+        """取得頻道與 bot 在該頻道的權限，找不到頻道時回傳 None"""
+        channel_id = int(channel_id)
+        access = self._entries.get(channel_id)
+        if access is not None:
+            self.stats["hits"] += 1
+            return access
+        self.stats["misses"] += 1
+        channel = bot.get_channel(channel_id)
+        if channel is None:
+            return None
+        guild = getattr(channel, "guild", None)
+        if guild is None or guild.me is None:
+            return None
+        permissions = channel.permissions_for(guild.me)
+        access = ChannelAccess(channel, permissions.send_messages, permissions.attach_files, permissions.embed_links)
+        self._entries[channel_id] = access
+        self._by_guild.setdefault(guild.id, set()).add(channel_id)
+        return access
+
+    def can_send(self, bot, channel_id: int) -> bool:
+        access = self.get(bot, channel_id)
+        return access is not None and access.can_send
+
+    def invalidate_channel(self, channel_id: int) -> None:
+        channel_id = int(channel_id)
+        access = self._entries.pop(channel_id, None)
+        if access is None:
+            return
+        self.stats["invalidations"] += 1
+        guild_id = access.channel.guild.id
+        channel_ids = self._by_guild.get(guild_id)
+        if channel_ids is not None:
+            channel_ids.discard(channel_id)
+            if not channel_ids:
+                del self._by_guild[guild_id]
+
+    def invalidate_guild(self, guild_id: int) -> None:
+        """身分組、分類或 bot 成員資料變更可能影響整個 guild 的頻道權限"""
+        for channel_id in self._by_guild.pop(guild_id, ()):
+            self.invalidate_channel(channel_id)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "channels": len(self._entries), "guilds": len(self._by_guild)}
+
+
+channel_access = ChannelAccessCache()
@@ -0,0 +1,131 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+from .channel_access import channel_access
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 連續失敗幾次後隔離頻道
+CHANNEL_QUARANTINE_THRESHOLD = int(os.getenv("CHANNEL_QUARANTINE_THRESHOLD", "3"))
+# 首次隔離秒數，之後每次探測失敗加倍，直到上限
+CHANNEL_QUARANTINE_BASE_SECONDS = float(os.getenv("CHANNEL_QUARANTINE_BASE_SECONDS", "60"))
+CHANNEL_QUARANTINE_MAX_SECONDS = float(os.getenv("CHANNEL_QUARANTINE_MAX_SECONDS", "21600"))
+
+# Discord 錯誤碼：Unknown Channel / Missing Access / Missing Permissions
+_DEAD_CHANNEL_CODES = {10003, 50001, 50013}
+
+
+class _Health:
+    __slots__ = ("failures", "backoff", "quarantined_until", "last_error", "last_failure_at")
+
+    def __init__(self):
+        self.failures = 0
+        self.backoff = 0.0
+        self.quarantined_until = 0.0
+        self.last_error = ""
+        self.last_failure_at = 0.0
+
+
+class ChannelHealth:
+    """頻道健康度斷路器：連續失敗達門檻即隔離，隔離到期後放行一次探測。
+
+    探測成功即恢復；失敗則以加倍的時間重新隔離（指數退避）。
+    """
+
+    def __init__(self, threshold: int = CHANNEL_QUARANTINE_THRESHOLD,
+                 base: float = CHANNEL_QUARANTINE_BASE_SECONDS, max_backoff: float = CHANNEL_QUARANTINE_MAX_SECONDS):
+        self.threshold = threshold
+        self.base = base
+        self.max_backoff = max_backoff
+        self._channels: Dict[int, _Health] = {}
+        self.stats = {"quarantined": 0, "skipped": 0, "recovered": 0, "probes": 0}
+
+    def is_quarantined(self, channel_id: int) -> bool:
+        health = self._channels.get(int(channel_id))
+        if health is None or not health.quarantined_until:
+            return False
+        now = time.monotonic()
+        if health.quarantined_until <= now:
+            # 隔離到期：只放行一次探測，其餘呼叫在探測結果回報前（或探測逾時前）仍視為隔離
+            health.quarantined_until = now + self.base
+            self.stats["probes"] += 1
+            return False
+        self.stats["skipped"] += 1
+        return True
+
+    def record_success(self, channel_id: int) -> None:
+        health = self._channels.pop(int(channel_id), None)
+        if health is not None and health.backoff:
+            self.stats["recovered"] += 1
+            logger.info(f"[ChannelHealth] 頻道 {channel_id} 已恢復，解除隔離")
+
+    def record_failure(self, channel_id: int, reason: str) -> None:
+        channel_id = int(channel_id)
+        health = self._channels.setdefault(channel_id, _Health())
+        health.failures += 1
+        health.last_error = reason
+        health.last_failure_at = time.time()
+        if health.failures < self.threshold:
+            return
+        health.backoff = min(health.backoff * 2 if health.backoff else self.base, self.max_backoff)
+        health.quarantined_until = time.monotonic() + health.backoff
+        self.stats["quarantined"] += 1
+        logger.warning(
+            f"[ChannelHealth] 頻道 {channel_id} 連續失敗 {health.failures} 次 ({reason})，隔離 {health.backoff:.0f} 秒"
+        )
+
+    def record_error(self, channel_id: int, error: BaseException) -> None:
+        """依例外判斷是否屬於頻道失效（被踢出、無權限、頻道不存在、逾時）"""
+        code = getattr(error, "code", None)
+        if code in _DEAD_CHANNEL_CODES or isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+            self.record_failure(channel_id, f"{type(error).__name__}({code})" if code else type(error).__name__)
+
+    def release(self, channel_id: int) -> bool:
+        """手動解除隔離"""
+        return self._channels.pop(int(channel_id), None) is not None
+
+    def quarantined(self) -> List[dict]:
+        """可從 API 執行緒呼叫：先複製一份快照，避免與 bot 事件迴圈的增刪同時迭代"""
+        now = time.monotonic()
+        return [
+            {
+                "channel_id": str(channel_id),
+                "failures": health.failures,
+                "last_error": health.last_error,
+                "last_failure_at": health.last_failure_at,
+                "retry_in_seconds": round(health.quarantined_until - now, 1),
+                "backoff_seconds": health.backoff,
+            }
+            for channel_id, health in list(self._channels.items())
+            if health.quarantined_until > now
+        ]
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "tracked": len(self._channels), "quarantined_now": len(self.quarantined())}
+
+
+channel_health = ChannelHealth()
+
+
+def can_deliver(bot, channel_id: int) -> bool:
+    """fan-out 前的篩選：隔離中的頻道直接略過；不存在或無發送權限的頻道計入失敗。
+
+    gateway 尚未載入完所有伺服器前（例如啟動時的 outbox 補發），快取找不到頻道不代表頻道失效，只略過不計入失敗。
+    """
+    if channel_health.is_quarantined(channel_id):
+        return False
+    if channel_access.can_send(bot, channel_id):
+        return True
+    if not bot.is_ready():
+        logger.info(f"[ChannelHealth] gateway 尚未就緒，頻道 {channel_id} 暫時無法取得，略過")
+        return False
+    logger.warning(f"[ChannelHealth] 頻道 {channel_id} 不存在或沒有發送權限，略過")
+    channel_health.record_failure(channel_id, "unsendable")
+    return False
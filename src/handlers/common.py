@@ -1,18 +1,18 @@
 import os
 import re
-import aiohttp
 import asyncio
 import logging
 from io import BytesIO
 from datetime import datetime, timezone
-from typing import List, Tuple, Dict
+from typing import Any, Awaitable, Callable, Hashable, List, Optional, Tuple, Dict
 from PIL import Image, ImageDraw, ImageFont
 from dotenv import load_dotenv
 import requests
 
 load_dotenv()
 
-SOCIAL_API = os.getenv("SOCIAL_API")
+# 批次介面單次最多接受的項目數
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
 
 # 新增: i18n 單例存取與語言正規化
 try:
@@ -25,6 +25,14 @@ except Exception:
         def normalize_locale(lang):
             return "en"
 
+from .routing import routing_table
+from .http_pool import http_sessions, timeout
+from .outbox import outbox
+from .dedup import dedup_window
+from .ingest import ingest_queues
+from .schemas import parse_json
+from .attachments import temp_image_path, remove_image
+
 _i18n_instance = None
 
 def get_i18n():
@@ -93,14 +101,14 @@ async def generate_trader_summary_image(trader_url, trader_name, pnl_percentage,
     # logging.info(f"[CopySignal] 開始下載頭像: {trader_url}")
     try:
         headers = {"User-Agent": "Mozilla/5.0"}
-        async with aiohttp.ClientSession() as session:
-            async with session.get(trader_url, timeout=aiohttp.ClientTimeout(total=6), headers=headers) as resp:
-                if resp.status == 200:
-                    avatar_data = await resp.read()
-                    avatar = Image.open(BytesIO(avatar_data)).resize((avatar_size, avatar_size)).convert("RGBA")
-                    # logging.info(f"[CopySignal] 成功下載頭像")
-                else:
-                    raise Exception(f"Failed to download avatar: {resp.status}")
+        session = http_sessions.get(trader_url)
+        async with session.get(trader_url, timeout=timeout(6), headers=headers) as resp:
+            if resp.status == 200:
+                avatar_data = await resp.read()
+                avatar = Image.open(BytesIO(avatar_data)).resize((avatar_size, avatar_size)).convert("RGBA")
+                # logging.info(f"[CopySignal] 成功下載頭像")
+            else:
+                raise Exception(f"Failed to download avatar: {resp.status}")
     except Exception as e:
         logging.warning(f"[CopySignal] 下載頭像失敗: {e}")
         avatar = Image.new("RGBA", (avatar_size, avatar_size), (120, 120, 120, 255))
@@ -174,7 +182,8 @@ async def generate_trader_summary_image(trader_url, trader_name, pnl_percentage,
 
     # logging.info(f"[CopySignal] 圖片文字繪製完成 - ROI: {roi_text}, PNL: {pnl_text}")
 
-    tmp_path = "/tmp/trader_summary_discord.png"
+    # 每次產圖使用獨立的暫存檔，呼叫端於推送結束後以 remove_image 刪除
+    tmp_path = temp_image_path("trader_summary_")
     # logging.info(f"[CopySignal] 保存圖片到: {tmp_path}")
     try:
         img.save(tmp_path, quality=95)
@@ -182,72 +191,92 @@ async def generate_trader_summary_image(trader_url, trader_name, pnl_percentage,
         return tmp_path
     except Exception as e:
         logging.error(f"[CopySignal] 圖片保存失敗: {e}")
+        remove_image(tmp_path)
         return None
 
 async def get_push_targets(trader_uid: str) -> List[Tuple[int, str, str, str]]:
-    """獲取推送目標列表，返回 (channel_id, topic_id, jump, lang) 的列表"""
-    # logging.info(f"[CopySignal] 開始獲取推送目標，交易員 UID: {trader_uid}")
+    """獲取推送目標列表，返回 (channel_id, topic_id, jump, lang) 的列表（由共享路由表提供）"""
     try:
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        payload = {"brand": "BYD", "type": "DISCORD"}
-        
-        # logging.info(f"[CopySignal] 調用 SOCIAL_API: {SOCIAL_API}")
-        async with aiohttp.ClientSession() as session:
-            async with session.post(SOCIAL_API, headers=headers, data=payload) as resp:
-                # logging.info(f"[CopySignal] SOCIAL_API 回應狀態: {resp.status}")
-                if resp.status != 200:
-                    logging.error(f"[CopySignal] SOCIAL_API 回應錯誤: {resp.status}")
-                    return []
-                
-                social_data = await resp.json()
-                # logging.info(f"[CopySignal] 成功獲取社交數據，包含 {len(social_data.get('data', []))} 個群組")
-
-        push_targets = []
-        for i, social in enumerate(social_data.get("data", [])):
-            # logging.info(f"[CopySignal] 處理第 {i+1} 個群組: {social.get('name', 'Unknown')}")
-            group_lang_raw = social.get("lang") or "en"
-            group_lang = normalize_locale(group_lang_raw)
-            for j, chat in enumerate(social.get("chats", [])):
-                # logging.info(f"[CopySignal] 檢查聊天 {j+1}: type={chat.get('type')}, enable={chat.get('enable')}, traderUid={chat.get('traderUid')}")
-                if (
-                    chat.get("type") == "copy"
-                    and chat.get("enable")
-                    and str(chat.get("traderUid")) == trader_uid
-                ):
-                    cid = chat.get("chatId")
-                    if cid:
-                        # 處理 jump 值：如果為 null 或未設置，默認為 "0"
-                        jump_value = chat.get("jump")
-                        if jump_value is None or jump_value == "" or jump_value == "null":
-                            jump_value = "0"
-                        else:
-                            jump_value = str(jump_value)
-                        
-                        push_targets.append((
-                            int(cid),
-                            str(chat.get("topicId", "")),
-                            jump_value,
-                            group_lang
-                        ))
-                        # logging.info(f"[CopySignal] 找到匹配的推送目標: channel_id={cid}, topic_id={chat.get('topicId')}, jump={jump_value}, lang={group_lang}")
-
-        # logging.info(f"[CopySignal] 總共找到 {len(push_targets)} 個推送目標")
-        return push_targets
+        return await routing_table.get_push_targets(trader_uid)
     except Exception as e:
         logging.error(f"[CopySignal] 獲取推送目標失敗: {type(e).__name__} - {e}")
         import traceback
         logging.error(f"[CopySignal] 詳細錯誤: {traceback.format_exc()}")
         return []
 
+def group_targets_for_render(push_targets: List[Tuple[int, str, str, str]]) -> Dict[Tuple[str, bool], List[Tuple[int, str, str, str]]]:
+    """依 (正規化語言, 是否含連結) 分組推送目標，同組頻道共用同一份渲染文案"""
+    groups: Dict[Tuple[str, bool], List[Tuple[int, str, str, str]]] = {}
+    for target in push_targets:
+        _, _, jump, lang = target
+        groups.setdefault((normalize_locale(lang), jump == "1"), []).append(target)
+    return groups
+
+# Discord 單則訊息字數上限
+DISCORD_MESSAGE_LIMIT = 2000
+
+def _split_oversized(block: str, limit: int) -> List[str]:
+    """單一區塊本身超過上限時才使用：依行切分，單行仍過長則硬切"""
+    pieces: List[str] = []
+    current = ""
+    for line in block.split("\n"):
+        while len(line) > limit:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) <= limit:
+            current = candidate
+        else:
+            pieces.append(current)
+            current = line
+    if current:
+        pieces.append(current)
+    return pieces
+
+def pack_message_blocks(blocks: List[str], header: str = "", footer: str = "",
+                        separator: str = "\n\n", limit: int = DISCORD_MESSAGE_LIMIT) -> List[str]:
+    """依序將區塊裝入最少則數的訊息，單一區塊不會被拆到兩則訊息。
+
+    header 只出現在第一則、footer 只出現在最後一則；區塊順序不變，因此依序貪婪裝填即為最少則數。
+    """
+    messages: List[str] = []
+    parts: List[str] = []
+    length = 0
+    sep_len = len(separator)
+
+    def add(piece: str) -> None:
+        nonlocal length
+        extra = len(piece) + (sep_len if parts else 0)
+        if parts and length + extra > limit:
+            messages.append(separator.join(parts))
+            parts.clear()
+            length = 0
+            extra = len(piece)
+        parts.append(piece)
+        length += extra
+
+    for piece in ([header] if header else []) + blocks + ([footer] if footer else []):
+        if len(piece) > limit:
+            for sub_piece in _split_oversized(piece, limit):
+                add(sub_piece)
+        else:
+            add(piece)
+    if parts:
+        messages.append(separator.join(parts))
+    return messages
+
 async def send_discord_message(discord_bot_url: str, data: dict) -> None:
     """發送消息到 Discord Bot"""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(discord_bot_url, json=data) as resp:
-                if resp.status != 200:
-                    logging.error(f"Discord Bot 推送失敗: {resp.status}")
-                else:
-                    logging.info("Discord Bot 推送成功")
+        session = http_sessions.get(discord_bot_url)
+        async with session.post(discord_bot_url, json=data, timeout=timeout(10)) as resp:
+            if resp.status != 200:
+                logging.error(f"Discord Bot 推送失敗: {resp.status}")
+            else:
+                logging.info("Discord Bot 推送成功")
     except Exception as e:
         logging.error(f"Discord Bot 推送異常: {e}")
 
@@ -261,4 +290,102 @@ def create_async_response(coroutine_func, *args, **kwargs):
     
     # 啟動背景任務
     asyncio.create_task(wrapper())
-    return {"status": "200", "message": "接收成功，稍後發送"} 
\ No newline at end of file
+    return {"status": "200", "message": "接收成功，稍後發送"}
+
+
+async def _process_trader_batch(process: Callable[..., Awaitable[None]], trader_uid: str,
+                                batch: List[Tuple[Optional[str], dict, Any]], bot) -> None:
+    """背景協程：同一交易員的批次項目只查詢一次推送目標，並依序處理"""
+    push_targets = await get_push_targets(trader_uid)
+    for signal_id, data, signal in batch:
+        await outbox.track(signal_id, process(data, bot, push_targets, signal))
+
+async def handle_batch(kind: str, validate: Callable[[dict], Any], dedup_key: Callable[[Any], Hashable],
+                       process: Callable[..., Awaitable[None]], request, bot,
+                       before_submit: Optional[Callable[[str], None]] = None) -> Any:
+    """
+    處理 /api/discord/<kind>/batch 介面：
+    1. 接受 JSON 陣列，逐筆驗證與去重，失敗項目以索引回報，不影響其他項目。
+    2. 有效項目依交易員分組，各組排入該交易員的有序 lane，每個項目計入一個佇列名額。
+    validate(data) 回傳已轉型的模型，dedup_key 以模型建立冪等鍵；
+    process(data, bot, push_targets, signal) 為單筆處理協程；before_submit(trader_uid) 於排入前呼叫。
+    """
+    tag = "".join(part.title() for part in kind.split("_"))
+    logging.info(f"[{tag}] 開始處理批次請求")
+
+    # Content-Type 檢查
+    content_type = request.headers.get("content-type", "").split(";")[0].lower()
+    if content_type != "application/json":
+        logging.error(f"[{tag}] Content-Type 錯誤: {content_type}")
+        return {"status": "400", "message": "Content-Type must be application/json"}
+
+    # 解析 JSON
+    try:
+        items = parse_json(await request.body())
+    except Exception as e:
+        logging.error(f"[{tag}] JSON 解析失敗: {e}")
+        return {"status": "400", "message": "Invalid JSON body"}
+    if not isinstance(items, list) or not items:
+        return {"status": "400", "message": "Request body must be a non-empty JSON array"}
+    if len(items) > BATCH_MAX_ITEMS:
+        return {"status": "400", "message": f"Batch too large (max {BATCH_MAX_ITEMS} items)"}
+
+    # 逐筆驗證與去重，批次內的重複項目同樣由時間窗過濾
+    errors = []
+    duplicates = 0
+    groups: Dict[str, List[Tuple[int, Hashable, dict, Any]]] = {}
+    for index, data in enumerate(items):
+        try:
+            if not isinstance(data, dict):
+                raise ValueError("項目必須為 JSON 物件")
+            signal = validate(data)
+        except ValueError as err:
+            errors.append({"index": index, "status": "400", "message": str(err)})
+            continue
+        key = dedup_key(signal)
+        if dedup_window.seen(kind, key):
+            duplicates += 1
+            continue
+        groups.setdefault(signal.trader_uid, []).append((index, key, data, signal))
+    valid = sum(len(group) for group in groups.values())
+    logging.info(f"[{tag}] 批次共 {len(items)} 筆：有效 {valid}、重複 {duplicates}、無效 {len(errors)}")
+
+    queued = 0
+    rejected = None
+    for trader_uid, group in groups.items():
+        batch = []
+        try:
+            # 逐筆加入 batch：中途失敗時，已寫入 outbox 的項目同樣會在下方標記完成，重啟後不會補發
+            for _, _, data, signal in group:
+                batch.append((outbox.record(kind, data), data, signal))
+            if before_submit is not None:
+                before_submit(trader_uid)
+            rejected = ingest_queues.submit(
+                kind, lambda trader_uid=trader_uid, batch=batch: _process_trader_batch(process, trader_uid, batch, bot),
+                key=trader_uid, cost=len(batch)
+            )
+        except Exception as e:
+            logging.error(f"[{tag}] 調度批次背景任務失敗: {e}")
+            rejected = 500
+        if rejected:
+            logging.warning(f"[{tag}] 交易員 {trader_uid} 的 {len(group)} 筆未能排入處理 ({rejected})")
+            for signal_id, _, _ in batch:
+                outbox.complete(signal_id)
+            for index, key, _, _ in group:
+                dedup_window.forget(kind, key)
+                errors.append({"index": index, "status": str(rejected), "message": "Not queued, retry later"})
+            continue
+        queued += len(group)
+
+    if valid and not queued:
+        if rejected in (429, 503):
+            return ingest_queues.reject_response(rejected)
+        return {"status": "500", "message": "Internal server error"}
+    errors.sort(key=lambda error: error["index"])
+    return {
+        "status": "200" if queued or duplicates else "400",
+        "message": "接收成功，稍後發送" if queued or duplicates else "批次內沒有有效項目",
+        "accepted": queued,
+        "duplicates": duplicates,
+        "errors": errors,
+    }
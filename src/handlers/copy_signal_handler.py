@@ -1,77 +1,54 @@
 import os
-import aiohttp
 import asyncio
 import logging
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 from fastapi import Request
 import discord
 from dotenv import load_dotenv
 
 from .common import (
-    get_push_targets, generate_trader_summary_image, format_timestamp_ms_to_utc,
-    create_async_response, get_i18n, normalize_locale
+    get_push_targets, handle_batch, generate_trader_summary_image, format_float, format_timestamp_ms_to_utc,
+    get_i18n, normalize_locale, group_targets_for_render
 )
+from .outbox import outbox
+from .schemas import parse_json, CopySignal
+from .ingest import ingest_queues
+from .scalp_update_handler import flush_pending_scalps
+from .dedup import dedup_window
+from .channel_access import channel_access
+from .channel_health import can_deliver
+from .delivery import deliver, PRIORITY_SIGNAL
+from .webhooks import webhook_registry, use_webhook
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-def validate_copy_signal(data: dict) -> None:
-    """驗證 copy signal 請求資料，失敗時拋出 ValueError。"""
-    required_fields = {
-        "trader_uid", "trader_name", "trader_pnl", "trader_pnlpercentage",
-        "trader_detail_url", "pair", "base_coin", "quote_coin",
-        "pair_leverage", "pair_type", "price", "time", "trader_url",
-        "pair_side", "pair_margin_type"
-    }
+def validate_copy_signal(data: dict) -> CopySignal:
+    """驗證 copy signal 請求資料並回傳已轉型的模型，失敗時拋出 ValueError。"""
+    return CopySignal.check(data)
 
-    missing = [f for f in required_fields if not data.get(f)]
-    if missing:
-        raise ValueError(f"缺少欄位: {', '.join(missing)}")
+def copy_signal_dedup_key(signal: CopySignal) -> tuple:
+    """冪等鍵：時間窗內相同鍵的請求視為上游重試"""
+    return (signal.trader_uid, signal.pair, signal.pair_type, int(signal.time))
 
-    # 數值與類型檢查
-    try:
-        pnl = float(data["trader_pnl"])
-        pnl_perc = float(data["trader_pnlpercentage"])
-        float(data["pair_leverage"])
-    except (TypeError, ValueError):
-        raise ValueError("trader_pnlpercentage / pair_leverage / trader_pnl 必須為數字格式")
-
-    # 正負號須一致
-    if (pnl >= 0) ^ (pnl_perc >= 0):
-        raise ValueError("trader_pnl 與 trader_pnlpercentage 正負號不一致")
-
-    if data["pair_type"] not in {"buy", "sell"}:
-        raise ValueError("pair_type 只能是 'buy' 或 'sell'")
-
-    # pair_side 必須為 1 或 2（字串或數字）
-    if str(data["pair_side"]) not in {"1", "2"}:
-        raise ValueError("pair_side 只能是 '1'(Long) 或 '2'(Short)")
-
-    # pair_margin_type 必須為 1 或 2（字串或數字）
-    if str(data["pair_margin_type"]) not in {"1", "2"}:
-        raise ValueError("pair_margin_type 只能是 '1'(Cross) 或 '2'(Isolated)")
+async def process_copy_signal_discord(data: dict, bot, push_targets: Optional[List[Tuple[int, str, str, str]]] = None,
+                                      signal: Optional[CopySignal] = None) -> None:
+    """背景協程：查詢推送目標、產圖並發送訊息到 Discord。
 
-    # time 欄位必須為毫秒級時間戳（13 位數/大於等於 1e12）
-    try:
-        ts_val = int(float(data["time"]))
-    except (TypeError, ValueError):
-        raise ValueError("time 必須為毫秒級時間戳 (數字格式)")
-
-    # 檢查是否可能為秒級時間戳（10 位數），若是則判定錯誤
-    if ts_val < 10**12:
-        raise ValueError("time 必須為毫秒級時間戳 (13 位)")
-
-async def process_copy_signal_discord(data: dict, bot) -> None:
-    """背景協程：查詢推送目標、產圖並發送訊息到 Discord。"""
+    signal 為已驗證的模型；未提供時（例如 outbox 重送）由 data 重新驗證。
+    """
     logger.info("[CopySignal] 開始執行背景處理任務")
     try:
-        trader_uid = str(data["trader_uid"])
+        if signal is None:
+            signal = validate_copy_signal(data)
+        trader_uid = signal.trader_uid
         logger.info(f"[CopySignal] 處理交易員 UID: {trader_uid}")
 
         # 獲取推送目標
-        logger.info("[CopySignal] 開始獲取推送目標")
-        push_targets = await get_push_targets(trader_uid)
+        if push_targets is None:
+            logger.info("[CopySignal] 開始獲取推送目標")
+            push_targets = await get_push_targets(trader_uid)
         logger.info(f"[CopySignal] 獲取到 {len(push_targets)} 個推送目標")
 
         if not push_targets:
@@ -92,66 +69,33 @@ async def process_copy_signal_discord(data: dict, bot) -> None:
         # logger.info(f"[CopySignal] 圖片生成成功: {img_path}")
 
         # 將毫秒級時間戳轉為 UTC+0 可讀格式
-        formatted_time = format_timestamp_ms_to_utc(data.get('time'))
+        formatted_time = format_timestamp_ms_to_utc(signal.time)
         logger.info(f"[CopySignal] 格式化時間: {formatted_time}")
 
-        # 準備發送任務
+        # 準備發送任務：同語言、同連結設定的頻道只渲染一次
         tasks = []
+        task_targets = []
         logger.info(f"[CopySignal] 準備發送到 {len(push_targets)} 個頻道")
-        
-        # 載入 i18n
-        i18n = get_i18n()
-        
-        for i, (channel_id, topic_id, jump, channel_lang) in enumerate(push_targets):
-            logger.info(f"[CopySignal] 處理第 {i+1} 個頻道: {channel_id}, topic: {topic_id}, jump: {jump}, lang: {channel_lang}")
-
-            # 每個頻道使用群組語言
-            req_locale = normalize_locale(channel_lang)
-
-            # 映射方向/倉位/保證金類型
-            pair_type_key = (data.get("pair_type") or "").lower()
-            pair_type_text = i18n.t(f"copy_signal.pair_types.{pair_type_key}", req_locale)
-            pair_side_text = i18n.t(f"common.sides.{str(data.get('pair_side', ''))}", req_locale)
-            margin_type_text = i18n.t(f"common.margin_types.{str(data.get('pair_margin_type',''))}", req_locale)
-
-            # 決定標題
-            title_key = "copy_signal.title_open" if pair_type_key == "buy" else "copy_signal.title_close"
-            title = i18n.render(title_key, req_locale, {"trader_name": data["trader_name"]})
-
-            # 根據 jump 決定是否顯示連結
-            detail_line = i18n.render(
-                "common.detail_line", req_locale,
-                {"trader_name": data['trader_name'], "url": data['trader_detail_url']}
-            ) if jump == "1" else ""
-
-            body = i18n.render(
-                "copy_signal.body", req_locale,
-                {
-                    "pair": data["pair"],
-                    "margin_type": margin_type_text,
-                    "leverage": data["pair_leverage"],
-                    "time_label": i18n.t("common.labels.time", req_locale),
-                    "time": formatted_time,
-                    "direction_label": i18n.t("common.labels.direction", req_locale),
-                    "pair_type": pair_type_text,
-                    "pair_side": pair_side_text,
-                    "entry_price_label": i18n.t("common.labels.entry_price", req_locale),
-                    "price": data["price"],
-                    "detail_line": detail_line
-                }
-            )
-
-            caption = f"{title}\n\n{body}"
-            
-            logger.info(f"[CopySignal] 為頻道 {channel_id} 準備消息內容")
-            tasks.append(
-                send_discord_message_with_image(
-                    bot=bot,
-                    channel_id=channel_id,
-                    text=caption,
-                    image_path=None
+
+        render_groups = group_targets_for_render(push_targets)
+        logger.info(f"[CopySignal] 共 {len(render_groups)} 種語言/連結組合")
+
+        for (req_locale, include_link), targets in render_groups.items():
+            caption = format_copy_signal_text(data, signal, formatted_time, include_link, req_locale)
+
+            for channel_id, topic_id, jump, channel_lang in targets:
+                if not use_webhook(topic_id) and not can_deliver(bot, channel_id):
+                    continue
+                tasks.append(
+                    send_discord_message_with_image(
+                        bot=bot,
+                        channel_id=channel_id,
+                        text=caption,
+                        image_path=None,
+                        topic_id=topic_id
+                    )
                 )
-            )
+                task_targets.append(channel_id)
 
         # 等待 Discord 發送結果
         logger.info(f"[CopySignal] 開始並發發送 {len(tasks)} 個消息")
@@ -161,10 +105,10 @@ async def process_copy_signal_discord(data: dict, bot) -> None:
         success_count = 0
         for i, result in enumerate(results):
             if isinstance(result, Exception):
-                logger.error(f"[CopySignal] 頻道 {push_targets[i][0]} 發送失敗: {result}")
+                logger.error(f"[CopySignal] 頻道 {task_targets[i]} 發送失敗: {result}")
             else:
                 success_count += 1
-                logger.info(f"[CopySignal] 頻道 {push_targets[i][0]} 發送成功")
+                logger.info(f"[CopySignal] 頻道 {task_targets[i]} 發送成功")
         
         logger.info(f"[CopySignal] 發送完成: {success_count}/{len(tasks)} 成功")
 
@@ -173,22 +117,63 @@ async def process_copy_signal_discord(data: dict, bot) -> None:
         import traceback
         logger.error(f"[CopySignal] 詳細錯誤: {traceback.format_exc()}")
 
-async def send_discord_message_with_image(bot, channel_id: int, text: str, image_path: str) -> None:
-    """發送帶圖片的 Discord 消息"""
+def format_copy_signal_text(data: dict, signal: CopySignal, formatted_time: str, include_link: bool = True, lang: str = None) -> str:
+    """格式化開平倉訊號文本（i18n）；代碼與數值取自已轉型的 signal，價格保留原始字串顯示"""
+    i18n = get_i18n()
+    req_locale = normalize_locale(lang)
+
+    # 映射方向/倉位/保證金類型
+    pair_type_key = signal.pair_type
+    pair_type_text = i18n.t(f"copy_signal.pair_types.{pair_type_key}", req_locale)
+    pair_side_text = i18n.t(f"common.sides.{signal.pair_side}", req_locale)
+    margin_type_text = i18n.t(f"common.margin_types.{signal.pair_margin_type}", req_locale)
+
+    # 決定標題
+    title_key = "copy_signal.title_open" if pair_type_key == "buy" else "copy_signal.title_close"
+    title = i18n.render(title_key, req_locale, {"trader_name": data["trader_name"]})
+
+    # 根據 jump 決定是否顯示連結
+    detail_line = i18n.render(
+        "common.detail_line", req_locale,
+        {"trader_name": data['trader_name'], "url": data['trader_detail_url']}
+    ) if include_link else ""
+
+    body = i18n.render(
+        "copy_signal.body", req_locale,
+        {
+            "pair": signal.pair,
+            "margin_type": margin_type_text,
+            "leverage": format_float(signal.pair_leverage),
+            "time_label": i18n.t("common.labels.time", req_locale),
+            "time": formatted_time,
+            "direction_label": i18n.t("common.labels.direction", req_locale),
+            "pair_type": pair_type_text,
+            "pair_side": pair_side_text,
+            "entry_price_label": i18n.t("common.labels.entry_price", req_locale),
+            "price": data["price"],
+            "detail_line": detail_line
+        }
+    )
+
+    return f"{title}\n\n{body}"
+
+async def send_discord_message_with_image(bot, channel_id: int, text: str, image_path: str, topic_id: str = "") -> None:
+    """發送帶圖片的 Discord 消息；topic 設定為 webhook 時優先經由 webhook 發送"""
     logger.info(f"[CopySignal] 開始發送消息到頻道 {channel_id}")
     try:
-        channel = bot.get_channel(channel_id)
-        if not channel:
+        if use_webhook(topic_id):
+            if await webhook_registry.send(bot, channel_id, PRIORITY_SIGNAL, text, image_path, "trader.png"):
+                logger.info(f"[CopySignal] 已經由 webhook 發送到頻道 {channel_id}")
+                return
+
+        # 頻道與權限取自快取，權限變更時由事件清除
+        access = channel_access.get(bot, channel_id)
+        if not access:
             logger.warning(f"[CopySignal] 找不到頻道 {channel_id}")
             return
+        channel = access.channel
 
-        logger.info(f"[CopySignal] 找到頻道: {channel.name} (ID: {channel_id})")
-
-        # 檢查權限
-        permissions = channel.permissions_for(channel.guild.me)
-        logger.info(f"[CopySignal] 頻道權限檢查 - 發送消息: {permissions.send_messages}, 附加文件: {permissions.attach_files}")
-        
-        if not permissions.send_messages:
+        if not access.can_send:
             logger.warning(f"[CopySignal] 在頻道 {channel_id} 中沒有發送消息的權限")
             return
 
@@ -201,13 +186,16 @@ async def send_discord_message_with_image(bot, channel_id: int, text: str, image
                 logger.warning(f"[CopySignal] 圖片文件不存在: {image_path}")
                 image_path = None
 
-        if image_path and permissions.attach_files:
+        if image_path and access.can_attach:
             logger.info(f"[CopySignal] 發送帶圖片的消息到頻道 {channel_id}")
-            discord_file = discord.File(image_path, filename="trader.png")
-            await channel.send(content=text, file=discord_file, allowed_mentions=discord.AllowedMentions.none())
+            await deliver(PRIORITY_SIGNAL, channel_id, lambda: channel.send(
+                content=text,
+                file=discord.File(image_path, filename="trader.png"),
+                allowed_mentions=discord.AllowedMentions.none()
+            ))
         else:
             logger.info(f"[CopySignal] 發送純文字消息到頻道 {channel_id}")
-            await channel.send(content=text, allowed_mentions=discord.AllowedMentions.none())
+            await deliver(PRIORITY_SIGNAL, channel_id, lambda: channel.send(content=text, allowed_mentions=discord.AllowedMentions.none()))
 
         logger.info(f"[CopySignal] 成功發送到 Discord 頻道 {channel_id}")
 
@@ -237,7 +225,7 @@ async def handle_send_copy_signal(request: Request, bot) -> Dict:
 
     # 解析 JSON
     try:
-        data = await request.json()
+        data = parse_json(await request.body())
         logger.info(f"[CopySignal] 成功解析 JSON 數據: {list(data.keys())}")
     except Exception as e:
         logger.error(f"[CopySignal] JSON 解析失敗: {e}")
@@ -245,19 +233,44 @@ async def handle_send_copy_signal(request: Request, bot) -> Dict:
 
     # 資料驗證
     try:
-        validate_copy_signal(data)
+        signal = validate_copy_signal(data)
         logger.info("[CopySignal] 數據驗證通過")
     except ValueError as err:
         logger.error(f"[CopySignal] 數據驗證失敗: {err}")
         return {"status": "400", "message": str(err)}
 
+    # 冪等：時間窗內的重複請求（上游重試）直接忽略
+    dedup_key = copy_signal_dedup_key(signal)
+    if dedup_window.seen("copy_signal", dedup_key):
+        logger.info(f"[CopySignal] 重複請求，已忽略: {dedup_key}")
+        return {"status": "200", "message": "重複請求，已忽略"}
+
     # 背景處理：在 Discord 事件迴圈執行
     logger.info("[CopySignal] 開始背景處理，調度到 Discord 事件迴圈")
     try:
-        asyncio.run_coroutine_threadsafe(process_copy_signal_discord(data, bot), bot.loop)
+        signal_id = outbox.record("copy_signal", data)
+        trader_uid = signal.trader_uid
+        flush_pending_scalps(trader_uid, bot)
+        rejected = ingest_queues.submit(
+            "copy_signal", lambda: outbox.track(signal_id, process_copy_signal_discord(data, bot, signal=signal)), key=trader_uid
+        )
+        if rejected:
+            logger.warning(f"[CopySignal] 處理佇列已滿或尚未就緒 ({rejected})，拒絕請求")
+            outbox.complete(signal_id)
+            dedup_window.forget("copy_signal", dedup_key)
+            return ingest_queues.reject_response(rejected)
         logger.info("[CopySignal] 成功調度背景任務")
     except Exception as e:
         logger.error(f"[CopySignal] 調度背景任務失敗: {e}")
+        dedup_window.forget("copy_signal", dedup_key)
         return {"status": "500", "message": "Internal server error"}
     
-    return {"status": "200", "message": "接收成功，稍後發送"} 
\ No newline at end of file
+    return {"status": "200", "message": "接收成功，稍後發送"}
+
+
+async def handle_send_copy_signal_batch(request: Request, bot) -> Dict:
+    """處理 /api/discord/copy_signal/batch 介面：訊號陣列逐筆驗證，依交易員分組排入有序 lane"""
+    return await handle_batch(
+        "copy_signal", validate_copy_signal, copy_signal_dedup_key, process_copy_signal_discord, request, bot,
+        before_submit=lambda trader_uid: flush_pending_scalps(trader_uid, bot),
+    )
@@ -0,0 +1,82 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 相同請求在此時間窗（秒）內重複送達時直接忽略
+DEDUP_WINDOW_SECONDS = float(os.getenv("DEDUP_WINDOW_SECONDS", "300"))
+# 最多記住的請求數，超過時淘汰最舊的
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "50000"))
+
+
+def payload_digest(data: Any) -> str:
+    """沒有自然鍵的請求以正規化後的內容摘要作為鍵"""
+    blob = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+
+class DedupWindow:
+    """依時間排序的有界 LRU：記錄時間窗內見過的 (endpoint, key)。
+
+    時間窗固定，插入順序即到期順序，清理只需從最舊的一端開始。
+    """
+
+    def __init__(self, window: float = DEDUP_WINDOW_SECONDS, max_entries: int = DEDUP_MAX_ENTRIES):
+        self.window = window
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, Hashable], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits: Dict[str, int] = {}
+        self.accepted: Dict[str, int] = {}
+        self.evicted = 0
+
+    def _purge(self, now: float) -> None:
+        while self._entries:
+            key, expires = next(iter(self._entries.items()))
+            if expires > now:
+                break
+            self._entries.popitem(last=False)
+
+    def seen(self, endpoint: str, key: Hashable) -> bool:
+        """若時間窗內已收過相同請求回傳 True；否則記錄並回傳 False"""
+        if self.window <= 0:
+            return False
+        now = time.monotonic()
+        entry = (endpoint, key)
+        with self._lock:
+            self._purge(now)
+            if entry in self._entries:
+                self.hits[endpoint] = self.hits.get(endpoint, 0) + 1
+                return True
+            self._entries[entry] = now + self.window
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+            self.accepted[endpoint] = self.accepted.get(endpoint, 0) + 1
+        return False
+
+    def forget(self, endpoint: str, key: Hashable) -> None:
+        """請求未成功排入處理時移除記錄，讓上游重試不被當成重複"""
+        with self._lock:
+            self._entries.pop((endpoint, key), None)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "window_seconds": self.window,
+                "entries": len(self._entries),
+                "evicted": self.evicted,
+                "hits": dict(self.hits),
+                "accepted": dict(self.accepted),
+                "total_hits": sum(self.hits.values()),
+            }
+
+
+dedup_window = DedupWindow()
@@ -0,0 +1,236 @@
+import os
+import time
+import asyncio
+import itertools
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from .outbox import outbox
+from .channel_health import channel_health
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 優先級（數字越小越優先）
+PRIORITY_SIGNAL = 0    # copy signal、止盈止損更新
+PRIORITY_SUMMARY = 1   # 交易總結
+PRIORITY_REPORT = 2    # 持倉報告、週報
+PRIORITY_BULK = 3      # 文章、公告
+
+PRIORITY_NAMES = {
+    PRIORITY_SIGNAL: "signal",
+    PRIORITY_SUMMARY: "summary",
+    PRIORITY_REPORT: "report",
+    PRIORITY_BULK: "bulk",
+}
+
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "16"))
+# Discord 全域上限為 50 req/s，預留餘量
+DISCORD_GLOBAL_RATE = float(os.getenv("DISCORD_GLOBAL_RATE", "45"))
+# 每頻道約 5 則 / 5 秒
+DISCORD_CHANNEL_BURST = float(os.getenv("DISCORD_CHANNEL_BURST", "5"))
+DISCORD_CHANNEL_RATE = float(os.getenv("DISCORD_CHANNEL_RATE", "1"))
+
+
+class TokenBucket:
+    """簡單 token bucket：rate 為每秒補充量，capacity 為突發上限"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """距離可取得一個 token 的秒數，0 表示可立即取得"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self._refill()
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ("priority", "route", "factory", "future", "enqueued_at")
+
+    def __init__(self, priority: int, route: str, factory: Callable[[], Awaitable[Any]], future: asyncio.Future):
+        self.priority = priority
+        self.route = route
+        self.factory = factory
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class DeliveryScheduler:
+    """集中式 Discord 發送排程器。
+
+    - 依優先級出隊，訊號類永遠先於報告與公告
+    - 以 token bucket 追蹤全域與各路由（頻道）額度，額度不足的路由等待補充，不佔用 worker
+    - 同一路由依提交順序逐一發送，確保頻道內訊息順序
+    - 統計各優先級的佇列深度與等待時間
+    """
+
+    def __init__(self, workers: int = DELIVERY_WORKERS, global_rate: float = DISCORD_GLOBAL_RATE,
+                 route_rate: float = DISCORD_CHANNEL_RATE, route_burst: float = DISCORD_CHANNEL_BURST):
+        self.workers = workers
+        self.route_rate = route_rate
+        self.route_burst = route_burst
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets: Dict[str, TokenBucket] = {}
+        # 每個路由等待中的工作（FIFO）
+        self._pending: Dict[str, deque] = {}
+        # 已有工作在就緒佇列、執行中或等待額度補充的路由
+        self._active_routes: set = set()
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._seq = itertools.count()
+        self.stats = {
+            name: {"depth": 0, "sent": 0, "failed": 0, "wait_total": 0.0, "wait_max": 0.0}
+            for name in PRIORITY_NAMES.values()
+        }
+
+    def _ensure_started(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            logger.info(f"[Delivery] 發送排程器已啟動: {self.workers} 個 worker")
+
+    def _bucket(self, route: str) -> TokenBucket:
+        bucket = self._buckets.get(route)
+        if bucket is None:
+            bucket = TokenBucket(self.route_rate, self.route_burst)
+            self._buckets[route] = bucket
+        return bucket
+
+    def _pump(self, route: str) -> None:
+        """將路由的下一個工作送入就緒佇列（每路由同時最多一個）"""
+        if route in self._active_routes or self._queue is None:
+            return
+        pending = self._pending.get(route)
+        while pending and pending[0].future.done():
+            # 呼叫者已取消（例如超時），不再發送
+            self.stats[PRIORITY_NAMES[pending.popleft().priority]]["depth"] -= 1
+        if not pending:
+            self._pending.pop(route, None)
+            return
+
+        bucket = self._bucket(route)
+        wait = bucket.delay()
+        self._active_routes.add(route)
+        if wait > 0:
+            asyncio.get_running_loop().call_later(wait, self._wake, route)
+            return
+        bucket.take()
+        job = pending.popleft()
+        self._queue.put_nowait((job.priority, next(self._seq), job))
+
+    def _wake(self, route: str) -> None:
+        self._active_routes.discard(route)
+        self._pump(route)
+
+    async def submit(self, priority: int, route: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """排入一次發送並等待結果；factory 於輪到時才被呼叫，例外原樣拋回呼叫者"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(priority, route, factory, future)
+        self.stats[PRIORITY_NAMES[priority]]["depth"] += 1
+        self._pending.setdefault(route, deque()).append(job)
+        self._pump(route)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+    async def _execute(self, job: _Job) -> None:
+        stats = self.stats[PRIORITY_NAMES[job.priority]]
+        stats["depth"] -= 1
+        if job.future.done():
+            return
+
+        global_wait = self._global.delay()
+        if global_wait > 0:
+            await asyncio.sleep(global_wait)
+        self._global.take()
+
+        waited = time.monotonic() - job.enqueued_at
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+
+        try:
+            result = await job.factory()
+        except Exception as e:
+            stats["failed"] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            stats["sent"] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, job = await self._queue.get()
+            try:
+                await self._execute(job)
+            finally:
+                self._active_routes.discard(job.route)
+                self._pump(job.route)
+
+    async def stop(self) -> None:
+        for task in self._worker_tasks:
+            task.cancel()
+        self._worker_tasks = []
+        self._queue = None
+        for pending in self._pending.values():
+            for job in pending:
+                job.future.cancel()
+        self._pending.clear()
+        self._active_routes.clear()
+
+    def get_stats(self) -> dict:
+        result = {}
+        for name, stats in self.stats.items():
+            done = stats["sent"] + stats["failed"]
+            result[name] = {
+                "depth": stats["depth"],
+                "sent": stats["sent"],
+                "failed": stats["failed"],
+                "avg_wait_ms": round(stats["wait_total"] / done * 1000, 1) if done else 0.0,
+                "max_wait_ms": round(stats["wait_max"] * 1000, 1),
+            }
+        return result
+
+
+delivery_scheduler = DeliveryScheduler()
+
+
+async def deliver(priority: int, channel_id: int, send: Callable[[], Awaitable[Any]]) -> Any:
+    """經由排程器發送到指定頻道，send 為實際呼叫 channel.send 的無參函式。
+
+    在 outbox 追蹤的訊號中，已送達的頻道直接跳過（回傳 None），成功後記錄送達；
+    頻道失效類錯誤計入頻道健康度。
+    """
+    target = outbox.begin_delivery(channel_id)
+    if target is None:
+        return None
+    try:
+        result = await delivery_scheduler.submit(priority, f"channel:{channel_id}", send)
+    except Exception as e:
+        channel_health.record_error(channel_id, e)
+        raise
+    channel_health.record_success(channel_id)
+    outbox.mark_delivered(target)
+    return result
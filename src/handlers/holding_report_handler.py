@@ -1,21 +1,34 @@
 import os
 import asyncio
 import logging
-from typing import Dict
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from fastapi import Request
 import discord
 from dotenv import load_dotenv
 
 from .common import (
-    get_push_targets, format_float, get_i18n, normalize_locale
+    get_push_targets, format_float, get_i18n, normalize_locale,
+    group_targets_for_render, pack_message_blocks
 )
+from .outbox import outbox
+from .schemas import parse_json, HoldingInfo
+from .ingest import ingest_queues, INGEST_RETRY_AFTER_SECONDS
+from .dedup import dedup_window, payload_digest
+from .channel_access import channel_access
+from .channel_health import can_deliver
+from .delivery import deliver, PRIORITY_REPORT
+from .report_index import holding_report_index, text_digest
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# NDJSON 串流介面單行（單一交易員）的位元組上限
+HOLDING_STREAM_MAX_LINE_BYTES = int(os.getenv("HOLDING_STREAM_MAX_LINE_BYTES", str(1024 * 1024)))
+# NDJSON 串流介面回應中逐行列出的錯誤上限，超過的部分只計數
+HOLDING_STREAM_MAX_ERRORS = int(os.getenv("HOLDING_STREAM_MAX_ERRORS", "100"))
+
 def validate_holding_report(data) -> None:
-    print(f"[HoldingReport] validate_holding_report called, data={data}")
     """支持批量trader+infos结构的校验"""
     # 兼容 {"data": [...]} 的包裝格式
     if isinstance(data, dict) and isinstance(data.get("data"), list):
@@ -51,49 +64,9 @@ def validate_holding_report(data) -> None:
     else:
         raise ValueError("請求資料必須為字典或列表格式")
 
-def validate_single_holding_report(data: dict, prefix: str = "") -> None:
+def validate_single_holding_report(data: dict, prefix: str = "") -> HoldingInfo:
     """驗證單個持倉報告項目（只校验币种相关字段）"""
-    required_fields = {
-        "pair", "pair_side", "pair_margin_type", "pair_leverage",
-        "entry_price", "current_price", "unrealized_pnl_percentage"
-    }
-    missing = [f for f in required_fields if not data.get(f)]
-    if missing:
-        error_msg = f"缺少欄位: {', '.join(missing)}"
-        if prefix:
-            error_msg = f"{prefix} - {error_msg}"
-        raise ValueError(error_msg)
-
-    # 檢查 pair_side
-    if str(data["pair_side"]) not in {"1", "2"}:
-        error_msg = "pair_side 只能是 '1'(Long) 或 '2'(Short)"
-        if prefix:
-            error_msg = f"{prefix} - {error_msg}"
-        raise ValueError(error_msg)
-
-    # 檢查 pair_margin_type
-    if str(data["pair_margin_type"]) not in {"1", "2"}:
-        error_msg = "pair_margin_type 只能是 '1'(Cross) 或 '2'(Isolated)"
-        if prefix:
-            error_msg = f"{prefix} - {error_msg}"
-        raise ValueError(error_msg)
-
-    # 數值檢查
-    try:
-        float(data["entry_price"])
-        float(data["current_price"])
-        float(data["unrealized_pnl_percentage"])
-        float(data["pair_leverage"])
-        # 檢查可選的止盈止損價格
-        if data.get("tp_price") not in (None, "", "None"):
-            float(data["tp_price"])
-        if data.get("sl_price") not in (None, "", "None"):
-            float(data["sl_price"])
-    except (TypeError, ValueError):
-        error_msg = "數值欄位必須為數字格式"
-        if prefix:
-            error_msg = f"{prefix} - {error_msg}"
-        raise ValueError(error_msg)
+    return HoldingInfo.check(data, f"{prefix} - " if prefix else "")
 
 async def process_holding_report_discord(data: dict, bot) -> None:
     """背景協程：處理持倉報告推送到 Discord，支援多trader，每個trader合併所有infos發一條訊息"""
@@ -132,49 +105,52 @@ async def process_holding_report_discord(data: dict, bot) -> None:
 
 async def send_holding_to_all_targets(infos, trader, push_targets, bot):
     tasks = []
-    for channel_id, topic_id, jump, channel_lang in push_targets:
-        # 根據 jump 值決定是否包含連結
-        include_link = (jump == "1")
-        
+    # 同語言、同連結設定的頻道只渲染一次
+    for (locale, include_link), targets in group_targets_for_render(push_targets).items():
         if infos and isinstance(infos, list):
             logger.info(f"[HoldingReport] infos 長度: {len(infos)}")
-            # 合併所有 infos，發一條訊息
-            text = format_holding_report_list_text(infos, trader, include_link, channel_lang)
+            # 合併所有 infos，超過字數上限時依持倉切成多則訊息
+            texts = format_holding_report_messages(infos, trader, include_link, locale)
         else:
             logger.info(f"[HoldingReport] 無 infos 或不是 list，使用單一持倉格式")
             # 沒有 infos，當作單一持倉
-            text = format_holding_report_text(trader, include_link, channel_lang)
-        
-        tasks.append(
-            send_discord_message(
-                bot=bot,
-                channel_id=channel_id,
-                text=text
+            texts = pack_message_blocks([format_holding_report_text(trader, include_link, locale)])
+
+        for channel_id, topic_id, jump, channel_lang in targets:
+            if not can_deliver(bot, channel_id):
+                continue
+            tasks.append(
+                send_discord_message(
+                    bot=bot,
+                    channel_id=channel_id,
+                    texts=texts,
+                    trader_uid=str(trader.get("trader_uid"))
+                )
             )
-        )
     await asyncio.gather(*tasks, return_exceptions=True)
 
-async def send_discord_message(bot, channel_id: int, text: str) -> None:
-    """發送 Discord 消息"""
+async def send_discord_message(bot, channel_id: int, texts: List[str], trader_uid: str = None) -> None:
+    """依序發送報告的各則 Discord 消息；啟用編輯模式時改為編輯該頻道上此交易員的上一份報告"""
     logger.info(f"[HoldingReport] 開始發送消息到頻道 {channel_id}")
     try:
-        channel = bot.get_channel(channel_id)
-        if not channel:
+        # 頻道與權限取自快取，權限變更時由事件清除
+        access = channel_access.get(bot, channel_id)
+        if not access:
             logger.warning(f"[HoldingReport] 找不到頻道 {channel_id}")
             return
+        channel = access.channel
 
-        logger.info(f"[HoldingReport] 找到頻道: {channel.name} (ID: {channel_id})")
-
-        # 檢查權限
-        permissions = channel.permissions_for(channel.guild.me)
-        logger.info(f"[HoldingReport] 頻道權限檢查 - 發送消息: {permissions.send_messages}")
-        
-        if not permissions.send_messages:
+        if not access.can_send:
             logger.warning(f"[HoldingReport] 在頻道 {channel_id} 中沒有發送消息的權限")
             return
 
-        logger.info(f"[HoldingReport] 發送消息到頻道 {channel_id}")
-        await channel.send(content=text, allowed_mentions=discord.AllowedMentions.none())
+        if holding_report_index.enabled and trader_uid:
+            await send_or_edit_report(channel, trader_uid, texts)
+            return
+
+        logger.info(f"[HoldingReport] 發送 {len(texts)} 則消息到頻道 {channel_id}")
+        for text in texts:
+            await deliver(PRIORITY_REPORT, channel_id, lambda: channel.send(content=text, allowed_mentions=discord.AllowedMentions.none()))
 
         logger.info(f"[HoldingReport] 成功發送到 Discord 頻道 {channel_id}")
 
@@ -187,6 +163,58 @@ async def send_discord_message(bot, channel_id: int, text: str) -> None:
         import traceback
         logger.error(f"[HoldingReport] 詳細錯誤: {traceback.format_exc()}")
 
+async def _delete_messages(channel, message_ids: List[int]) -> None:
+    """刪除舊報告訊息；與發送、編輯共用排程器的速率桶，已不存在的訊息略過"""
+    for message_id in message_ids:
+        message = channel.get_partial_message(message_id)
+        try:
+            await deliver(PRIORITY_REPORT, channel.id, message.delete)
+        except discord.HTTPException:
+            pass
+
+async def send_or_edit_report(channel, trader_uid: str, texts: List[str]) -> None:
+    """編輯索引中的上一份報告；內容未變則略過。
+
+    新報告則數不多於舊報告時逐則編輯並刪除多出的舊訊息；則數變多或舊訊息已被刪除時，
+    刪除舊訊息並依序重新發送，確保同一份報告的訊息連續且有序。
+    """
+    channel_id = channel.id
+    digest = text_digest("\n".join(texts))
+    entry = holding_report_index.get(channel_id, trader_uid)
+
+    if entry:
+        old_ids = entry["message_ids"]
+        if entry["digest"] == digest:
+            holding_report_index.stats["unchanged"] += 1
+            logger.info(f"[HoldingReport] 頻道 {channel_id} 交易員 {trader_uid} 持倉未變，略過")
+            return
+        if len(texts) <= len(old_ids):
+            try:
+                for message_id, text in zip(old_ids, texts):
+                    message = channel.get_partial_message(message_id)
+                    await deliver(PRIORITY_REPORT, channel_id, lambda: message.edit(content=text, allowed_mentions=discord.AllowedMentions.none()))
+            except discord.NotFound:
+                logger.info(f"[HoldingReport] 頻道 {channel_id} 的持倉報告已被刪除，重新發送")
+                holding_report_index.stats["recreated"] += 1
+            else:
+                await _delete_messages(channel, old_ids[len(texts):])
+                holding_report_index.put(channel_id, trader_uid, old_ids[:len(texts)], digest)
+                holding_report_index.stats["edited"] += 1
+                logger.info(f"[HoldingReport] 已編輯頻道 {channel_id} 的持倉報告 {old_ids[:len(texts)]}")
+                return
+        holding_report_index.drop(channel_id, trader_uid)
+        await _delete_messages(channel, old_ids)
+
+    message_ids = []
+    for text in texts:
+        message = await deliver(PRIORITY_REPORT, channel_id, lambda: channel.send(content=text, allowed_mentions=discord.AllowedMentions.none()))
+        if message is not None:
+            message_ids.append(message.id)
+    if len(message_ids) == len(texts):
+        holding_report_index.put(channel_id, trader_uid, message_ids, digest)
+        holding_report_index.stats["created"] += 1
+    logger.info(f"[HoldingReport] 成功發送 {len(texts)} 則消息到 Discord 頻道 {channel_id}")
+
 def format_holding_report_text(data: dict, include_link: bool = True, lang: str = None) -> str:
     """格式化持倉報告文本（i18n）"""
     i18n = get_i18n()
@@ -231,14 +259,13 @@ def format_holding_report_text(data: dict, include_link: bool = True, lang: str
 
     return text
 
-def format_holding_report_list_text(infos: list, trader: dict, include_link: bool = True, lang: str = None) -> str:
-    logger.info(f"[HoldingReport] format_holding_report_list_text called, infos={infos}")
-    if not infos:
-        return ""
+def render_holding_report_blocks(infos: list, trader: dict, include_link: bool = True, lang: str = None) -> Tuple[str, List[str], str]:
+    """渲染持倉報告的 (標題, 各持倉區塊, 詳情連結)，供組合或分則打包"""
     i18n = get_i18n()
     locale = normalize_locale(lang)
     trader_name = trader.get('trader_name', 'Trader')
-    text = i18n.render("holding.summary", locale, {"trader_name": trader_name}) + "\n\n"
+    header = i18n.render("holding.summary", locale, {"trader_name": trader_name})
+    blocks = []
     for i, data in enumerate(infos, 1):
         pair_side = i18n.t(f"common.sides.{str(data.get('pair_side',''))}", locale)
         margin_type = i18n.t(f"common.margin_types.{str(data.get('pair_margin_type',''))}", locale)
@@ -248,11 +275,11 @@ def format_holding_report_list_text(infos: list, trader: dict, include_link: boo
         leverage = format_float(data.get("pair_leverage", 0))
         has_tp = data.get("tp_price") not in (None, "None", "null", "")
         has_sl = data.get("sl_price") not in (None, "None", "null", "")
-        text += f"**{i}. {data.get('pair', '')} {margin_type} {leverage}X**\n"
-        text += i18n.render("holding.line_direction", locale, {"pair_side": pair_side}) + "\n"
-        text += i18n.render("holding.line_entry", locale, {"price": entry_price}) + "\n"
-        text += i18n.render("holding.line_current", locale, {"price": current_price}) + "\n"
-        text += i18n.render("holding.line_roi", locale, {"roi": roi})
+        block = f"**{i}. {data.get('pair', '')} {margin_type} {leverage}X**\n"
+        block += i18n.render("holding.line_direction", locale, {"pair_side": pair_side}) + "\n"
+        block += i18n.render("holding.line_entry", locale, {"price": entry_price}) + "\n"
+        block += i18n.render("holding.line_current", locale, {"price": current_price}) + "\n"
+        block += i18n.render("holding.line_roi", locale, {"roi": roi})
         tp_sl_lines = []
         if has_tp:
             tp_price = str(data.get("tp_price", 0))
@@ -261,13 +288,27 @@ def format_holding_report_list_text(infos: list, trader: dict, include_link: boo
             sl_price = str(data.get("sl_price", 0))
             tp_sl_lines.append(i18n.render("holding.sl", locale, {"price": sl_price}))
         if tp_sl_lines:
-            text += "\n" + "\n".join(tp_sl_lines)
-        text += "\n\n"
-    text = text.rstrip('\n')
+            block += "\n" + "\n".join(tp_sl_lines)
+        blocks.append(block.rstrip('\n'))
+    footer = ""
     if include_link:
         detail_url = trader.get('trader_detail_url', '')
-        text += "\n\n" + i18n.render("common.detail_line", locale, {"trader_name": trader_name, "url": detail_url})
-    return text
+        footer = i18n.render("common.detail_line", locale, {"trader_name": trader_name, "url": detail_url})
+    return header, blocks, footer
+
+def format_holding_report_list_text(infos: list, trader: dict, include_link: bool = True, lang: str = None) -> str:
+    logger.info(f"[HoldingReport] format_holding_report_list_text called, infos={infos}")
+    if not infos:
+        return ""
+    header, blocks, footer = render_holding_report_blocks(infos, trader, include_link, lang)
+    return "\n\n".join([header] + blocks + ([footer] if footer else []))
+
+def format_holding_report_messages(infos: list, trader: dict, include_link: bool = True, lang: str = None) -> List[str]:
+    """渲染持倉報告並打包為符合 Discord 字數上限的最少則數訊息，單一持倉不會被拆開"""
+    if not infos:
+        return []
+    header, blocks, footer = render_holding_report_blocks(infos, trader, include_link, lang)
+    return pack_message_blocks(blocks, header=header, footer=footer)
 
 async def handle_holding_report(request: Request, bot) -> Dict:
     """
@@ -286,7 +327,7 @@ async def handle_holding_report(request: Request, bot) -> Dict:
 
     # 解析 JSON
     try:
-        data = await request.json()
+        data = parse_json(await request.body())
         if isinstance(data, dict):
             logger.info(f"[HoldingReport] 成功解析 JSON 數據: {list(data.keys())}")
         elif isinstance(data, list):
@@ -308,13 +349,133 @@ async def handle_holding_report(request: Request, bot) -> Dict:
         logger.error(f"[HoldingReport] 數據驗證失敗: {err}")
         return {"status": "400", "message": str(err)}
 
+    # 冪等：時間窗內的重複請求（上游重試）直接忽略
+    dedup_key = payload_digest(normalized_data)
+    if dedup_window.seen("holding_report", dedup_key):
+        logger.info(f"[HoldingReport] 重複請求，已忽略: {dedup_key}")
+        return {"status": "200", "message": "重複請求，已忽略"}
+
     # 背景處理：在 Discord 事件迴圈執行
     logger.info("[HoldingReport] 開始背景處理，調度到 Discord 事件迴圈")
     try:
-        asyncio.run_coroutine_threadsafe(process_holding_report_discord(normalized_data, bot), bot.loop)
+        signal_id = outbox.record("holding_report", normalized_data)
+        rejected = ingest_queues.submit("holding_report", lambda: outbox.track(signal_id, process_holding_report_discord(normalized_data, bot)))
+        if rejected:
+            logger.warning(f"[HoldingReport] 處理佇列已滿或尚未就緒 ({rejected})，拒絕請求")
+            outbox.complete(signal_id)
+            dedup_window.forget("holding_report", dedup_key)
+            return ingest_queues.reject_response(rejected)
         logger.info("[HoldingReport] 成功調度背景任務")
     except Exception as e:
         logger.error(f"[HoldingReport] 調度背景任務失敗: {e}")
+        dedup_window.forget("holding_report", dedup_key)
         return {"status": "500", "message": "Internal server error"}
     
-    return {"status": "200", "message": "接收成功，稍後發送"} 
\ No newline at end of file
+    return {"status": "200", "message": "接收成功，稍後發送"}
+
+
+async def _iter_ndjson_lines(request: Request, max_line: int) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """逐塊讀取請求內容並切出完整的行，只保留尚未結束的最後一行；超過上限的行以 None 回報"""
+    buffer = b""
+    line_no = 0
+    oversized = False
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_no += 1
+            yield line_no, None if oversized or len(line) > max_line else line
+            oversized = False
+        if len(buffer) > max_line:
+            # 丟棄過長的行，直到下一個換行為止
+            buffer = b""
+            oversized = True
+    if buffer or oversized:
+        yield line_no + 1, None if oversized else buffer
+
+
+async def _submit_holding_trader(trader: dict, bot) -> Optional[int]:
+    """單一交易員排入持倉報告佇列；佇列已滿時短暫等待（對上游形成背壓），逾時則回傳狀態碼"""
+    signal_id = outbox.record("holding_report", trader)
+    deadline = asyncio.get_running_loop().time() + INGEST_RETRY_AFTER_SECONDS
+    while True:
+        rejected = ingest_queues.submit("holding_report", lambda: outbox.track(signal_id, process_holding_report_discord(trader, bot)))
+        if rejected != 429 or asyncio.get_running_loop().time() >= deadline:
+            break
+        await asyncio.sleep(0.05)
+    if rejected:
+        outbox.complete(signal_id)
+    return rejected
+
+
+async def handle_holding_report_stream(request: Request, bot) -> Dict:
+    """
+    處理 /api/report/holdings/stream 介面：
+    1. 接受 NDJSON（每行一個交易員），邊接收邊解析、驗證並排入背景處理，記憶體只保留目前這一行。
+    2. 失敗的行以行號回報（最多 HOLDING_STREAM_MAX_ERRORS 筆，其餘計入 errors_dropped），不影響其他行。
+    3. 有效的行全部因佇列已滿或尚未就緒而未能排入時，比照批次介面回傳 429/503 與 Retry-After。
+    """
+    logger.info("[HoldingReport] 開始處理串流持倉報告請求")
+
+    content_type = request.headers.get("content-type", "").split(";")[0].lower()
+    if content_type not in ("application/x-ndjson", "application/jsonl"):
+        logger.error(f"[HoldingReport] Content-Type 錯誤: {content_type}")
+        return {"status": "400", "message": "Content-Type must be application/x-ndjson"}
+
+    accepted = 0
+    duplicates = 0
+    errors = []
+    errors_dropped = 0
+    rejected = None
+
+    def add_error(line_no: int, status, message: str) -> None:
+        nonlocal errors_dropped
+        if len(errors) < HOLDING_STREAM_MAX_ERRORS:
+            errors.append({"line": line_no, "status": str(status), "message": message})
+        else:
+            errors_dropped += 1
+
+    async for line_no, line in _iter_ndjson_lines(request, HOLDING_STREAM_MAX_LINE_BYTES):
+        if line is None:
+            add_error(line_no, 400, f"Line too long (max {HOLDING_STREAM_MAX_LINE_BYTES} bytes)")
+            continue
+        if not line.strip():
+            continue
+        try:
+            trader = parse_json(line)
+            if not isinstance(trader, dict):
+                raise ValueError("每行必須為單一交易員的 JSON 物件")
+            validate_holding_report(trader)
+        except ValueError as err:
+            add_error(line_no, 400, str(err))
+            continue
+
+        dedup_key = payload_digest(trader)
+        if dedup_window.seen("holding_report", dedup_key):
+            duplicates += 1
+            continue
+        try:
+            rejected = await _submit_holding_trader(trader, bot)
+        except Exception as e:
+            logger.error(f"[HoldingReport] 調度背景任務失敗: {e}")
+            rejected = 500
+        if rejected:
+            dedup_window.forget("holding_report", dedup_key)
+            add_error(line_no, rejected, "Not queued, retry later")
+            continue
+        accepted += 1
+
+    logger.info(f"[HoldingReport] 串流接收完成：排入 {accepted}、重複 {duplicates}、失敗 {len(errors) + errors_dropped}")
+    if rejected and not accepted:
+        if rejected in (429, 503):
+            return ingest_queues.reject_response(rejected)
+        return {"status": "500", "message": "Internal server error"}
+    ok = accepted or duplicates or not (errors or errors_dropped)
+    return {
+        "status": "200" if ok else "400",
+        "message": "接收成功，稍後發送" if ok else "串流內沒有有效項目",
+        "accepted": accepted,
+        "duplicates": duplicates,
+        "errors": errors,
+        "errors_dropped": errors_dropped,
+    }
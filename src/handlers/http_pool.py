@@ -0,0 +1,75 @@
+import os
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 每個上游主機的連線上限與 keep-alive 設定
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "30"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+# 未指定 timeout 的請求使用的預設總時限（秒）
+HTTP_DEFAULT_TIMEOUT = float(os.getenv("HTTP_DEFAULT_TIMEOUT", "15"))
+
+
+def timeout(total: float) -> aiohttp.ClientTimeout:
+    """建立單次請求的 timeout 設定"""
+    return aiohttp.ClientTimeout(total=total)
+
+
+class SessionRegistry:
+    """依上游主機共用 aiohttp.ClientSession，避免每次請求重新做 DNS/TCP/TLS。
+
+    session 綁定建立時的事件迴圈，需在 bot 事件迴圈上使用。
+    """
+
+    def __init__(self):
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+
+    @staticmethod
+    def _host_key(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}".lower()
+
+    def get(self, url: str) -> aiohttp.ClientSession:
+        """取得 url 所屬主機的共用 session，不存在或已關閉時建立"""
+        key = self._host_key(url)
+        session = self._sessions.get(key)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT_PER_HOST,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            )
+            session = aiohttp.ClientSession(connector=connector, timeout=timeout(HTTP_DEFAULT_TIMEOUT))
+            self._sessions[key] = session
+            logger.info(f"[HttpPool] 建立共用 session: {key}")
+        return session
+
+    @asynccontextmanager
+    async def borrow(self, url: str):
+        """以 async with 取得共用 session，離開時不關閉"""
+        yield self.get(url)
+
+    async def start(self, urls: Iterable[Optional[str]]) -> None:
+        """啟動時預先為已知上游建立 session"""
+        for url in urls:
+            if url:
+                self.get(url)
+
+    async def close(self) -> None:
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            if not session.closed:
+                await session.close()
+
+
+http_sessions = SessionRegistry()
@@ -0,0 +1,339 @@
+import os
+import time
+import zlib
+import asyncio
+import logging
+import threading
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 佇列已滿時建議上游多久後重試（秒）
+INGEST_RETRY_AFTER_SECONDS = int(os.getenv("INGEST_RETRY_AFTER_SECONDS", "5"))
+
+# 各訊號類型預設的 (worker 數, 佇列上限)，可用 INGEST_<KIND>_WORKERS / INGEST_<KIND>_MAXSIZE 覆寫。
+# LANE_KINDS 不在此列：改由共用的 lane 處理，並發數與容量由 INGEST_LANES / INGEST_LANES_MAXSIZE 設定
+_DEFAULTS = {
+    "holding_report": (4, 200),
+    "weekly_report": (2, 100),
+}
+
+# 依 trader_uid 分配到有序 lane 的訊號類型：同一交易員的開倉、止盈止損更新與平倉總結依序送達
+LANE_KINDS = ("copy_signal", "scalp_update", "trade_summary")
+INGEST_LANES = int(os.getenv("INGEST_LANES", "32"))
+INGEST_LANES_MAXSIZE = int(os.getenv("INGEST_LANES_MAXSIZE", "2500"))
+# 熱門交易員統計的時間窗（秒）
+LANE_HOT_WINDOW_SECONDS = float(os.getenv("LANE_HOT_WINDOW_SECONDS", "300"))
+
+
+def call_on_loop(loop: asyncio.AbstractEventLoop, callback: Callable[..., Any], *args: Any) -> None:
+    """在目標事件迴圈上執行 callback：已在該迴圈上（單一事件迴圈模式）時直接呼叫，否則跨執行緒排程"""
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        callback(*args)
+    else:
+        loop.call_soon_threadsafe(callback, *args)
+
+
+class IngestQueue:
+    """單一訊號類型的有界佇列：FastAPI 端提交，bot 事件迴圈上的固定數量 worker 處理。
+
+    容量以執行緒安全的計數器控制，提交端不需等待事件迴圈即可判斷是否接受。
+    """
+
+    def __init__(self, kind: str, workers: int, maxsize: int):
+        self.kind = kind
+        self.workers = workers
+        self.maxsize = maxsize
+        self._size = 0
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.stats = {"accepted": 0, "dropped": 0, "processed": 0, "failed": 0,
+                      "enqueue_total": 0.0, "enqueue_max": 0.0, "wait_total": 0.0, "wait_max": 0.0}
+
+    def start(self) -> None:
+        """於 bot 事件迴圈上啟動 worker"""
+        if self._queue is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._queue = None
+        self._loop = None
+
+    def submit(self, factory: Callable[[], Awaitable[Any]], cost: int = 1) -> Optional[int]:
+        """從任意執行緒提交工作（佔用 cost 個名額）；接受回傳 None，拒絕時回傳應回應的 HTTP 狀態碼"""
+        started = time.perf_counter()
+        loop, queue = self._loop, self._queue
+        if loop is None or queue is None or loop.is_closed():
+            self.stats["dropped"] += 1
+            return 503
+        with self._lock:
+            if self._size + cost > self.maxsize:
+                self.stats["dropped"] += 1
+                return 429
+            self._size += cost
+        call_on_loop(loop, queue.put_nowait, (factory, cost, time.monotonic()))
+        elapsed = time.perf_counter() - started
+        self.stats["accepted"] += 1
+        self.stats["enqueue_total"] += elapsed
+        self.stats["enqueue_max"] = max(self.stats["enqueue_max"], elapsed)
+        return None
+
+    async def _worker(self) -> None:
+        while True:
+            factory, cost, enqueued_at = await self._queue.get()
+            waited = time.monotonic() - enqueued_at
+            self.stats["wait_total"] += waited
+            self.stats["wait_max"] = max(self.stats["wait_max"], waited)
+            try:
+                await factory()
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"[Ingest] {self.kind} 處理失敗: {type(e).__name__} - {e}")
+            finally:
+                with self._lock:
+                    self._size -= cost
+
+    def get_stats(self) -> dict:
+        accepted = self.stats["accepted"]
+        started = self.stats["processed"] + self.stats["failed"]
+        return {
+            "depth": self._size,
+            "maxsize": self.maxsize,
+            "workers": self.workers,
+            "accepted": accepted,
+            "dropped": self.stats["dropped"],
+            "processed": self.stats["processed"],
+            "failed": self.stats["failed"],
+            "avg_enqueue_us": round(self.stats["enqueue_total"] / accepted * 1e6, 1) if accepted else 0.0,
+            "max_enqueue_us": round(self.stats["enqueue_max"] * 1e6, 1),
+            "avg_wait_ms": round(self.stats["wait_total"] / started * 1000, 1) if started else 0.0,
+            "max_wait_ms": round(self.stats["wait_max"] * 1000, 1),
+        }
+
+
+class _Lane:
+    __slots__ = ("queue", "depth", "max_depth", "processed", "busy", "busy_since")
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.depth = 0
+        self.max_depth = 0
+        self.processed = 0
+        self.busy = 0.0
+        self.busy_since = 0.0
+
+
+class LanePool:
+    """依 crc32(trader_uid) 將工作分配到固定數量的 lane：lane 內依提交順序逐一執行，不同 lane 並行。
+
+    同一交易員的工作永遠落在同一個 lane，前一筆送達（或失敗）後才處理下一筆；
+    提交方式與 IngestQueue 相同，可從任意執行緒呼叫，總容量以執行緒安全的計數器控制。
+    """
+
+    def __init__(self, kinds: Tuple[str, ...], lanes: int, maxsize: int):
+        self.kinds = kinds
+        self.lanes = lanes
+        self.maxsize = maxsize
+        self._size = 0
+        # 已預留但尚未排入 lane 的名額（仍在合併時間窗內的工作）
+        self._reserved = 0
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lanes: List[_Lane] = []
+        self._tasks: List[asyncio.Task] = []
+        self._started_at = 0.0
+        self.stats = {kind: {"accepted": 0, "dropped": 0, "processed": 0, "failed": 0} for kind in kinds}
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        # 目前與上一個時間窗內各交易員的工作數
+        self._hot: Counter = Counter()
+        self._hot_prev: Counter = Counter()
+        self._hot_since = time.monotonic()
+
+    def lane_of(self, key: str) -> int:
+        return zlib.crc32(key.encode("utf-8")) % self.lanes
+
+    def start(self) -> None:
+        """於 bot 事件迴圈上為每個 lane 啟動一個 worker"""
+        if self._loop is not None:
+            return
+        self._lanes = [_Lane() for _ in range(self.lanes)]
+        self._tasks = [asyncio.create_task(self._worker(lane)) for lane in self._lanes]
+        self._started_at = time.monotonic()
+        # 最後才設定事件迴圈，提交端看到迴圈時 lane 已就緒
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._loop = None
+
+    def submit(self, kind: str, key: str, factory: Callable[[], Awaitable[Any]], cost: int = 1) -> Optional[int]:
+        """從任意執行緒提交工作（佔用 cost 個名額）；接受回傳 None，拒絕時回傳應回應的 HTTP 狀態碼"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            self.stats[kind]["dropped"] += 1
+            return 503
+        lane = self._lanes[self.lane_of(key)]
+        now = time.monotonic()
+        with self._lock:
+            if self._size + cost > self.maxsize:
+                self.stats[kind]["dropped"] += 1
+                return 429
+            self._size += cost
+            lane.depth += cost
+            lane.max_depth = max(lane.max_depth, lane.depth)
+            if now - self._hot_since >= LANE_HOT_WINDOW_SECONDS:
+                self._hot_prev, self._hot, self._hot_since = self._hot, Counter(), now
+            self._hot[key] += cost
+        call_on_loop(loop, lane.queue.put_nowait, (kind, factory, cost, now))
+        self.stats[kind]["accepted"] += 1
+        return None
+
+    def reserve(self, kind: str, cost: int = 1) -> Optional[int]:
+        """從任意執行緒預留 cost 個名額但不排入 lane；接受回傳 None，之後以 release 歸還"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            self.stats[kind]["dropped"] += 1
+            return 503
+        with self._lock:
+            if self._size + cost > self.maxsize:
+                self.stats[kind]["dropped"] += 1
+                return 429
+            self._size += cost
+            self._reserved += cost
+        return None
+
+    def release(self, cost: int = 1) -> None:
+        with self._lock:
+            self._size -= cost
+            self._reserved -= cost
+
+    async def _worker(self, lane: _Lane) -> None:
+        while True:
+            kind, factory, cost, enqueued_at = await lane.queue.get()
+            started = time.monotonic()
+            waited = started - enqueued_at
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            lane.busy_since = started
+            try:
+                await factory()
+                self.stats[kind]["processed"] += 1
+            except Exception as e:
+                self.stats[kind]["failed"] += 1
+                logger.error(f"[Ingest] {kind} 處理失敗: {type(e).__name__} - {e}")
+            finally:
+                lane.busy += time.monotonic() - started
+                lane.busy_since = 0.0
+                lane.processed += 1
+                with self._lock:
+                    self._size -= cost
+                    lane.depth -= cost
+
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        uptime = max(now - self._started_at, 1e-9) if self._started_at else 0.0
+        processed = sum(lane.processed for lane in self._lanes)
+        with self._lock:
+            hot = (self._hot_prev + self._hot).most_common(10)
+        return {
+            "lanes": self.lanes,
+            "depth": self._size,
+            "reserved": self._reserved,
+            "maxsize": self.maxsize,
+            "kinds": {kind: dict(stats) for kind, stats in self.stats.items()},
+            "avg_wait_ms": round(self.wait_total / processed * 1000, 1) if processed else 0.0,
+            "max_wait_ms": round(self.wait_max * 1000, 1),
+            # 各 lane 的佇列深度、歷史最大深度、已處理數與忙碌時間比例
+            "lane_depth": [lane.depth for lane in self._lanes],
+            "lane_max_depth": [lane.max_depth for lane in self._lanes],
+            "lane_processed": [lane.processed for lane in self._lanes],
+            "lane_busy_pct": [
+                round((lane.busy + (now - lane.busy_since if lane.busy_since else 0.0)) / uptime * 100, 1) if uptime else 0.0
+                for lane in self._lanes
+            ],
+            "hot_traders": [
+                {"trader_uid": key, "lane": self.lane_of(key), "events": count} for key, count in hot
+            ],
+            "hot_window_seconds": LANE_HOT_WINDOW_SECONDS,
+        }
+
+
+class IngestQueues:
+    def __init__(self):
+        self.lanes = LanePool(LANE_KINDS, INGEST_LANES, INGEST_LANES_MAXSIZE)
+        for kind in LANE_KINDS:
+            prefix = f"INGEST_{kind.upper()}"
+            for name in (f"{prefix}_WORKERS", f"{prefix}_MAXSIZE"):
+                if os.getenv(name) is not None:
+                    logger.warning(f"[Ingest] {name} 已不再使用，{kind} 改由共用 lane 處理，請改設 INGEST_LANES / INGEST_LANES_MAXSIZE")
+        self.queues: Dict[str, IngestQueue] = {}
+        for kind, (workers, maxsize) in _DEFAULTS.items():
+            prefix = f"INGEST_{kind.upper()}"
+            self.queues[kind] = IngestQueue(
+                kind,
+                int(os.getenv(f"{prefix}_WORKERS", str(workers))),
+                int(os.getenv(f"{prefix}_MAXSIZE", str(maxsize))),
+            )
+
+    def start(self) -> None:
+        self.lanes.start()
+        for queue in self.queues.values():
+            queue.start()
+
+    async def stop(self) -> None:
+        await self.lanes.stop()
+        for queue in self.queues.values():
+            await queue.stop()
+
+    def submit(self, kind: str, factory: Callable[[], Awaitable[Any]], key: Optional[str] = None,
+               cost: int = 1) -> Optional[int]:
+        """LANE_KINDS 依 key（trader_uid）排入有序 lane，其餘類型排入各自的佇列；批次工作以項目數計入容量"""
+        if kind in self.lanes.kinds:
+            return self.lanes.submit(kind, key or "", factory, cost)
+        return self.queues[kind].submit(factory, cost)
+
+    def reserve(self, kind: str, cost: int = 1) -> Optional[int]:
+        """為暫不排入的 LANE_KINDS 工作（例如合併時間窗內的更新）預留容量，回傳值同 submit"""
+        return self.lanes.reserve(kind, cost)
+
+    def release(self, kind: str, cost: int = 1) -> None:
+        """歸還 reserve 預留的名額"""
+        self.lanes.release(cost)
+
+    @staticmethod
+    def reject_response(status_code: int) -> JSONResponse:
+        """佇列已滿回 429、尚未就緒回 503，皆附 Retry-After"""
+        message = "Too many requests, retry later" if status_code == 429 else "Service not ready, retry later"
+        return JSONResponse(
+            status_code=status_code,
+            content={"status": str(status_code), "message": message},
+            headers={"Retry-After": str(INGEST_RETRY_AFTER_SECONDS)},
+        )
+
+    def get_stats(self) -> dict:
+        return {"lanes": self.lanes.get_stats(), **{kind: queue.get_stats() for kind, queue in self.queues.items()}}
+
+
+ingest_queues = IngestQueues()
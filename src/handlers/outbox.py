@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import asyncio
+import logging
+import threading
+import contextvars
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 本地 outbox 資料庫，設為空字串可停用
+OUTBOX_PATH = os.getenv(
+    "OUTBOX_PATH",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'outbox.sqlite3'))
+)
+# 寫入批次的最長等待時間（秒），同一批次只 commit / fsync 一次
+OUTBOX_FLUSH_INTERVAL = float(os.getenv("OUTBOX_FLUSH_INTERVAL", "0.05"))
+# 超過此時間（秒）的未完成訊號重啟後不再補發，避免推送過時的交易訊號
+OUTBOX_REPLAY_MAX_AGE = float(os.getenv("OUTBOX_REPLAY_MAX_AGE", "900"))
+# 已完成訊號的保留時間（秒）
+OUTBOX_RETENTION_SECONDS = float(os.getenv("OUTBOX_RETENTION_SECONDS", "86400"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS signals (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    done_at REAL
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    signal_id TEXT NOT NULL,
+    target TEXT NOT NULL,
+    delivered_at REAL NOT NULL,
+    PRIMARY KEY (signal_id, target)
+);
+CREATE INDEX IF NOT EXISTS idx_signals_pending ON signals (done_at);
+"""
+
+
+class _Tracking:
+    """單一訊號在推送過程中的狀態：已送達的目標與各頻道的發送序號"""
+    __slots__ = ("signal_id", "delivered", "counters")
+
+    def __init__(self, signal_id: str, delivered: Iterable[str] = ()):
+        self.signal_id = signal_id
+        self.delivered: Set[str] = set(delivered)
+        self.counters: Dict[int, int] = {}
+
+    def next_target(self, channel_id: int) -> str:
+        # 同一訊號可能對同一頻道發送多則訊息，以序號區分
+        n = self.counters.get(channel_id, 0)
+        self.counters[channel_id] = n + 1
+        return f"{channel_id}:{n}"
+
+
+_current: contextvars.ContextVar[Optional[_Tracking]] = contextvars.ContextVar("outbox_tracking", default=None)
+
+
+class Outbox:
+    """以 SQLite (WAL) 記錄已接收的訊號與各頻道送達狀態，重啟後補發未完成的推送。
+
+    - record / mark 僅放入佇列，由背景執行緒批次寫入，不阻塞請求與事件迴圈
+    - 推送時透過 contextvar 追蹤目前訊號，deliver() 依此跳過已送達的頻道並記錄新送達
+    """
+
+    def __init__(self, path: Optional[str] = OUTBOX_PATH, flush_interval: float = OUTBOX_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Optional[Tuple[str, tuple]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.stats = {"recorded": 0, "delivered": 0, "completed": 0, "replayed": 0, "expired": 0,
+                      "skipped": 0, "batches": 0, "write_errors": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def _ensure_writer(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._writer, name="outbox-writer", daemon=True)
+                self._thread.start()
+
+    def _writer(self) -> None:
+        conn = self._connect()
+        conn.execute("DELETE FROM deliveries WHERE signal_id IN (SELECT id FROM signals WHERE done_at < ?)",
+                     (time.time() - OUTBOX_RETENTION_SECONDS,))
+        conn.execute("DELETE FROM signals WHERE done_at < ?", (time.time() - OUTBOX_RETENTION_SECONDS,))
+        conn.commit()
+        stopping = False
+        while not stopping:
+            op = self._queue.get()
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if op is None:
+                    stopping = True
+                else:
+                    batch.append(op)
+                remaining = deadline - time.monotonic()
+                if stopping or remaining <= 0:
+                    break
+                try:
+                    op = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if not batch:
+                continue
+            try:
+                with conn:
+                    for sql, params in batch:
+                        conn.execute(sql, params)
+                self.stats["batches"] += 1
+            except Exception as e:
+                self.stats["write_errors"] += 1
+                logger.error(f"[Outbox] 批次寫入失敗 ({len(batch)} 筆): {type(e).__name__} - {e}")
+        conn.close()
+
+    def _put(self, sql: str, params: tuple) -> None:
+        self._ensure_writer()
+        self._queue.put((sql, params))
+
+    def record(self, kind: str, payload: dict) -> Optional[str]:
+        """記錄一則已接收的訊號，回傳 signal_id（可於任何執行緒呼叫）"""
+        if not self.enabled:
+            return None
+        signal_id = uuid.uuid4().hex
+        self._put("INSERT INTO signals (id, kind, payload, created_at) VALUES (?, ?, ?, ?)",
+                  (signal_id, kind, json.dumps(payload, ensure_ascii=False), time.time()))
+        self.stats["recorded"] += 1
+        return signal_id
+
+    async def track(self, signal_id: Optional[str], coro: Awaitable[Any], delivered: Iterable[str] = ()) -> Any:
+        """在追蹤 signal_id 的情境下執行推送協程，結束後標記完成。
+
+        追蹤狀態在結束時還原，長駐的 worker 接著處理的工作不會沿用上一筆訊號的追蹤。
+        """
+        token = _current.set(_Tracking(signal_id, delivered) if signal_id is not None else None)
+        try:
+            return await coro
+        finally:
+            _current.reset(token)
+            self.complete(signal_id)
+
+    def complete(self, signal_id: Optional[str]) -> None:
+        """標記訊號已處理完成（例如被合併到其他訊號一起發送）"""
+        if signal_id is None:
+            return
+        self._put("UPDATE signals SET done_at = ? WHERE id = ?", (time.time(), signal_id))
+        self.stats["completed"] += 1
+
+    def begin_delivery(self, channel_id: int) -> Optional[str]:
+        """取得本次發送在目前訊號中的目標鍵；已送達時回傳 None 表示應跳過"""
+        tracking = _current.get()
+        if tracking is None:
+            return ""
+        target = tracking.next_target(channel_id)
+        if target in tracking.delivered:
+            self.stats["skipped"] += 1
+            return None
+        return target
+
+    def release_delivery(self, channel_id: int) -> None:
+        """撤銷最近一次 begin_delivery（改以其他方式發送同一則訊息時使用）"""
+        tracking = _current.get()
+        if tracking is not None and tracking.counters.get(channel_id):
+            tracking.counters[channel_id] -= 1
+
+    def mark_delivered(self, target: str) -> None:
+        tracking = _current.get()
+        if tracking is None or not target:
+            return
+        tracking.delivered.add(target)
+        self._put("INSERT OR IGNORE INTO deliveries (signal_id, target, delivered_at) VALUES (?, ?, ?)",
+                  (tracking.signal_id, target, time.time()))
+        self.stats["delivered"] += 1
+
+    def _load_pending(self) -> List[Tuple[str, str, str, float, List[str]]]:
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT id, kind, payload, created_at FROM signals WHERE done_at IS NULL ORDER BY created_at"
+            ).fetchall()
+            pending = []
+            for signal_id, kind, payload, created_at in rows:
+                targets = [t for (t,) in conn.execute("SELECT target FROM deliveries WHERE signal_id = ?", (signal_id,))]
+                pending.append((signal_id, kind, payload, created_at, targets))
+            return pending
+        finally:
+            conn.close()
+
+    def _replay_job(self, signal_id: str, processor: Callable[[Any], Awaitable[Any]], data: Any,
+                    delivered: Iterable[str]) -> Callable[[], Awaitable[Any]]:
+        return lambda: self.track(signal_id, processor(data), delivered)
+
+    async def replay(self, processors: Dict[str, Callable[[Any], Awaitable[Any]]],
+                     submit: Callable[[str, Any, Callable[[], Awaitable[Any]]], Optional[int]]) -> int:
+        """補發上次執行未完成的訊號（已送達的頻道會跳過），回傳補發數量。
+
+        依 created_at 順序交給 submit(kind, data, factory) 排入處理佇列，與即時訊號共用順序與容量限制；
+        submit 回傳 429 時等待佇列騰出空間，其他拒絕則停止補發，剩餘訊號留待下次啟動。
+        """
+        if not self.enabled:
+            return 0
+        try:
+            pending = await asyncio.to_thread(self._load_pending)
+        except Exception as e:
+            logger.error(f"[Outbox] 讀取未完成訊號失敗: {type(e).__name__} - {e}")
+            return 0
+
+        replayed = 0
+        now = time.time()
+        for signal_id, kind, payload, created_at, delivered in pending:
+            processor = processors.get(kind)
+            if processor is None or now - created_at > OUTBOX_REPLAY_MAX_AGE:
+                self._put("UPDATE signals SET done_at = ? WHERE id = ?", (now, signal_id))
+                self.stats["expired"] += 1
+                logger.warning(f"[Outbox] 放棄補發 {kind} 訊號 {signal_id}（過期或無對應處理器）")
+                continue
+            data = json.loads(payload)
+            job = self._replay_job(signal_id, processor, data, delivered)
+            while True:
+                rejected = submit(kind, data, job)
+                if rejected != 429:
+                    break
+                await asyncio.sleep(0.05)
+            if rejected:
+                logger.warning(f"[Outbox] 處理佇列尚未就緒 ({rejected})，停止補發，剩餘訊號留待下次啟動")
+                break
+            replayed += 1
+        self.stats["replayed"] += replayed
+        if pending:
+            logger.info(f"[Outbox] 重新推送 {replayed}/{len(pending)} 個未完成訊號")
+        return replayed
+
+    def close(self) -> None:
+        """送出剩餘寫入並停止背景執行緒"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(None)
+        thread.join(timeout=5)
+        self._thread = None
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "enabled": self.enabled, "queued_writes": self._queue.qsize()}
+
+
+outbox = Outbox()
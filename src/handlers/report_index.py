@@ -0,0 +1,96 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 持倉報告改為編輯同一則訊息（預設關閉，維持每次發新訊息）
+HOLDING_REPORT_EDIT_IN_PLACE = os.getenv("HOLDING_REPORT_EDIT_IN_PLACE", "false").lower() in ("1", "true", "yes")
+HOLDING_REPORT_INDEX_PATH = os.getenv(
+    "HOLDING_REPORT_INDEX_PATH",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'holding_report_index.json'))
+)
+# 索引變更後延遲寫檔（秒），合併同一批報告的多次變更
+REPORT_INDEX_SAVE_DELAY = float(os.getenv("REPORT_INDEX_SAVE_DELAY", "1"))
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class ReportIndex:
+    """(channel_id, trader_uid) -> 最近一次報告的訊息 id 列表（依序）與內容摘要，持久化於本地 JSON 檔"""
+
+    def __init__(self, path: str = HOLDING_REPORT_INDEX_PATH, enabled: bool = HOLDING_REPORT_EDIT_IN_PLACE):
+        self.path = path
+        self.enabled = enabled
+        self._entries: Optional[Dict[str, dict]] = None
+        self._save_task: Optional[asyncio.Task] = None
+        self.stats = {"edited": 0, "created": 0, "unchanged": 0, "recreated": 0}
+
+    @staticmethod
+    def _key(channel_id: int, trader_uid: str) -> str:
+        return f"{channel_id}:{trader_uid}"
+
+    def _load(self) -> Dict[str, dict]:
+        if self._entries is None:
+            self._entries = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self._entries = json.load(f)
+                    logger.info(f"[ReportIndex] 已載入 {len(self._entries)} 筆報告訊息索引")
+                except Exception as e:
+                    logger.warning(f"[ReportIndex] 載入報告訊息索引失敗: {type(e).__name__} - {e}")
+        return self._entries
+
+    def get(self, channel_id: int, trader_uid: str) -> Optional[dict]:
+        return self._load().get(self._key(channel_id, trader_uid))
+
+    def put(self, channel_id: int, trader_uid: str, message_ids: List[int], digest: str) -> None:
+        self._load()[self._key(channel_id, trader_uid)] = {"message_ids": list(message_ids), "digest": digest}
+        self._schedule_save()
+
+    def drop(self, channel_id: int, trader_uid: str) -> None:
+        if self._load().pop(self._key(channel_id, trader_uid), None) is not None:
+            self._schedule_save()
+
+    def _write(self, blob: bytes) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    async def flush(self) -> None:
+        if self._entries is None:
+            return
+        blob = json.dumps(self._entries, separators=(",", ":")).encode("utf-8")
+        try:
+            await asyncio.to_thread(self._write, blob)
+        except Exception as e:
+            logger.warning(f"[ReportIndex] 寫入報告訊息索引失敗: {type(e).__name__} - {e}")
+
+    async def _delayed_save(self) -> None:
+        await asyncio.sleep(REPORT_INDEX_SAVE_DELAY)
+        self._save_task = None
+        await self.flush()
+
+    def _schedule_save(self) -> None:
+        if self._save_task is None:
+            self._save_task = asyncio.create_task(self._delayed_save())
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "enabled": self.enabled, "entries": len(self._entries or {})}
+
+
+holding_report_index = ReportIndex()
@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+try:
+    from ..i18n_loader import normalize_locale
+except Exception:
+    try:
+        from i18n_loader import normalize_locale  # type: ignore
+    except Exception:
+        def normalize_locale(lang):
+            return "en"
+
+from .http_pool import http_sessions, timeout
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SOCIAL_API = os.getenv("SOCIAL_API")
+# 路由表有效期（秒），過期後背景刷新，期間仍以舊資料服務
+ROUTING_TTL_SECONDS = float(os.getenv("ROUTING_TTL_SECONDS", "30"))
+# 最後一次成功取得的路由資料快照，重啟時先行載入
+ROUTING_SNAPSHOT_PATH = os.getenv(
+    "ROUTING_SNAPSHOT_PATH",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'routing_snapshot.json'))
+)
+
+# (channel_id, topic_id, jump, lang)
+PushTarget = Tuple[int, str, str, str]
+
+
+def _normalize_jump(jump_value) -> str:
+    """jump 為 null 或未設置時默認為 "0" """
+    if jump_value is None or jump_value == "" or jump_value == "null":
+        return "0"
+    return str(jump_value)
+
+
+def build_trader_index(social_groups: List[dict]) -> Dict[str, List[PushTarget]]:
+    """將 SOCIAL_API 群組資料建為 trader_uid -> 推送目標列表 的索引"""
+    index: Dict[str, List[PushTarget]] = {}
+    for social in social_groups:
+        group_lang = normalize_locale(social.get("lang") or "en")
+        for chat in social.get("chats", []):
+            if chat.get("type") != "copy" or not chat.get("enable"):
+                continue
+            cid = chat.get("chatId")
+            if not cid:
+                continue
+            try:
+                target = (int(cid), str(chat.get("topicId", "")), _normalize_jump(chat.get("jump")), group_lang)
+            except (TypeError, ValueError):
+                logger.warning(f"[Routing] 忽略格式錯誤的 chatId: {cid}")
+                continue
+            index.setdefault(str(chat.get("traderUid")), []).append(target)
+    return index
+
+
+class RoutingTable:
+    """SOCIAL_API 路由表：以 trader_uid 建索引，依 TTL 於背景刷新。
+
+    - 查詢為 O(1) 字典讀取，不需網路往返
+    - 資料過期時先回傳舊資料，同時觸發背景刷新
+    - 尚未載入任何資料時才會同步等待 SOCIAL_API
+    - 每次成功刷新後原子寫入本地快照，啟動時可先以快照服務
+    """
+
+    def __init__(self, ttl: float = ROUTING_TTL_SECONDS, snapshot_path: Optional[str] = ROUTING_SNAPSHOT_PATH):
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self._snapshot_blob: Optional[bytes] = None
+        self.source: Optional[str] = None
+        self._groups: List[dict] = []
+        self._by_trader: Dict[str, List[PushTarget]] = {}
+        self._loaded_at: Optional[float] = None
+        self._inflight: Optional[asyncio.Future] = None
+        self._revalidate_task: Optional[asyncio.Task] = None
+        self._refresh_loop_task: Optional[asyncio.Task] = None
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "stale_hits": 0,
+            "refreshes": 0,
+            "refresh_failures": 0,
+            "coalesced": 0,
+        }
+
+    @property
+    def age(self) -> Optional[float]:
+        if self._loaded_at is None:
+            return None
+        return time.monotonic() - self._loaded_at
+
+    def is_stale(self) -> bool:
+        age = self.age
+        return age is None or age >= self.ttl
+
+    async def _fetch(self) -> List[dict]:
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        payload = {"brand": "BYD", "type": "DISCORD"}
+        session = http_sessions.get(SOCIAL_API)
+        async with session.post(SOCIAL_API, headers=headers, data=payload, timeout=timeout(10)) as resp:
+            if resp.status != 200:
+                raise RuntimeError(f"SOCIAL_API 回應錯誤: {resp.status}")
+            social_data = await resp.json()
+        return social_data.get("data", []) or []
+
+    def _apply(self, groups: List[dict], loaded_at: Optional[float] = None) -> None:
+        self._by_trader = build_trader_index(groups)
+        self._groups = groups
+        self._loaded_at = time.monotonic() if loaded_at is None else loaded_at
+
+    def load_snapshot(self) -> bool:
+        """同步載入本地快照（於 API 開始接收請求前呼叫），成功回傳 True。
+
+        快照依其寫入時間計算年齡，過期時首次查詢會觸發背景刷新（stale-while-revalidate）。
+        """
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                blob = f.read()
+            snapshot = json.loads(blob)
+            groups = snapshot.get("groups") or []
+            saved_at = float(snapshot.get("saved_at") or 0)
+        except Exception as e:
+            logger.warning(f"[Routing] 載入路由快照失敗: {type(e).__name__} - {e}")
+            return False
+        age = max(time.time() - saved_at, 0.0)
+        self._apply(groups, loaded_at=time.monotonic() - age)
+        self._snapshot_blob = json.dumps(groups, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.source = "snapshot"
+        logger.info(f"[Routing] 已載入路由快照: {len(groups)} 個群組, 快照年齡 {age:.0f}s")
+        return True
+
+    def _write_snapshot(self, blob: bytes) -> None:
+        directory = os.path.dirname(self.snapshot_path)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b'{"saved_at":' + str(time.time()).encode("ascii") + b',"groups":' + blob + b'}')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+    async def _save_snapshot(self, groups: List[dict]) -> None:
+        if not self.snapshot_path:
+            return
+        blob = json.dumps(groups, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if blob == self._snapshot_blob:
+            return
+        try:
+            await asyncio.to_thread(self._write_snapshot, blob)
+            self._snapshot_blob = blob
+        except Exception as e:
+            logger.warning(f"[Routing] 寫入路由快照失敗: {type(e).__name__} - {e}")
+
+    async def _do_refresh(self) -> List[dict]:
+        try:
+            groups = await self._fetch()
+        except Exception as e:
+            self.stats["refresh_failures"] += 1
+            logger.error(f"[Routing] 刷新路由表失敗: {type(e).__name__} - {e}")
+            raise
+        self._apply(groups)
+        self.source = "live"
+        self.stats["refreshes"] += 1
+        logger.info(f"[Routing] 路由表已刷新: {len(groups)} 個群組, {len(self._by_trader)} 個交易員")
+        await self._save_snapshot(groups)
+        return groups
+
+    async def refresh(self) -> List[dict]:
+        """向 SOCIAL_API 重新取得群組資料並重建索引，失敗時拋出例外。
+
+        single-flight：同時呼叫者共用同一個進行中的請求與解析結果。
+        """
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.ensure_future(self._do_refresh())
+        else:
+            self.stats["coalesced"] += 1
+        # shield：單一呼叫者被取消時不影響其他等待中的呼叫者
+        return await asyncio.shield(self._inflight)
+
+    async def _safe_refresh(self) -> None:
+        try:
+            await self.refresh()
+        except Exception:
+            pass
+
+    def _revalidate_in_background(self) -> None:
+        if self._revalidate_task is None or self._revalidate_task.done():
+            self._revalidate_task = asyncio.create_task(self._safe_refresh())
+
+    async def get_push_targets(self, trader_uid: str) -> List[PushTarget]:
+        """以 trader_uid 查詢推送目標"""
+        if self._loaded_at is None:
+            self.stats["misses"] += 1
+            try:
+                await self.refresh()
+            except Exception:
+                return []
+        elif self.is_stale():
+            self.stats["stale_hits"] += 1
+            self._revalidate_in_background()
+        else:
+            self.stats["hits"] += 1
+        return list(self._by_trader.get(str(trader_uid), ()))
+
+    async def get_groups(self) -> List[dict]:
+        """取得 SOCIAL_API 原始群組資料；過期時刷新，刷新失敗則退回舊資料"""
+        if not self.is_stale():
+            return self._groups
+        try:
+            return await self.refresh()
+        except Exception:
+            if self._loaded_at is None:
+                raise
+            logger.warning("[Routing] SOCIAL_API 刷新失敗，使用既有群組資料")
+            return self._groups
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await self._safe_refresh()
+            await asyncio.sleep(self.ttl)
+
+    def start(self) -> None:
+        """在目前的事件迴圈啟動定時刷新（重複呼叫無副作用）"""
+        if self._refresh_loop_task is None or self._refresh_loop_task.done():
+            self._refresh_loop_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        for task in (self._refresh_loop_task, self._revalidate_task):
+            if task and not task.done():
+                task.cancel()
+        self._refresh_loop_task = None
+        self._revalidate_task = None
+
+    def get_stats(self) -> dict:
+        age = self.age
+        return {
+            **self.stats,
+            "age_seconds": round(age, 3) if age is not None else None,
+            "stale": self.is_stale(),
+            "source": self.source,
+            "ttl_seconds": self.ttl,
+            "groups": len(self._groups),
+            "traders": len(self._by_trader),
+        }
+
+
+routing_table = RoutingTable()
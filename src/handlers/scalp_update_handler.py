@@ -1,68 +1,49 @@
 import os
 import asyncio
 import logging
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 from fastapi import Request
 import discord
 from dotenv import load_dotenv
 
 from .common import (
-    get_push_targets, format_float, format_timestamp_ms_to_utc, get_i18n, normalize_locale
+    get_push_targets, format_float, format_timestamp_ms_to_utc, get_i18n, normalize_locale,
+    group_targets_for_render
 )
+from .outbox import outbox
+from .schemas import parse_json, ScalpUpdate
+from .ingest import ingest_queues, call_on_loop
+from .dedup import dedup_window
+from .channel_access import channel_access
+from .channel_health import can_deliver
+from .delivery import deliver, PRIORITY_SIGNAL
+from .webhooks import webhook_registry, use_webhook
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-def validate_scalp_update(data: dict) -> None:
-    """驗證止盈止損更新請求資料，失敗時拋出 ValueError。"""
-    required_fields = {
-        "trader_uid", "trader_name", "trader_detail_url", "pair", "pair_side",
-        "time"
-    }
+# 同一交易員、交易對、方向的止盈止損更新合併時間窗（秒），0 表示不合併、逐筆發送
+SCALP_COALESCE_SECONDS = float(os.getenv("SCALP_COALESCE_SECONDS", "0"))
 
-    missing = [f for f in required_fields if not data.get(f)]
-    if missing:
-        raise ValueError(f"缺少欄位: {', '.join(missing)}")
+# 價格欄位與其對應的「調整前」欄位
+_PRICE_FIELDS = (("tp_price", "previous_tp_price"), ("sl_price", "previous_sl_price"))
 
-    # 檢查 pair_side
-    if str(data["pair_side"]) not in {"1", "2"}:
-        raise ValueError("pair_side 只能是 '1'(Long) 或 '2'(Short)")
+def validate_scalp_update(data: dict) -> ScalpUpdate:
+    """驗證止盈止損更新請求資料並回傳已轉型的模型，失敗時拋出 ValueError。"""
+    return ScalpUpdate.check(data)
 
-    # 檢查是否為設置或更新操作
-    has_tp_price = data.get("tp_price") is not None
-    has_sl_price = data.get("sl_price") is not None
-    
-    if not has_tp_price and not has_sl_price:
-        raise ValueError("至少需要提供 tp_price 或 sl_price 其中之一")
+def scalp_update_dedup_key(signal: ScalpUpdate) -> tuple:
+    """冪等鍵：時間窗內相同鍵的請求視為上游重試"""
+    return (signal.trader_uid, signal.pair, signal.pair_side, signal.tp_price, signal.sl_price, int(signal.time))
 
-    # 數值檢查
-    try:
-        if has_tp_price:
-            float(data["tp_price"])
-        if has_sl_price:
-            float(data["sl_price"])
-        # 檢查 previous 價格（可選）
-        if data.get("previous_tp_price"):
-            float(data["previous_tp_price"])
-        if data.get("previous_sl_price"):
-            float(data["previous_sl_price"])
-    except (TypeError, ValueError):
-        raise ValueError("價格欄位必須為數字格式")
-
-    # time 欄位檢查
-    try:
-        ts_val = int(float(data["time"]))
-        if ts_val < 10**12:
-            raise ValueError("time 必須為毫秒級時間戳 (13 位)")
-    except (TypeError, ValueError):
-        raise ValueError("time 必須為毫秒級時間戳 (數字格式)")
-
-async def process_scalp_update_discord(data: dict, bot) -> None:
-    """背景協程：處理止盈止損更新推送到 Discord"""
+async def process_scalp_update_discord(data: dict, bot, signal: Optional[ScalpUpdate] = None) -> None:
+    """背景協程：處理止盈止損更新推送到 Discord；signal 未提供時（例如合併後或 outbox 重送）由 data 重新驗證"""
     logger.info("[ScalpUpdate] 開始執行背景處理任務")
     try:
-        trader_uid = str(data["trader_uid"])
+        if signal is None:
+            signal = validate_scalp_update(data)
+        trader_uid = signal.trader_uid
         logger.info(f"[ScalpUpdate] 處理交易員 UID: {trader_uid}")
 
         # 獲取推送目標
@@ -75,28 +56,30 @@ async def process_scalp_update_discord(data: dict, bot) -> None:
             return
 
         # 格式化時間
-        formatted_time = format_timestamp_ms_to_utc(data.get('time'))
+        formatted_time = format_timestamp_ms_to_utc(signal.time)
         logger.info(f"[ScalpUpdate] 格式化時間: {formatted_time}")
 
-        # 準備發送任務
+        # 準備發送任務：同語言、同連結設定的頻道只渲染一次
         tasks = []
+        task_targets = []
         logger.info(f"[ScalpUpdate] 準備發送到 {len(push_targets)} 個頻道")
-        
-        for i, (channel_id, topic_id, jump, channel_lang) in enumerate(push_targets):
-            logger.info(f"[ScalpUpdate] 處理第 {i+1} 個頻道: {channel_id}, topic: {topic_id}, jump: {jump}, lang: {channel_lang}")
-            
-            # 根據 jump 值決定是否包含連結
-            include_link = (jump == "1")
-            text = format_scalp_update_text(data, formatted_time, include_link, channel_lang)
-            logger.info(f"[ScalpUpdate] 為頻道 {channel_id} 準備消息內容")
-            
-            tasks.append(
-                send_discord_message(
-                    bot=bot,
-                    channel_id=channel_id,
-                    text=text
+
+        for (locale, include_link), targets in group_targets_for_render(push_targets).items():
+            text = format_scalp_update_text(data, formatted_time, include_link, locale)
+            logger.info(f"[ScalpUpdate] 語言 {locale} (連結: {include_link}) 共 {len(targets)} 個頻道")
+
+            for channel_id, topic_id, jump, channel_lang in targets:
+                if not use_webhook(topic_id) and not can_deliver(bot, channel_id):
+                    continue
+                tasks.append(
+                    send_discord_message(
+                        bot=bot,
+                        channel_id=channel_id,
+                        text=text,
+                        topic_id=topic_id
+                    )
                 )
-            )
+                task_targets.append(channel_id)
 
         # 等待 Discord 發送結果
         logger.info(f"[ScalpUpdate] 開始並發發送 {len(tasks)} 個消息")
@@ -106,10 +89,10 @@ async def process_scalp_update_discord(data: dict, bot) -> None:
         success_count = 0
         for i, result in enumerate(results):
             if isinstance(result, Exception):
-                logger.error(f"[ScalpUpdate] 頻道 {push_targets[i][0]} 發送失敗: {result}")
+                logger.error(f"[ScalpUpdate] 頻道 {task_targets[i]} 發送失敗: {result}")
             else:
                 success_count += 1
-                logger.info(f"[ScalpUpdate] 頻道 {push_targets[i][0]} 發送成功")
+                logger.info(f"[ScalpUpdate] 頻道 {task_targets[i]} 發送成功")
         
         logger.info(f"[ScalpUpdate] 發送完成: {success_count}/{len(tasks)} 成功")
 
@@ -118,27 +101,28 @@ async def process_scalp_update_discord(data: dict, bot) -> None:
         import traceback
         logger.error(f"[ScalpUpdate] 詳細錯誤: {traceback.format_exc()}")
 
-async def send_discord_message(bot, channel_id: int, text: str) -> None:
-    """發送 Discord 消息"""
+async def send_discord_message(bot, channel_id: int, text: str, topic_id: str = "") -> None:
+    """發送 Discord 消息；topic 設定為 webhook 時優先經由 webhook 發送"""
     logger.info(f"[ScalpUpdate] 開始發送消息到頻道 {channel_id}")
     try:
-        channel = bot.get_channel(channel_id)
-        if not channel:
+        if use_webhook(topic_id):
+            if await webhook_registry.send(bot, channel_id, PRIORITY_SIGNAL, text):
+                logger.info(f"[ScalpUpdate] 已經由 webhook 發送到頻道 {channel_id}")
+                return
+
+        # 頻道與權限取自快取，權限變更時由事件清除
+        access = channel_access.get(bot, channel_id)
+        if not access:
             logger.warning(f"[ScalpUpdate] 找不到頻道 {channel_id}")
             return
+        channel = access.channel
 
-        logger.info(f"[ScalpUpdate] 找到頻道: {channel.name} (ID: {channel_id})")
-
-        # 檢查權限
-        permissions = channel.permissions_for(channel.guild.me)
-        logger.info(f"[ScalpUpdate] 頻道權限檢查 - 發送消息: {permissions.send_messages}")
-        
-        if not permissions.send_messages:
+        if not access.can_send:
             logger.warning(f"[ScalpUpdate] 在頻道 {channel_id} 中沒有發送消息的權限")
             return
 
         logger.info(f"[ScalpUpdate] 發送消息到頻道 {channel_id}")
-        await channel.send(content=text, allowed_mentions=discord.AllowedMentions.none())
+        await deliver(PRIORITY_SIGNAL, channel_id, lambda: channel.send(content=text, allowed_mentions=discord.AllowedMentions.none()))
 
         logger.info(f"[ScalpUpdate] 成功發送到 Discord 頻道 {channel_id}")
 
@@ -151,6 +135,125 @@ async def send_discord_message(bot, channel_id: int, text: str) -> None:
         import traceback
         logger.error(f"[ScalpUpdate] 詳細錯誤: {traceback.format_exc()}")
 
+class _PendingScalp:
+    __slots__ = ("data", "previous", "prices", "signal_ids", "count", "timer")
+
+    def __init__(self, data: dict, signal: ScalpUpdate, signal_id: Optional[str]):
+        self.data = dict(data)
+        # 時間窗內第一筆帶有該價格的更新所附的調整前價格：(原始字串供顯示, 已轉型數值供比較)
+        self.previous: Dict[str, Tuple[Optional[str], Optional[float]]] = {}
+        # 各價格欄位目前的最終數值
+        self.prices: Dict[str, float] = {}
+        self.signal_ids: List[Optional[str]] = [signal_id]
+        self.count = 1
+        # 時間窗到期時的 flush 排程，提前 flush 時取消
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self._remember_prices(data, signal)
+
+    def _remember_prices(self, data: dict, signal: ScalpUpdate) -> None:
+        for price_field, previous_field in _PRICE_FIELDS:
+            price = getattr(signal, price_field)
+            if price is None:
+                continue
+            self.prices[price_field] = price
+            if price_field not in self.previous:
+                self.previous[price_field] = (data.get(previous_field), getattr(signal, previous_field))
+
+    def merge(self, data: dict, signal: ScalpUpdate, signal_id: Optional[str]) -> None:
+        """以最新一筆為準，未在新更新中出現的價格沿用先前的值"""
+        merged = dict(data)
+        for price_field, _ in _PRICE_FIELDS:
+            if getattr(signal, price_field) is None and price_field in self.prices:
+                merged[price_field] = self.data[price_field]
+        self._remember_prices(data, signal)
+        self.data = merged
+        self.signal_ids.append(signal_id)
+        self.count += 1
+
+    def result(self) -> Optional[dict]:
+        """合併後的最終狀態；合併多筆後價格最終都回到調整前的值時回傳 None（無淨變化）。
+
+        單筆更新照原樣發送，與未啟用合併時的行為一致。
+        """
+        data = dict(self.data)
+        changed = self.count == 1 or not self.previous
+        for price_field, previous_field in _PRICE_FIELDS:
+            if price_field not in self.previous:
+                continue
+            previous_raw, previous = self.previous[price_field]
+            data[previous_field] = previous_raw
+            if previous is None or previous != self.prices[price_field]:
+                changed = True
+        return data if changed else None
+
+
+class ScalpCoalescer:
+    """依 (trader_uid, pair, pair_side) 合併短時間內的多次止盈止損調整，只發送最終狀態。
+
+    時間窗自第一筆更新起算，不會因持續調整而無限延後；僅在 bot 事件迴圈上操作。
+    """
+
+    def __init__(self, window: float = SCALP_COALESCE_SECONDS):
+        self.window = window
+        self._pending: Dict[Tuple[str, str, str], _PendingScalp] = {}
+        self.stats = {"received": 0, "merged": 0, "flushed": 0, "unchanged": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def add(self, data: dict, signal: ScalpUpdate, signal_id: Optional[str], bot) -> None:
+        key = (signal.trader_uid, signal.pair, signal.pair_side)
+        self.stats["received"] += 1
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending.merge(data, signal, signal_id)
+            self.stats["merged"] += 1
+            return
+        pending = self._pending[key] = _PendingScalp(data, signal, signal_id)
+        pending.timer = asyncio.get_running_loop().call_later(self.window, self._flush, key, bot)
+
+    def _flush(self, key: Tuple[str, str, str], bot) -> None:
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        if pending.timer is not None:
+            pending.timer.cancel()
+        # 時間窗內每筆更新預留的名額在此歸還，合併結果改以一般提交計入容量
+        ingest_queues.release("scalp_update", pending.count)
+        first_id, *merged_ids = pending.signal_ids
+        for signal_id in merged_ids:
+            outbox.complete(signal_id)
+        data = pending.result()
+        if data is None:
+            self.stats["unchanged"] += 1
+            outbox.complete(first_id)
+            logger.info(f"[ScalpUpdate] {key} 時間窗內 {pending.count} 筆調整無淨變化，不發送")
+            return
+        self.stats["flushed"] += 1
+        if pending.count > 1:
+            logger.info(f"[ScalpUpdate] {key} 合併 {pending.count} 筆調整後發送")
+        if ingest_queues.submit("scalp_update", lambda: outbox.track(first_id, process_scalp_update_discord(data, bot)), key=key[0]):
+            outbox.complete(first_id)
+            logger.warning(f"[ScalpUpdate] 處理佇列已滿，捨棄 {key} 的合併更新")
+
+    def flush_trader(self, trader_uid: str, bot) -> None:
+        """立即送出該交易員尚在時間窗內的更新，使其排在隨後的開倉訊號或平倉總結之前"""
+        for key in [key for key in self._pending if key[0] == trader_uid]:
+            self._flush(key, bot)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "window_seconds": self.window, "pending": len(self._pending)}
+
+
+scalp_coalescer = ScalpCoalescer()
+
+
+def flush_pending_scalps(trader_uid: str, bot) -> None:
+    """開倉訊號或平倉總結排入 lane 前，先送出該交易員尚在合併時間窗內的止盈止損更新（可於任意執行緒呼叫）"""
+    if scalp_coalescer.enabled:
+        call_on_loop(bot.loop, scalp_coalescer.flush_trader, trader_uid, bot)
+
 def format_scalp_update_text(data: dict, formatted_time: str, include_link: bool = True, lang: str = None) -> str:
     """格式化止盈止損更新文本（i18n）"""
     i18n = get_i18n()
@@ -222,7 +325,7 @@ async def handle_send_scalp_update(request: Request, bot) -> Dict:
 
     # 解析 JSON
     try:
-        data = await request.json()
+        data = parse_json(await request.body())
         logger.info(f"[ScalpUpdate] 成功解析 JSON 數據: {list(data.keys())}")
     except Exception as e:
         logger.error(f"[ScalpUpdate] JSON 解析失敗: {e}")
@@ -230,19 +333,44 @@ async def handle_send_scalp_update(request: Request, bot) -> Dict:
 
     # 資料驗證
     try:
-        validate_scalp_update(data)
+        signal = validate_scalp_update(data)
         logger.info("[ScalpUpdate] 數據驗證通過")
     except ValueError as err:
         logger.error(f"[ScalpUpdate] 數據驗證失敗: {err}")
         return {"status": "400", "message": str(err)}
 
+    # 冪等：時間窗內的重複請求（上游重試）直接忽略
+    dedup_key = scalp_update_dedup_key(signal)
+    if dedup_window.seen("scalp_update", dedup_key):
+        logger.info(f"[ScalpUpdate] 重複請求，已忽略: {dedup_key}")
+        return {"status": "200", "message": "重複請求，已忽略"}
+
     # 背景處理：在 Discord 事件迴圈執行
     logger.info("[ScalpUpdate] 開始背景處理，調度到 Discord 事件迴圈")
     try:
-        asyncio.run_coroutine_threadsafe(process_scalp_update_discord(data, bot), bot.loop)
+        signal_id = outbox.record("scalp_update", data)
+        if scalp_coalescer.enabled:
+            # 合併時間窗內的更新同樣佔用 lane 容量，flush 時歸還
+            rejected = ingest_queues.reserve("scalp_update")
+            if not rejected:
+                try:
+                    call_on_loop(bot.loop, scalp_coalescer.add, data, signal, signal_id, bot)
+                except Exception:
+                    ingest_queues.release("scalp_update")
+                    raise
+        else:
+            rejected = ingest_queues.submit(
+                "scalp_update", lambda: outbox.track(signal_id, process_scalp_update_discord(data, bot, signal)), key=signal.trader_uid
+            )
+        if rejected:
+            logger.warning(f"[ScalpUpdate] 處理佇列已滿或尚未就緒 ({rejected})，拒絕請求")
+            outbox.complete(signal_id)
+            dedup_window.forget("scalp_update", dedup_key)
+            return ingest_queues.reject_response(rejected)
         logger.info("[ScalpUpdate] 成功調度背景任務")
     except Exception as e:
         logger.error(f"[ScalpUpdate] 調度背景任務失敗: {e}")
+        dedup_window.forget("scalp_update", dedup_key)
         return {"status": "500", "message": "Internal server error"}
     
     return {"status": "200", "message": "接收成功，稍後發送"} 
\ No newline at end of file
@@ -0,0 +1,196 @@
+import math
+from typing import Any, ClassVar, Dict, Literal, Optional, Tuple
+
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field, ValidationError, model_validator
+from pydantic_core import from_json
+from typing_extensions import Annotated
+
+# 毫秒級時間戳下限（13 位數）
+MS_TIMESTAMP_MIN = 10**12
+
+# '1' / '2'（字串或數字），用於 pair_side 與 pair_margin_type
+_SideCode = Annotated[str, Field(pattern=r"^[12]$")]
+# 可選價格：空字串或 "None" 視為未提供
+_OptionalNumber = Annotated[Optional[float], BeforeValidator(lambda v: None if v in ("", "None") else v)]
+# 筆數：與 int() 相同，小數直接截斷，字串仍須為整數格式
+_Count = Annotated[int, BeforeValidator(lambda v: int(v) if isinstance(v, float) and math.isfinite(v) else v)]
+
+
+def parse_json(body: bytes) -> Any:
+    """以 pydantic-core 的 JSON 解析器直接解析原始請求內容，格式錯誤時拋出 ValueError"""
+    return from_json(body)
+
+
+class Payload(BaseModel):
+    """請求資料的宣告式 schema。
+
+    必填欄位沿用原本的 truthy 檢查；型別、格式與範圍由 pydantic-core 一次驗證，
+    錯誤訊息依欄位（或 "欄位:錯誤類型"）對應到 messages 中的原有訊息。
+    """
+
+    model_config = ConfigDict(extra="ignore", coerce_numbers_to_str=True)
+
+    required: ClassVar[Tuple[str, ...]] = ()
+    messages: ClassVar[Dict[str, str]] = {}
+
+    @classmethod
+    def check(cls, data: dict, prefix: str = "") -> "Payload":
+        """驗證 dict 並回傳已轉型的模型，失敗時拋出 ValueError"""
+        missing = [f for f in cls.required if not data.get(f)]
+        if missing:
+            raise ValueError(f"{prefix}缺少欄位: {', '.join(missing)}")
+        try:
+            return cls.model_validate(data)
+        except ValidationError as e:
+            raise ValueError(prefix + cls._message(e.errors(include_url=False)[0])) from None
+
+    @classmethod
+    def _message(cls, error: dict) -> str:
+        if not error["loc"]:
+            # model_validator 拋出的跨欄位錯誤
+            return str(error["ctx"]["error"])
+        field = error["loc"][0]
+        return cls.messages.get(f"{field}:{error['type']}") or cls.messages.get(field) or f"{field} 格式錯誤"
+
+
+class CopySignal(Payload):
+    required = (
+        "trader_uid", "trader_name", "trader_pnl", "trader_pnlpercentage",
+        "trader_detail_url", "pair", "base_coin", "quote_coin",
+        "pair_leverage", "pair_type", "price", "time", "trader_url",
+        "pair_side", "pair_margin_type",
+    )
+    messages = {
+        "trader_pnl": "trader_pnlpercentage / pair_leverage / trader_pnl 必須為數字格式",
+        "trader_pnlpercentage": "trader_pnlpercentage / pair_leverage / trader_pnl 必須為數字格式",
+        "pair_leverage": "trader_pnlpercentage / pair_leverage / trader_pnl 必須為數字格式",
+        "pair_type": "pair_type 只能是 'buy' 或 'sell'",
+        "pair_side": "pair_side 只能是 '1'(Long) 或 '2'(Short)",
+        "pair_margin_type": "pair_margin_type 只能是 '1'(Cross) 或 '2'(Isolated)",
+        "time": "time 必須為毫秒級時間戳 (數字格式)",
+        "time:greater_than_equal": "time 必須為毫秒級時間戳 (13 位)",
+    }
+
+    trader_uid: str
+    pair: str
+    trader_pnl: float
+    trader_pnlpercentage: float
+    pair_leverage: float
+    pair_type: Literal["buy", "sell"]
+    pair_side: _SideCode
+    pair_margin_type: _SideCode
+    time: float = Field(ge=MS_TIMESTAMP_MIN, allow_inf_nan=False)
+
+    @model_validator(mode="after")
+    def _same_sign(self) -> "CopySignal":
+        if (self.trader_pnl >= 0) ^ (self.trader_pnlpercentage >= 0):
+            raise ValueError("trader_pnl 與 trader_pnlpercentage 正負號不一致")
+        return self
+
+
+class TradeSummary(Payload):
+    required = (
+        "trader_uid", "trader_name", "trader_detail_url", "pair", "pair_side",
+        "pair_margin_type", "pair_leverage", "entry_price", "exit_price",
+        "realized_pnl", "realized_pnl_percentage", "close_time",
+    )
+    messages = {
+        "pair_side": "pair_side 只能是 '1'(Long) 或 '2'(Short)",
+        "pair_margin_type": "pair_margin_type 只能是 '1'(Cross) 或 '2'(Isolated)",
+        "entry_price": "數值欄位必須為正確的數字格式",
+        "exit_price": "數值欄位必須為正確的數字格式",
+        "realized_pnl": "數值欄位必須為正確的數字格式",
+        "realized_pnl_percentage": "數值欄位必須為正確的數字格式",
+        "pair_leverage": "數值欄位必須為正確的數字格式",
+        "close_time": "close_time 必須為毫秒級時間戳 (數字格式)",
+    }
+
+    trader_uid: str
+    pair: str
+    pair_side: _SideCode
+    pair_margin_type: _SideCode
+    entry_price: float
+    exit_price: float
+    realized_pnl: float
+    realized_pnl_percentage: float
+    pair_leverage: float
+    close_time: float = Field(ge=MS_TIMESTAMP_MIN, allow_inf_nan=False)
+
+
+class ScalpUpdate(Payload):
+    required = ("trader_uid", "trader_name", "trader_detail_url", "pair", "pair_side", "time")
+    messages = {
+        "pair_side": "pair_side 只能是 '1'(Long) 或 '2'(Short)",
+        "tp_price": "價格欄位必須為數字格式",
+        "sl_price": "價格欄位必須為數字格式",
+        "previous_tp_price": "價格欄位必須為數字格式",
+        "previous_sl_price": "價格欄位必須為數字格式",
+        "time": "time 必須為毫秒級時間戳 (數字格式)",
+    }
+
+    trader_uid: str
+    pair: str
+    pair_side: _SideCode
+    tp_price: Optional[float] = None
+    sl_price: Optional[float] = None
+    previous_tp_price: _OptionalNumber = None
+    previous_sl_price: _OptionalNumber = None
+    time: float = Field(ge=MS_TIMESTAMP_MIN, allow_inf_nan=False)
+
+    @model_validator(mode="after")
+    def _has_price(self) -> "ScalpUpdate":
+        if self.tp_price is None and self.sl_price is None:
+            raise ValueError("至少需要提供 tp_price 或 sl_price 其中之一")
+        return self
+
+
+class HoldingInfo(Payload):
+    required = (
+        "pair", "pair_side", "pair_margin_type", "pair_leverage",
+        "entry_price", "current_price", "unrealized_pnl_percentage",
+    )
+    messages = {
+        "pair_side": "pair_side 只能是 '1'(Long) 或 '2'(Short)",
+        "pair_margin_type": "pair_margin_type 只能是 '1'(Cross) 或 '2'(Isolated)",
+        "entry_price": "數值欄位必須為數字格式",
+        "current_price": "數值欄位必須為數字格式",
+        "unrealized_pnl_percentage": "數值欄位必須為數字格式",
+        "pair_leverage": "數值欄位必須為數字格式",
+        "tp_price": "數值欄位必須為數字格式",
+        "sl_price": "數值欄位必須為數字格式",
+    }
+
+    pair_side: _SideCode
+    pair_margin_type: _SideCode
+    entry_price: float
+    current_price: float
+    unrealized_pnl_percentage: float
+    pair_leverage: float
+    tp_price: _OptionalNumber = None
+    sl_price: _OptionalNumber = None
+
+
+class WeeklyReport(Payload):
+    required = (
+        "trader_uid", "trader_name", "trader_url", "trader_detail_url",
+        "total_roi", "total_pnl", "total_trades",
+        "win_trades", "loss_trades", "win_rate",
+    )
+    messages = {
+        "total_roi": "數值欄位必須為正確的數字格式",
+        "total_pnl": "數值欄位必須為正確的數字格式",
+        "total_trades": "數值欄位必須為正確的數字格式",
+        "win_trades": "數值欄位必須為正確的數字格式",
+        "loss_trades": "數值欄位必須為正確的數字格式",
+        "win_rate": "數值欄位必須為正確的數字格式",
+        "win_rate:greater_than_equal": "勝率必須在 0-100 之間",
+        "win_rate:less_than_equal": "勝率必須在 0-100 之間",
+    }
+
+    trader_uid: str
+    total_roi: float
+    total_pnl: float
+    total_trades: _Count
+    win_trades: _Count
+    loss_trades: _Count
+    win_rate: float = Field(ge=0, le=100)
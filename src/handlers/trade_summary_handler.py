@@ -1,68 +1,53 @@
 import os
 import asyncio
 import logging
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 from fastapi import Request
 import discord
 from dotenv import load_dotenv
 from PIL import Image, ImageDraw, ImageFont
 
 from .common import (
-    get_push_targets, format_float, format_timestamp_ms_to_utc, get_i18n, normalize_locale
+    get_push_targets, handle_batch, format_float, format_timestamp_ms_to_utc, get_i18n,
+    normalize_locale, group_targets_for_render
 )
+from .outbox import outbox
+from .schemas import parse_json, TradeSummary
+from .ingest import ingest_queues
+from .scalp_update_handler import flush_pending_scalps
+from .dedup import dedup_window
+from .channel_access import channel_access
+from .channel_health import can_deliver
+from .delivery import deliver, PRIORITY_SUMMARY
+from .attachments import stage_image, image_embed, temp_image_path, remove_image, stats as attachment_counters
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-def validate_trade_summary(data: dict) -> None:
-    """驗證交易總結請求資料，失敗時拋出 ValueError。"""
-    required_fields = {
-        "trader_uid", "trader_name", "trader_detail_url", "pair", "pair_side",
-        "pair_margin_type", "pair_leverage", "entry_price", "exit_price",
-        "realized_pnl", "realized_pnl_percentage", "close_time"
-    }
+def validate_trade_summary(data: dict) -> TradeSummary:
+    """驗證交易總結請求資料並回傳已轉型的模型，失敗時拋出 ValueError。"""
+    return TradeSummary.check(data)
 
-    missing = [f for f in required_fields if not data.get(f)]
-    if missing:
-        raise ValueError(f"缺少欄位: {', '.join(missing)}")
+def trade_summary_dedup_key(signal: TradeSummary) -> tuple:
+    """冪等鍵：時間窗內相同鍵的請求視為上游重試"""
+    return (signal.trader_uid, signal.pair, int(signal.close_time))
 
-    # 檢查 pair_side
-    if str(data["pair_side"]) not in {"1", "2"}:
-        raise ValueError("pair_side 只能是 '1'(Long) 或 '2'(Short)")
-
-    # 檢查 pair_margin_type
-    if str(data["pair_margin_type"]) not in {"1", "2"}:
-        raise ValueError("pair_margin_type 只能是 '1'(Cross) 或 '2'(Isolated)")
-
-    # 數值檢查
-    try:
-        float(data["entry_price"])
-        float(data["exit_price"])
-        float(data["realized_pnl"])
-        float(data["realized_pnl_percentage"])
-        float(data["pair_leverage"])
-    except (TypeError, ValueError):
-        raise ValueError("數值欄位必須為正確的數字格式")
-
-    # time 欄位檢查
-    try:
-        ts_val = int(float(data["close_time"]))
-        if ts_val < 10**12:
-            raise ValueError("close_time 必須為毫秒級時間戳 (13 位)")
-    except (TypeError, ValueError):
-        raise ValueError("close_time 必須為毫秒級時間戳 (數字格式)")
-
-async def process_trade_summary_discord(data: dict, bot) -> None:
-    """背景協程：處理交易總結推送到 Discord"""
+async def process_trade_summary_discord(data: dict, bot, push_targets: Optional[List[Tuple[int, str, str, str]]] = None,
+                                        signal: Optional[TradeSummary] = None) -> None:
+    """背景協程：處理交易總結推送到 Discord；signal 未提供時（例如 outbox 重送）由 data 重新驗證"""
     logger.info("[TradeSummary] 開始執行背景處理任務")
+    img_path = None
     try:
-        trader_uid = str(data["trader_uid"])
+        if signal is None:
+            signal = validate_trade_summary(data)
+        trader_uid = signal.trader_uid
         logger.info(f"[TradeSummary] 處理交易員 UID: {trader_uid}")
 
         # 獲取推送目標
-        logger.info("[TradeSummary] 開始獲取推送目標")
-        push_targets = await get_push_targets(trader_uid)
+        if push_targets is None:
+            logger.info("[TradeSummary] 開始獲取推送目標")
+            push_targets = await get_push_targets(trader_uid)
         logger.info(f"[TradeSummary] 獲取到 {len(push_targets)} 個推送目標")
 
         if not push_targets:
@@ -71,32 +56,37 @@ async def process_trade_summary_discord(data: dict, bot) -> None:
 
         # 生成交易總結圖片
         logger.info("[TradeSummary] 開始生成交易總結圖片")
-        img_path = generate_trade_summary_image(data)
+        img_path = generate_trade_summary_image(data, signal)
         if not img_path:
             logger.warning("[TradeSummary] 交易總結圖片生成失敗，取消推送")
             return
         logger.info(f"[TradeSummary] 圖片生成成功: {img_path}")
 
-        # 準備發送任務
+        # 設定公開圖片網址時圖片只寫入一次，各頻道以 embed 引用其固定網址
+        image_url = await stage_image(img_path, "trade_summary.png")
+
+        # 準備發送任務：同語言、同連結設定的頻道只渲染一次
         tasks = []
+        task_targets = []
         logger.info(f"[TradeSummary] 準備發送到 {len(push_targets)} 個頻道")
-        
-        for i, (channel_id, topic_id, jump, channel_lang) in enumerate(push_targets):
-            logger.info(f"[TradeSummary] 處理第 {i+1} 個頻道: {channel_id}, topic: {topic_id}, jump: {jump}, lang: {channel_lang}")
-            
-            # 根據 jump 值決定是否包含連結
-            include_link = (jump == "1")
-            text = format_trade_summary_text(data, include_link, channel_lang)
-            logger.info(f"[TradeSummary] 為頻道 {channel_id} 準備消息內容")
-            
-            tasks.append(
-                send_discord_message_with_image(
-                    bot=bot,
-                    channel_id=channel_id,
-                    text=text,
-                    image_path=img_path
+
+        for (locale, include_link), targets in group_targets_for_render(push_targets).items():
+            text = format_trade_summary_text(data, signal, include_link, locale)
+            logger.info(f"[TradeSummary] 語言 {locale} (連結: {include_link}) 共 {len(targets)} 個頻道")
+
+            for channel_id, topic_id, jump, channel_lang in targets:
+                if not can_deliver(bot, channel_id):
+                    continue
+                tasks.append(
+                    send_discord_message_with_image(
+                        bot=bot,
+                        channel_id=channel_id,
+                        text=text,
+                        image_path=img_path,
+                        image_url=image_url
+                    )
                 )
-            )
+                task_targets.append(channel_id)
 
         # 等待 Discord 發送結果
         logger.info(f"[TradeSummary] 開始並發發送 {len(tasks)} 個消息")
@@ -106,10 +96,10 @@ async def process_trade_summary_discord(data: dict, bot) -> None:
         success_count = 0
         for i, result in enumerate(results):
             if isinstance(result, Exception):
-                logger.error(f"[TradeSummary] 頻道 {push_targets[i][0]} 發送失敗: {result}")
+                logger.error(f"[TradeSummary] 頻道 {task_targets[i]} 發送失敗: {result}")
             else:
                 success_count += 1
-                logger.info(f"[TradeSummary] 頻道 {push_targets[i][0]} 發送成功")
+                logger.info(f"[TradeSummary] 頻道 {task_targets[i]} 發送成功")
         
         logger.info(f"[TradeSummary] 發送完成: {success_count}/{len(tasks)} 成功")
 
@@ -117,23 +107,22 @@ async def process_trade_summary_discord(data: dict, bot) -> None:
         logger.error(f"[TradeSummary] 推送交易總結到 Discord 失敗: {type(e).__name__} - {e}")
         import traceback
         logger.error(f"[TradeSummary] 詳細錯誤: {traceback.format_exc()}")
+    finally:
+        # 所有頻道（含 webhook 與直接上傳）都已發送完畢，刪除本次的暫存圖片
+        remove_image(img_path)
 
-async def send_discord_message_with_image(bot, channel_id: int, text: str, image_path: str) -> None:
-    """發送帶圖片的 Discord 消息"""
+async def send_discord_message_with_image(bot, channel_id: int, text: str, image_path: str, image_url: str = None) -> None:
+    """發送帶圖片的 Discord 消息；提供 image_url 時以 embed 引用已上傳的圖片，不重新上傳"""
     logger.info(f"[TradeSummary] 開始發送消息到頻道 {channel_id}")
     try:
-        channel = bot.get_channel(channel_id)
-        if not channel:
+        # 頻道與權限取自快取，權限變更時由事件清除
+        access = channel_access.get(bot, channel_id)
+        if not access:
             logger.warning(f"[TradeSummary] 找不到頻道 {channel_id}")
             return
+        channel = access.channel
 
-        logger.info(f"[TradeSummary] 找到頻道: {channel.name} (ID: {channel_id})")
-
-        # 檢查權限
-        permissions = channel.permissions_for(channel.guild.me)
-        logger.info(f"[TradeSummary] 頻道權限檢查 - 發送消息: {permissions.send_messages}, 附加文件: {permissions.attach_files}")
-        
-        if not permissions.send_messages:
+        if not access.can_send:
             logger.warning(f"[TradeSummary] 在頻道 {channel_id} 中沒有發送消息的權限")
             return
 
@@ -146,13 +135,33 @@ async def send_discord_message_with_image(bot, channel_id: int, text: str, image
                 logger.warning(f"[TradeSummary] 圖片文件不存在: {image_path}")
                 image_path = None
 
-        if image_path and permissions.attach_files:
+        if image_url and access.can_embed:
+            logger.info(f"[TradeSummary] 發送引用公開圖片的消息到頻道 {channel_id}")
+            try:
+                await deliver(PRIORITY_SUMMARY, channel_id, lambda: channel.send(
+                    content=text,
+                    embed=image_embed(image_url),
+                    allowed_mentions=discord.AllowedMentions.none()
+                ))
+                attachment_counters["embed_sends"] += 1
+                logger.info(f"[TradeSummary] 成功發送到 Discord 頻道 {channel_id}")
+                return
+            except discord.HTTPException as e:
+                # 公開圖片無法引用時，本機圖片仍在，改為直接上傳
+                attachment_counters["embed_fallbacks"] += 1
+                logger.warning(f"[TradeSummary] 引用公開圖片發送到頻道 {channel_id} 失敗，改為直接上傳: {e}")
+
+        if image_path and access.can_attach:
             logger.info(f"[TradeSummary] 發送帶圖片的消息到頻道 {channel_id}")
-            discord_file = discord.File(image_path, filename="trade_summary.png")
-            await channel.send(content=text, file=discord_file, allowed_mentions=discord.AllowedMentions.none())
+            await deliver(PRIORITY_SUMMARY, channel_id, lambda: channel.send(
+                content=text,
+                file=discord.File(image_path, filename="trade_summary.png"),
+                allowed_mentions=discord.AllowedMentions.none()
+            ))
+            attachment_counters["direct_uploads"] += 1
         else:
             logger.info(f"[TradeSummary] 發送純文字消息到頻道 {channel_id}")
-            await channel.send(content=text, allowed_mentions=discord.AllowedMentions.none())
+            await deliver(PRIORITY_SUMMARY, channel_id, lambda: channel.send(content=text, allowed_mentions=discord.AllowedMentions.none()))
 
         logger.info(f"[TradeSummary] 成功發送到 Discord 頻道 {channel_id}")
 
@@ -165,25 +174,25 @@ async def send_discord_message_with_image(bot, channel_id: int, text: str, image
         import traceback
         logger.error(f"[TradeSummary] 詳細錯誤: {traceback.format_exc()}")
 
-def format_trade_summary_text(data: dict, include_link: bool = True, lang: str = None) -> str:
-    """格式化交易總結文本（i18n）"""
+def format_trade_summary_text(data: dict, signal: TradeSummary, include_link: bool = True, lang: str = None) -> str:
+    """格式化交易總結文本（i18n）；數值取自已轉型的 signal，價格保留原始字串顯示"""
     i18n = get_i18n()
     locale = normalize_locale(lang)
 
-    pair_side = i18n.t(f"common.sides.{str(data.get('pair_side',''))}", locale)
-    margin_type = i18n.t(f"common.margin_types.{str(data.get('pair_margin_type',''))}", locale)
+    pair_side = i18n.t(f"common.sides.{signal.pair_side}", locale)
+    margin_type = i18n.t(f"common.margin_types.{signal.pair_margin_type}", locale)
 
     entry_price = str(data.get("entry_price", 0))
     exit_price = str(data.get("exit_price", 0))
-    realized_pnl = format_float(float(data.get("realized_pnl_percentage", 0)) * 100)
-    leverage = format_float(data.get("pair_leverage", 0))
+    realized_pnl = format_float(signal.realized_pnl_percentage * 100)
+    leverage = format_float(signal.pair_leverage)
 
-    formatted_time = format_timestamp_ms_to_utc(data.get('close_time'))
+    formatted_time = format_timestamp_ms_to_utc(signal.close_time)
 
     text = (
         i18n.t("summary.title", locale) + "\n\n" +
         i18n.render("summary.close", locale, {"trader_name": data.get('trader_name', 'Trader')}) + "\n\n" +
-        f"**{data.get('pair', '')}** {margin_type} **{leverage}X**\n\n" +
+        f"**{signal.pair}** {margin_type} **{leverage}X**\n\n" +
         i18n.render("summary.line_time", locale, {"time": formatted_time}) + "\n" +
         i18n.render("summary.line_direction", locale, {"pair_side": pair_side}) + "\n" +
         i18n.render("summary.line_roi", locale, {"roi": realized_pnl}) + "\n" +
@@ -198,7 +207,7 @@ def format_trade_summary_text(data: dict, include_link: bool = True, lang: str =
 
     return text
 
-def generate_trade_summary_image(data: dict) -> str:
+def generate_trade_summary_image(data: dict, signal: TradeSummary) -> str:
     """生成交易總結圖片 - 配合新背景圖格式"""
     logger.info(f"[TradeSummary] 開始生成交易總結圖片")
     try:
@@ -239,29 +248,28 @@ def generate_trade_summary_image(data: dict) -> str:
             return None
         
         # 格式化數值
-        realized_pnl = format_float(float(data.get("realized_pnl_percentage", 0)) * 100)
+        realized_pnl = format_float(signal.realized_pnl_percentage * 100)
         entry_price = str(data.get("entry_price", 0))
         exit_price = str(data.get("exit_price", 0))
-        leverage = format_float(data.get("pair_leverage", 0))
+        leverage = format_float(signal.pair_leverage)
         
         # 判斷盈虧顏色
-        is_positive = float(data.get("realized_pnl_percentage", 0)) >= 0
+        is_positive = signal.realized_pnl_percentage >= 0
         pnl_color = (0, 191, 99) if is_positive else (237, 29, 36)  # 綠色或紅色
         
         # 判斷交易方向顏色
-        is_long = str(data.get("pair_side", "")) == "1"
+        is_long = signal.pair_side == "1"
         direction_color = (0, 191, 99) if is_long else (237, 29, 36)  # Long用綠色，Short用紅色
         
         # 在背景圖上填充數值到對應位置
         # 根據第二張照片的風格調整位置，增加間距並靠左
         
         # 交易對標題 (頂部)
-        pair_text = f"{data.get('pair', '')} Perpetual"
+        pair_text = f"{signal.pair} Perpetual"
         draw.text((80, 70), pair_text, font=medium_font, fill=(255, 255, 255))
         
         # 槓桿信息 (交易對下方) - 根據方向設置顏色
-        pair_side_map = {"1": "Long", "2": "Short", 1: "Long", 2: "Short"}
-        pair_side = pair_side_map.get(str(data.get("pair_side", "")), str(data.get("pair_side", "")))
+        pair_side = "Long" if is_long else "Short"
         leverage_text = f"{pair_side} {leverage}X"
         draw.text((80, 140), leverage_text, font=small_font, fill=direction_color)
         
@@ -284,7 +292,7 @@ def generate_trade_summary_image(data: dict) -> str:
         logger.info(f"[TradeSummary] 圖片文字繪製完成")
         
         # 保存圖片
-        temp_path = "/tmp/trade_summary_discord.png"
+        temp_path = temp_image_path("trade_summary_")
         logger.info(f"[TradeSummary] 保存圖片到: {temp_path}")
         try:
             img.save(temp_path, quality=95)
@@ -292,6 +300,7 @@ def generate_trade_summary_image(data: dict) -> str:
             return temp_path
         except Exception as e:
             logger.error(f"[TradeSummary] 圖片保存失敗: {e}")
+            remove_image(temp_path)
             return None
         
     except Exception as e:
@@ -317,7 +326,7 @@ async def handle_send_trade_summary(request: Request, bot) -> Dict:
 
     # 解析 JSON
     try:
-        data = await request.json()
+        data = parse_json(await request.body())
         logger.info(f"[TradeSummary] 成功解析 JSON 數據: {list(data.keys())}")
     except Exception as e:
         logger.error(f"[TradeSummary] JSON 解析失敗: {e}")
@@ -325,19 +334,44 @@ async def handle_send_trade_summary(request: Request, bot) -> Dict:
 
     # 資料驗證
     try:
-        validate_trade_summary(data)
+        signal = validate_trade_summary(data)
         logger.info("[TradeSummary] 數據驗證通過")
     except ValueError as err:
         logger.error(f"[TradeSummary] 數據驗證失敗: {err}")
         return {"status": "400", "message": str(err)}
 
+    # 冪等：時間窗內的重複請求（上游重試）直接忽略
+    dedup_key = trade_summary_dedup_key(signal)
+    if dedup_window.seen("trade_summary", dedup_key):
+        logger.info(f"[TradeSummary] 重複請求，已忽略: {dedup_key}")
+        return {"status": "200", "message": "重複請求，已忽略"}
+
     # 背景處理：在 Discord 事件迴圈執行
     logger.info("[TradeSummary] 開始背景處理，調度到 Discord 事件迴圈")
     try:
-        asyncio.run_coroutine_threadsafe(process_trade_summary_discord(data, bot), bot.loop)
+        signal_id = outbox.record("trade_summary", data)
+        trader_uid = signal.trader_uid
+        flush_pending_scalps(trader_uid, bot)
+        rejected = ingest_queues.submit(
+            "trade_summary", lambda: outbox.track(signal_id, process_trade_summary_discord(data, bot, signal=signal)), key=trader_uid
+        )
+        if rejected:
+            logger.warning(f"[TradeSummary] 處理佇列已滿或尚未就緒 ({rejected})，拒絕請求")
+            outbox.complete(signal_id)
+            dedup_window.forget("trade_summary", dedup_key)
+            return ingest_queues.reject_response(rejected)
         logger.info("[TradeSummary] 成功調度背景任務")
     except Exception as e:
         logger.error(f"[TradeSummary] 調度背景任務失敗: {e}")
+        dedup_window.forget("trade_summary", dedup_key)
         return {"status": "500", "message": "Internal server error"}
     
-    return {"status": "200", "message": "接收成功，稍後發送"} 
\ No newline at end of file
+    return {"status": "200", "message": "接收成功，稍後發送"}
+
+
+async def handle_send_trade_summary_batch(request: Request, bot) -> Dict:
+    """處理 /api/discord/trade_summary/batch 介面：交易總結陣列逐筆驗證，依交易員分組排入有序 lane"""
+    return await handle_batch(
+        "trade_summary", validate_trade_summary, trade_summary_dedup_key, process_trade_summary_discord, request, bot,
+        before_submit=lambda trader_uid: flush_pending_scalps(trader_uid, bot),
+    )
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+from dotenv import load_dotenv
+
+from .http_pool import http_sessions, timeout
+from .delivery import delivery_scheduler
+from .outbox import outbox
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 使用 webhook 發送的 topicId（逗號分隔，"*" 表示全部）；未設定時全部走 bot 發送
+WEBHOOK_TOPICS = {t.strip() for t in os.getenv("WEBHOOK_TOPICS", "").split(",") if t.strip()}
+WEBHOOK_NAME = os.getenv("WEBHOOK_NAME", "BYD Signal")
+# Discord API 位址，測試時可指向本地假伺服器
+DISCORD_WEBHOOK_BASE_URL = os.getenv("DISCORD_WEBHOOK_BASE_URL", "https://discord.com/api/v10").rstrip("/")
+# 取得 webhook 失敗（例如缺少 Manage Webhooks 權限）後，多久內不再嘗試（秒）
+WEBHOOK_RETRY_SECONDS = float(os.getenv("WEBHOOK_RETRY_SECONDS", "300"))
+
+# (webhook_id, token)
+WebhookCredentials = Tuple[int, str]
+
+
+def use_webhook(topic_id: str) -> bool:
+    """該 topic 是否設定為 webhook 發送"""
+    return "*" in WEBHOOK_TOPICS or str(topic_id) in WEBHOOK_TOPICS
+
+
+class WebhookError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"webhook 回應錯誤: {status} {message}")
+        self.status = status
+
+
+class WebhookRegistry:
+    """每個頻道建立並快取一個 webhook，訊號直接 POST 到 webhook URL。
+
+    - webhook 有獨立於 bot 的速率限制，且發送時不需要 gateway 狀態
+    - 取得 webhook 失敗的頻道在 WEBHOOK_RETRY_SECONDS 內直接回退 bot 發送
+    - webhook 被刪除（404）時清除快取，下次重新建立
+    """
+
+    def __init__(self, base_url: str = DISCORD_WEBHOOK_BASE_URL, name: str = WEBHOOK_NAME):
+        self.base_url = base_url
+        self.name = name
+        self._credentials: Dict[int, WebhookCredentials] = {}
+        self._failed_until: Dict[int, float] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self.stats = {"sent": 0, "failed": 0, "created": 0, "fallbacks": 0}
+
+    def remember(self, channel_id: int, webhook_id: int, token: str) -> None:
+        """直接登記頻道的 webhook（例如由設定或測試提供）"""
+        self._credentials[channel_id] = (int(webhook_id), token)
+
+    def forget(self, channel_id: int) -> None:
+        self._credentials.pop(channel_id, None)
+
+    async def _resolve(self, bot, channel_id: int) -> Optional[WebhookCredentials]:
+        channel = bot.get_channel(channel_id)
+        if not channel:
+            return None
+        hooks = await channel.webhooks()
+        hook = next((h for h in hooks if h.name == self.name and h.token), None)
+        if hook is None:
+            hook = await channel.create_webhook(name=self.name, reason="signal delivery")
+            self.stats["created"] += 1
+            logger.info(f"[Webhook] 已為頻道 {channel_id} 建立 webhook")
+        return (hook.id, hook.token)
+
+    async def get(self, bot, channel_id: int) -> Optional[WebhookCredentials]:
+        """取得頻道的 webhook，無法取得時回傳 None"""
+        credentials = self._credentials.get(channel_id)
+        if credentials:
+            return credentials
+        if self._failed_until.get(channel_id, 0) > time.monotonic():
+            return None
+        lock = self._locks.setdefault(channel_id, asyncio.Lock())
+        async with lock:
+            credentials = self._credentials.get(channel_id)
+            if credentials:
+                return credentials
+            try:
+                credentials = await self._resolve(bot, channel_id)
+            except Exception as e:
+                logger.warning(f"[Webhook] 取得頻道 {channel_id} 的 webhook 失敗: {type(e).__name__} - {e}")
+                credentials = None
+            if credentials is None:
+                self._failed_until[channel_id] = time.monotonic() + WEBHOOK_RETRY_SECONDS
+                return None
+            self._credentials[channel_id] = credentials
+            return credentials
+
+    async def execute(self, credentials: WebhookCredentials, content: str,
+                      image_path: Optional[str] = None, filename: Optional[str] = None) -> None:
+        """POST 到 webhook，失敗時拋出 WebhookError"""
+        webhook_id, token = credentials
+        url = f"{self.base_url}/webhooks/{webhook_id}/{token}"
+        payload = {"content": content, "allowed_mentions": {"parse": []}}
+        session = http_sessions.get(url)
+        if image_path:
+            form = aiohttp.FormData()
+            form.add_field("payload_json", json.dumps(payload), content_type="application/json")
+            with open(image_path, "rb") as f:
+                form.add_field("files[0]", f.read(), filename=filename or os.path.basename(image_path))
+            request = session.post(url, data=form, timeout=timeout(15))
+        else:
+            request = session.post(url, json=payload, timeout=timeout(15))
+        async with request as resp:
+            if resp.status >= 300:
+                raise WebhookError(resp.status, await resp.text())
+
+    async def send(self, bot, channel_id: int, priority: int, content: str,
+                   image_path: Optional[str] = None, filename: Optional[str] = None) -> bool:
+        """經由 webhook 發送，回傳 False 表示呼叫端應回退 channel.send"""
+        credentials = await self.get(bot, channel_id)
+        if credentials is None:
+            self.stats["fallbacks"] += 1
+            return False
+        target = outbox.begin_delivery(channel_id)
+        if target is None:
+            return True
+        try:
+            await delivery_scheduler.submit(
+                priority, f"webhook:{credentials[0]}",
+                lambda: self.execute(credentials, content, image_path, filename)
+            )
+        except Exception as e:
+            self.stats["failed"] += 1
+            self.stats["fallbacks"] += 1
+            if isinstance(e, WebhookError) and e.status == 404:
+                self.forget(channel_id)
+            logger.warning(f"[Webhook] 頻道 {channel_id} webhook 發送失敗，回退 bot 發送: {type(e).__name__} - {e}")
+            outbox.release_delivery(channel_id)
+            return False
+        outbox.mark_delivered(target)
+        self.stats["sent"] += 1
+        return True
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "channels": len(self._credentials), "topics": sorted(WEBHOOK_TOPICS)}
+
+
+webhook_registry = WebhookRegistry()
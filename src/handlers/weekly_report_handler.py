@@ -2,13 +2,20 @@ import os
 import asyncio
 import logging
 import discord
-import aiohttp
 from fastapi import Request
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from .common import (
-    get_push_targets, format_float, create_async_response,
+    get_push_targets, format_float,
     generate_trader_summary_image, get_i18n, normalize_locale
 )
+from .outbox import outbox
+from .schemas import parse_json, WeeklyReport
+from .ingest import ingest_queues
+from .dedup import dedup_window, payload_digest
+from .channel_access import channel_access
+from .channel_health import can_deliver
+from .delivery import deliver, PRIORITY_REPORT
+from .attachments import stage_image, image_embed, remove_image, stats as attachment_counters
 
 logger = logging.getLogger(__name__)
 
@@ -18,18 +25,34 @@ async def handle_weekly_report(request: Request, bot) -> Dict[str, Any]:
     """
     try:
         # 解析 JSON
-        data = await request.json()
+        data = parse_json(await request.body())
         logger.info(f"收到週報請求: {data.get('trader_uid', 'unknown')}")
         
         # 資料驗證
         try:
-            validate_weekly_report(data)
+            report = validate_weekly_report(data)
         except ValueError as err:
             logger.error(f"週報資料驗證失敗: {err}")
             return {"status": "error", "message": str(err)}
         
+        # 冪等：時間窗內的重複請求（上游重試）直接忽略
+        dedup_key = payload_digest(data)
+        if dedup_window.seen("weekly_report", dedup_key):
+            logger.info(f"重複的週報請求，已忽略: {data.get('trader_uid')}")
+            return {"status": "success", "message": "重複請求，已忽略"}
+
         # 背景處理，不阻塞 HTTP 回應
-        asyncio.run_coroutine_threadsafe(process_weekly_report(data, bot), bot.loop)
+        signal_id = outbox.record("weekly_report", data)
+        try:
+            rejected = ingest_queues.submit("weekly_report", lambda: outbox.track(signal_id, process_weekly_report(data, bot, report)))
+        except Exception:
+            dedup_window.forget("weekly_report", dedup_key)
+            raise
+        if rejected:
+            logger.warning(f"週報處理佇列已滿或尚未就緒 ({rejected})，拒絕請求")
+            outbox.complete(signal_id)
+            dedup_window.forget("weekly_report", dedup_key)
+            return ingest_queues.reject_response(rejected)
         
         return {"status": "success", "message": "週報推送已開始處理"}
         
@@ -37,38 +60,17 @@ async def handle_weekly_report(request: Request, bot) -> Dict[str, Any]:
         logger.error(f"處理週報請求時發生錯誤: {e}")
         return {"status": "error", "message": "內部服務錯誤"}
 
-def validate_weekly_report(data: dict) -> None:
-    """驗證週報請求資料，失敗時拋出 ValueError。"""
-    required_fields = {
-        "trader_uid", "trader_name", "trader_url", "trader_detail_url",
-        "total_roi", "total_pnl", "total_trades",
-        "win_trades", "loss_trades", "win_rate"
-    }
-
-    missing = [f for f in required_fields if not data.get(f)]
-    if missing:
-        raise ValueError(f"缺少欄位: {', '.join(missing)}")
+def validate_weekly_report(data: dict) -> WeeklyReport:
+    """驗證週報請求資料並回傳已轉型的模型，失敗時拋出 ValueError。"""
+    return WeeklyReport.check(data)
 
-    # 數值檢查
+async def process_weekly_report(data: dict, bot, report: Optional[WeeklyReport] = None) -> None:
+    """背景協程：處理週報推送；report 未提供時（例如 outbox 重送）由 data 重新驗證"""
+    img_path = None
     try:
-        float(data["total_roi"])
-        float(data["total_pnl"])
-        int(data["total_trades"])
-        int(data["win_trades"])
-        int(data["loss_trades"])
-        float(data["win_rate"])
-    except (TypeError, ValueError):
-        raise ValueError("數值欄位必須為正確的數字格式")
-
-    # 驗證勝率範圍
-    win_rate = float(data["win_rate"])
-    if not (0 <= win_rate <= 100):
-        raise ValueError("勝率必須在 0-100 之間")
-
-async def process_weekly_report(data: dict, bot) -> None:
-    """背景協程：處理週報推送"""
-    try:
-        trader_uid = str(data["trader_uid"])
+        if report is None:
+            report = validate_weekly_report(data)
+        trader_uid = report.trader_uid
         logger.info(f"開始處理週報推送: {trader_uid}")
 
         # 獲取推送目標
@@ -80,36 +82,39 @@ async def process_weekly_report(data: dict, bot) -> None:
             return
 
         # 生成週報圖片
-        img_path = await generate_weekly_report_image(data)
+        img_path = await generate_weekly_report_image(data, report)
         if not img_path:
             logger.warning("週報圖片生成失敗，取消推送")
             return
 
+        # 設定公開圖片網址時圖片只寫入一次，各頻道以 embed 引用其固定網址
+        image_url = await stage_image(img_path, "weekly_report.png")
+
         # 準備發送任務
         tasks = []
+        # 同語言、同連結設定的頻道只渲染一次
+        rendered = {}
         for chat_id, topic_id, jump, channel_lang in push_targets:
             try:
-                channel = bot.get_channel(int(chat_id))
-                if not channel:
-                    logger.warning(f"找不到頻道: {chat_id}")
-                    continue
-                
-                # 檢查權限
-                permissions = channel.permissions_for(channel.guild.me)
-                if not permissions.send_messages:
-                    logger.warning(f"在頻道 {chat_id} 中沒有發送消息的權限")
+                if not can_deliver(bot, chat_id):
                     continue
+                # 頻道與權限取自快取，權限變更時由事件清除
+                access = channel_access.get(bot, chat_id)
                 
                 # 格式化消息 - 根據 jump 值決定是否包含連結
-                include_link = (jump == "1")
-                content = format_weekly_report_text(data, include_link, channel_lang)
+                render_key = (normalize_locale(channel_lang), jump == "1")
+                content = rendered.get(render_key)
+                if content is None:
+                    content = format_weekly_report_text(data, report, render_key[1], render_key[0])
+                    rendered[render_key] = content
                 
                 # 創建發送任務
                 task = send_discord_weekly_report(
-                    channel=channel,
+                    channel=access.channel,
                     content=content,
                     image_path=img_path,
-                    permissions=permissions
+                    access=access,
+                    image_url=image_url
                 )
                 tasks.append(task)
                 
@@ -126,18 +131,38 @@ async def process_weekly_report(data: dict, bot) -> None:
 
     except Exception as e:
         logger.error(f"推送週報失敗: {e}")
+    finally:
+        # 所有頻道都已發送完畢，刪除本次的暫存圖片
+        remove_image(img_path)
 
-async def send_discord_weekly_report(channel, content: str, image_path: str, permissions) -> bool:
+async def send_discord_weekly_report(channel, content: str, image_path: str, access, image_url: str = None) -> bool:
     """發送週報到Discord頻道"""
     try:
-        if image_path and os.path.exists(image_path) and permissions.attach_files:
+        if image_url and access.can_embed:
+            # 引用已公開的圖片，不重新上傳
+            try:
+                await deliver(PRIORITY_REPORT, channel.id, lambda: channel.send(
+                    content=content,
+                    embed=image_embed(image_url)
+                ))
+                attachment_counters["embed_sends"] += 1
+                logger.info(f"成功發送週報到頻道: {channel.name} ({channel.id})")
+                return True
+            except discord.HTTPException as e:
+                # 公開圖片無法引用時，本機圖片仍在，改為直接上傳
+                attachment_counters["embed_fallbacks"] += 1
+                logger.warning(f"引用公開圖片發送週報到頻道 {channel.id} 失敗，改為直接上傳: {e}")
+
+        if image_path and os.path.exists(image_path) and access.can_attach:
             # 發送帶圖片的消息
-            with open(image_path, "rb") as image_file:
-                file = discord.File(image_file, filename="weekly_report.png")
-                await channel.send(content=content, file=file)
+            await deliver(PRIORITY_REPORT, channel.id, lambda: channel.send(
+                content=content,
+                file=discord.File(image_path, filename="weekly_report.png")
+            ))
+            attachment_counters["direct_uploads"] += 1
         else:
             # 只發送文字消息
-            await channel.send(content=content)
+            await deliver(PRIORITY_REPORT, channel.id, lambda: channel.send(content=content))
         
         logger.info(f"成功發送週報到頻道: {channel.name} ({channel.id})")
         return True
@@ -146,25 +171,24 @@ async def send_discord_weekly_report(channel, content: str, image_path: str, per
         logger.error(f"發送週報到頻道 {channel.id} 失敗: {e}")
         return False
 
-def format_weekly_report_text(data: dict, include_link: bool = True, lang: str = None) -> str:
-    """格式化週報文本（i18n）"""
+def format_weekly_report_text(data: dict, report: WeeklyReport, include_link: bool = True, lang: str = None) -> str:
+    """格式化週報文本（i18n）；數值取自已轉型的 report"""
     i18n = get_i18n()
     locale = normalize_locale(lang)
 
-    total_trades = int(data.get("total_trades", 0))
-    win_trades = int(data.get("win_trades", 0))
-    win_rate = float(data.get("win_rate", 0))
-    loss_trades = int(data.get("loss_trades", max(total_trades - win_trades, 0)))
+    total_trades = report.total_trades
+    win_trades = report.win_trades
+    loss_trades = report.loss_trades
 
     # CSV 顯示為百分比，80% 就是 80
-    total_roi = format_float(float(data.get("total_roi", 0)) * 100)
+    total_roi = format_float(report.total_roi * 100)
     # 勝率以 wins/total 自算，避免傳入為 0.8 造成 80*100
     if total_trades > 0:
-        win_rate = format_float((win_rate) * 100)
+        win_rate = format_float(report.win_rate * 100)
     else:
         win_rate = "0"
 
-    is_positive = float(data.get("total_roi", 0)) >= 0
+    is_positive = report.total_roi >= 0
     roi_emoji = "🔥" if is_positive else "📉"
 
     text = (
@@ -183,25 +207,20 @@ def format_weekly_report_text(data: dict, include_link: bool = True, lang: str =
 
     return text
 
-async def generate_weekly_report_image(data: dict) -> str:
-    """生成週報圖片 - 使用 generate_trader_summary_image 函數"""
+async def generate_weekly_report_image(data: dict, report: WeeklyReport) -> str:
+    """生成週報圖片 - 使用 generate_trader_summary_image 函數，回傳本次專用的暫存圖片路徑"""
     try:
         # 調用 generate_trader_summary_image 函數
         img_path = await generate_trader_summary_image(
             trader_url=data.get("trader_url", ""),
             trader_name=data.get("trader_name", "Unknown"),
-            pnl_percentage=data.get("total_roi", 0),
-            pnl=data.get("total_pnl", 0)
+            pnl_percentage=report.total_roi,
+            pnl=report.total_pnl
         )
         
         if img_path:
-            # 複製圖片到週報專用的臨時文件
-            import shutil
-            import tempfile
-            weekly_img_path = os.path.join(tempfile.gettempdir(), "weekly_report.png")
-            shutil.copy2(img_path, weekly_img_path)
-            logger.info(f"週報圖片生成成功: {weekly_img_path}")
-            return weekly_img_path
+            logger.info(f"週報圖片生成成功: {img_path}")
+            return img_path
         else:
             logger.error("generate_trader_summary_image 返回空路徑")
             return None
@@ -1,29 +1,40 @@
 import io
 import re
 import os
+import time
 import discord
 import logging
 from logging.handlers import RotatingFileHandler
 import asyncio
-import aiohttp
-import aiofiles
 import uvicorn
 from discord.ext import commands, tasks
 from discord.ui import Button, View, Modal, TextInput
 from discord import ButtonStyle, TextStyle
 from dotenv import load_dotenv
 from db_handler_aio import *
-from typing import Dict, Optional
+from typing import Any, Dict, Optional
 from functools import lru_cache
 from discord.ext.commands import CommandNotFound
 from fastapi import FastAPI, Query, Request, BackgroundTasks
+from fastapi.staticfiles import StaticFiles
 from threading import Thread
 from typing import Union
-from handlers.copy_signal_handler import handle_send_copy_signal
-from handlers.trade_summary_handler import handle_send_trade_summary
-from handlers.scalp_update_handler import handle_send_scalp_update
-from handlers.holding_report_handler import handle_holding_report
-from handlers.weekly_report_handler import handle_weekly_report
+from handlers.copy_signal_handler import handle_send_copy_signal, handle_send_copy_signal_batch, process_copy_signal_discord
+from handlers.trade_summary_handler import handle_send_trade_summary, handle_send_trade_summary_batch, process_trade_summary_discord
+from handlers.scalp_update_handler import handle_send_scalp_update, process_scalp_update_discord, scalp_coalescer
+from handlers.holding_report_handler import handle_holding_report, handle_holding_report_stream, process_holding_report_discord
+from handlers.weekly_report_handler import handle_weekly_report, process_weekly_report
+from handlers.outbox import outbox
+from handlers.dedup import dedup_window, payload_digest
+from handlers.report_index import holding_report_index
+from handlers.channel_access import channel_access
+from handlers.channel_health import channel_health
+from handlers.ingest import ingest_queues, call_on_loop, LANE_KINDS
+from handlers.routing import routing_table
+from handlers.http_pool import http_sessions, timeout
+from handlers.delivery import deliver, delivery_scheduler, PRIORITY_BULK
+from handlers.attachments import get_stats as attachment_stats, ATTACHMENT_PUBLIC_BASE_URL, ATTACHMENT_PUBLIC_DIR
+from handlers.webhooks import webhook_registry, DISCORD_WEBHOOK_BASE_URL
 from multilingual_utils import get_multilingual_content, AI_TRANSLATE_HINT, LANGUAGE_CODE_MAPPING, get_uid_already_verified_message
 
 # 統一日誌：集中到 root，避免子 logger 重複輸出，並啟用文件輪轉
@@ -63,12 +74,26 @@ _configure_logging()
 load_dotenv()
 app = FastAPI()
 
+# 報告圖片的公開目錄：ATTACHMENT_PUBLIC_BASE_URL 需對外指向此路徑（或由其他靜態伺服器提供同一目錄）
+if ATTACHMENT_PUBLIC_BASE_URL:
+    app.mount("/media", StaticFiles(directory=ATTACHMENT_PUBLIC_DIR, check_dir=False), name="media")
+
 WELCOME_API = os.getenv("WELCOME_API")
 VERIFY_API = os.getenv("VERIFY_API")
 DETAIL_API = os.getenv("DETAIL_API")
 SOCIAL_API = os.getenv("SOCIAL_API")
 MESSAGE_API_URL = os.getenv("MESSAGE_API_URL")
 UPDATE_MESSAGE_API_URL = os.getenv("UPDATE_MESSAGE_API_URL")
+# 文章推送的並發頻道數與單一頻道發送時限（秒）
+ARTICLE_FANOUT_CONCURRENCY = int(os.getenv("ARTICLE_FANOUT_CONCURRENCY", "10"))
+ARTICLE_SEND_TIMEOUT = float(os.getenv("ARTICLE_SEND_TIMEOUT", "30"))
+# 公告推送的並發頻道數與單一頻道發送時限（秒）
+ANNOUNCEMENT_CONCURRENCY = int(os.getenv("ANNOUNCEMENT_CONCURRENCY", "10"))
+ANNOUNCEMENT_SEND_TIMEOUT = float(os.getenv("ANNOUNCEMENT_SEND_TIMEOUT", "15"))
+# 文章已發布回報的並發請求數
+PUBLISH_ACK_CONCURRENCY = int(os.getenv("PUBLISH_ACK_CONCURRENCY", "8"))
+# FastAPI 與 Discord bot 共用同一個事件迴圈（預設關閉，API 在獨立執行緒運行）
+API_SINGLE_LOOP = os.getenv("API_SINGLE_LOOP", "false").lower() in ("1", "true", "yes")
 
 # Bot initialization
 TOKEN = (
@@ -172,30 +197,30 @@ def _ensure_rtl_text(text: str, lang_key: str) -> str:
             return f"\u200E{text}"
     return text
 
-async def _fetch_group_lang_from_detail(verify_group_id: int) -> str:
-    """從 DETAIL_API 查詢群組語言，回傳本地字典鍵（例如 'en'/'zh'/...）。失敗回 'en'。"""
+async def _request_group_lang_from_detail(verify_group_id: int) -> Optional[str]:
+    """從 DETAIL_API 查詢群組語言，回傳本地字典鍵（例如 'en'/'zh'/...）。失敗回 None。"""
     try:
         if not DETAIL_API:
             logging.warning("[Verify] DETAIL_API is not set; fallback to 'en'")
-            return "en"
+            return None
         logging.info(f"[Verify] Fetching group language from DETAIL_API, group={verify_group_id}")
         payload = {"verifyGroup": verify_group_id, "brand": "BYD", "type": "DISCORD"}
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(DETAIL_API, data=payload) as resp:
-                    logging.info(f"[Verify] DETAIL_API status={resp.status}")
-                    if resp.status != 200:
-                        logging.warning("[Verify] DETAIL_API non-200 response; fallback to 'en'")
-                        return "en"
-                    try:
-                        data = await resp.json()
-                        logging.info(f"[Verify] DETAIL_API response keys={list(data.keys())}")
-                    except Exception:
-                        logging.exception("[Verify] DETAIL_API JSON parse failed; fallback to 'en'")
-                        return "en"
-            except Exception:
-                logging.exception("[Verify] DETAIL_API request failed; fallback to 'en'")
-                return "en"
+        session = http_sessions.get(DETAIL_API)
+        try:
+            async with session.post(DETAIL_API, data=payload, timeout=timeout(5)) as resp:
+                logging.info(f"[Verify] DETAIL_API status={resp.status}")
+                if resp.status != 200:
+                    logging.warning("[Verify] DETAIL_API non-200 response; fallback to 'en'")
+                    return None
+                try:
+                    data = await resp.json()
+                    logging.info(f"[Verify] DETAIL_API response keys={list(data.keys())}")
+                except Exception:
+                    logging.exception("[Verify] DETAIL_API JSON parse failed; fallback to 'en'")
+                    return None
+        except Exception:
+            logging.exception("[Verify] DETAIL_API request failed; fallback to 'en'")
+            return None
         lang = (
             (data.get("data", {}).get("lang") if isinstance(data.get("data"), dict) else None)
             or data.get("lang")
@@ -206,6 +231,60 @@ async def _fetch_group_lang_from_detail(verify_group_id: int) -> str:
         return lang_key
     except Exception:
         logging.exception("[Verify] DETAIL_API unexpected error; fallback to 'en'")
+        return None
+
+class GroupLangCache:
+    """驗證群組語言快取：成功結果依 TTL 快取，失敗結果以較短 TTL 負向快取"""
+
+    def __init__(self, ttl: float, negative_ttl: float):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # verify_group_id -> (lang_key, expires_at, is_negative)
+        self._cache: Dict[int, tuple] = {}
+        self._inflight: Dict[int, asyncio.Future] = {}
+        self.stats = {"hits": 0, "misses": 0, "negative_hits": 0}
+
+    async def get(self, verify_group_id: int) -> str:
+        key = int(verify_group_id)
+        cached = self._cache.get(key)
+        now = time.monotonic()
+        if cached and cached[1] > now:
+            lang_key, _, negative = cached
+            self.stats["negative_hits" if negative else "hits"] += 1
+            return lang_key
+
+        self.stats["misses"] += 1
+        # 同一群組的並發查詢共用同一個 DETAIL_API 請求
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(_request_group_lang_from_detail(key))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        lang_key = await asyncio.shield(future)
+
+        if lang_key is None:
+            self._cache[key] = ("en", time.monotonic() + self.negative_ttl, True)
+            return "en"
+        self._cache[key] = (lang_key, time.monotonic() + self.ttl, False)
+        return lang_key
+
+    def invalidate(self, verify_group_id: int) -> None:
+        self._cache.pop(int(verify_group_id), None)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "entries": len(self._cache)}
+
+group_lang_cache = GroupLangCache(
+    ttl=float(os.getenv("GROUP_LANG_TTL_SECONDS", "3600")),
+    negative_ttl=float(os.getenv("GROUP_LANG_NEGATIVE_TTL_SECONDS", "60")),
+)
+
+async def _fetch_group_lang_from_detail(verify_group_id: int) -> str:
+    """查詢群組語言（優先讀取快取），回傳本地字典鍵。失敗回 'en'。"""
+    try:
+        return await group_lang_cache.get(verify_group_id)
+    except Exception:
+        logging.exception("[Verify] group language lookup failed; fallback to 'en'")
         return "en"
 
 class ChannelManager:
@@ -232,47 +311,36 @@ class ChannelManager:
             del self.channel_cache[guild_id]
 
 class MessagePublisher:
-    def __init__(self, bot, session):
+    def __init__(self, bot):
         self.bot = bot
-        self.session = session
         # topic_name -> list of dict: {"channel_id": int, "lang": str}
         self.topic_to_channel_map = {}
 
     async def refresh_social_mapping(self):
         """Refresh the topic to channel mapping, now with lang info"""
-        payload = {
-            "brand": "BYD",
-            "type": "DISCORD"
-        }
-
-        async with self.session.post(SOCIAL_API, data=payload) as response:
-            if response.status != 200:
-                raise ValueError("Failed to fetch social data")
-
-            social_data = await response.json()
-            social_groups = social_data.get("data", [])
-
-            # Update mapping
-            self.topic_to_channel_map.clear()
-            for group in social_groups:
-                # lang 在 group 層級，不是 chat 層級
-                group_lang = group.get("lang", "en_US")
-                for chat in group.get("chats", []):
-                    if chat.get("enable", False):
-                        topic = chat["name"]
-                        channel_id = int(chat["chatId"])
-                        if topic not in self.topic_to_channel_map:
-                            self.topic_to_channel_map[topic] = []
-                        
-                        # 檢查是否已經存在相同的 channel_id，避免重複添加
-                        existing_channels = [ch["channel_id"] for ch in self.topic_to_channel_map[topic]]
-                        if channel_id not in existing_channels:
-                            self.topic_to_channel_map[topic].append({"channel_id": channel_id, "lang": group_lang})
-                        else:
-                            logging.warning(f"主題 '{topic}' 中已存在頻道 ID {channel_id}，跳過重複添加")
+        social_groups = await routing_table.get_groups()
+
+        # Update mapping
+        self.topic_to_channel_map.clear()
+        for group in social_groups:
+            # lang 在 group 層級，不是 chat 層級
+            group_lang = group.get("lang", "en_US")
+            for chat in group.get("chats", []):
+                if chat.get("enable", False):
+                    topic = chat["name"]
+                    channel_id = int(chat["chatId"])
+                    if topic not in self.topic_to_channel_map:
+                        self.topic_to_channel_map[topic] = []
+                    
+                    # 檢查是否已經存在相同的 channel_id，避免重複添加
+                    existing_channels = [ch["channel_id"] for ch in self.topic_to_channel_map[topic]]
+                    if channel_id not in existing_channels:
+                        self.topic_to_channel_map[topic].append({"channel_id": channel_id, "lang": group_lang})
+                    else:
+                        logging.warning(f"主題 '{topic}' 中已存在頻道 ID {channel_id}，跳過重複添加")
 
-    async def handle_image(self, image_url, article_id):
-        """Handle image download and return file path"""
+    async def download_image(self, image_url) -> Optional[bytes]:
+        """下載文章圖片，回傳圖片內容（每篇文章只下載一次，供所有頻道共用）"""
         if not image_url:
             return None
 
@@ -281,26 +349,20 @@ class MessagePublisher:
             # image_url = f"http://172.25.183.139:5003{image_url}"
             # image_url = f"http://127.0.0.1:5003{image_url}"
 
-        pics_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pics")
-        os.makedirs(pics_dir, exist_ok=True)
-        temp_file_path = os.path.join(pics_dir, f"temp_image_{article_id}.jpg")
-
-        async with self.session.get(image_url) as response:
+        session = http_sessions.get(image_url)
+        async with session.get(image_url, timeout=timeout(30)) as response:
             if response.status != 200:
                 logging.error(f"Failed to download image: {image_url}")
                 return None
-
-            async with aiofiles.open(temp_file_path, "wb") as f:
-                await f.write(await response.read())
-
-        return temp_file_path
+            return await response.read()
 
     async def mark_as_published(self, article_id):
         """標記文章為已發布"""
         try:
             current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             update_payload = {"id": article_id, "is_sent_dc": 1}
-            async with self.session.post(UPDATE_MESSAGE_API_URL, json=update_payload) as response:
+            session = http_sessions.get(UPDATE_MESSAGE_API_URL)
+            async with session.post(UPDATE_MESSAGE_API_URL, json=update_payload, timeout=timeout(10)) as response:
                 response_text = await response.text()
                 if response.status != 200:
                     logging.error(f"標記文章 {article_id} 為已發布失敗: 狀態碼 {response.status}, 回應: {response_text} - 時間: {current_time}")
@@ -312,12 +374,74 @@ class MessagePublisher:
             logging.error(f"標記文章 {article_id} 為已發布時發生錯誤: {type(e).__name__} - {e} - 時間: {current_time}")
             return False
 
+class PublishAckBuffer:
+    """文章已發布回報的緩衝區：每輪結束時集中回報一次。
+
+    UPDATE_MESSAGE_API_URL 每次只接受單一文章（{"id", "is_sent_dc"}），沒有批次端點，
+    因此仍是每篇文章一次請求，只是集中在每輪結束時以有限並發送出。
+    回報失敗（含例外）的文章留在緩衝區於下一輪重試，重試成功前不會被重複發送。
+    """
+
+    def __init__(self, concurrency: int = PUBLISH_ACK_CONCURRENCY):
+        self.concurrency = concurrency
+        # article_id -> 失敗次數
+        self._pending: Dict[Any, int] = {}
+        self.stats = {"acked": 0, "retries": 0, "flushes": 0}
+
+    def add(self, article_id) -> None:
+        self._pending.setdefault(article_id, 0)
+
+    def is_pending(self, article_id) -> bool:
+        return article_id in self._pending
+
+    async def flush(self, publisher: "MessagePublisher") -> None:
+        if not self._pending:
+            return
+        article_ids = list(self._pending)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def ack(article_id) -> bool:
+            async with semaphore:
+                return await publisher.mark_as_published(article_id)
+
+        results = await asyncio.gather(*(ack(article_id) for article_id in article_ids), return_exceptions=True)
+        self.stats["flushes"] += 1
+        for article_id, ok in zip(article_ids, results):
+            if ok is True:
+                self._pending.pop(article_id, None)
+                self.stats["acked"] += 1
+            else:
+                self._pending[article_id] += 1
+                self.stats["retries"] += 1
+        if self._pending:
+            logging.warning(f"{len(self._pending)} 篇文章標記已發布失敗，下一輪重試: {list(self._pending)}")
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "pending": len(self._pending)}
+
+publish_acks = PublishAckBuffer()
+
 class OptimizedBot(commands.Bot):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.channel_manager = ChannelManager()
         self.verified_users = {}
 
+    async def setup_hook(self):
+        # 路由表在 bot 事件迴圈上定時刷新，供各 handler 以 O(1) 查詢推送目標
+        await http_sessions.start([SOCIAL_API, DETAIL_API, VERIFY_API, MESSAGE_API_URL, UPDATE_MESSAGE_API_URL, DISCORD_WEBHOOK_BASE_URL])
+        routing_table.start()
+        ingest_queues.start()
+
+    async def close(self):
+        await routing_table.stop()
+        await ingest_queues.stop()
+        await delivery_scheduler.stop()
+        await holding_report_index.flush()
+        await super().close()
+        await http_sessions.close()
+        await asyncio.to_thread(outbox.close)
+
     @lru_cache(maxsize=1000)
     def get_admin_mention(self, guild_id: int) -> str:
         """Cache admin mention for each guild"""
@@ -365,11 +489,21 @@ bot = OptimizedBot(command_prefix="!", intents=intents)
 async def send_copy_signal_to_discord(request: Request):
     return await handle_send_copy_signal(request, bot)
 
+# 註冊 Copy-Signal 批次端點
+@app.post("/api/discord/copy_signal/batch")
+async def send_copy_signal_batch_to_discord(request: Request):
+    return await handle_send_copy_signal_batch(request, bot)
+
 # 註冊 Trade Summary 端點
 @app.post("/api/discord/trade_summary")
 async def send_trade_summary_to_discord(request: Request):
     return await handle_send_trade_summary(request, bot)
 
+# 註冊 Trade Summary 批次端點
+@app.post("/api/discord/trade_summary/batch")
+async def send_trade_summary_batch_to_discord(request: Request):
+    return await handle_send_trade_summary_batch(request, bot)
+
 # 註冊 Scalp Update 端點
 @app.post("/api/discord/scalp_update")
 async def send_scalp_update_to_discord(request: Request):
@@ -380,6 +514,11 @@ async def send_scalp_update_to_discord(request: Request):
 async def send_holding_report_to_discord(request: Request):
     return await handle_holding_report(request, bot)
 
+# 註冊 Holding Report NDJSON 串流端點
+@app.post("/api/report/holdings/stream")
+async def stream_holding_report_to_discord(request: Request):
+    return await handle_holding_report_stream(request, bot)
+
 # 註冊 Weekly Report 端點
 @app.post("/api/report/weekly")
 async def send_weekly_report_to_discord(request: Request):
@@ -458,8 +597,8 @@ class UIDInputModal(Modal):
                 "type": "DISCORD"
             }
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(VERIFY_API, data=payload) as response:
+            async with http_sessions.borrow(VERIFY_API) as session:
+                async with session.post(VERIFY_API, data=payload, timeout=timeout(10)) as response:
                     data = await response.json()
                     print(f"response: {data}")
                     # 兼容新結構：data: { lang, msg }
@@ -539,6 +678,8 @@ class VerifyView(View):
         await interaction.response.send_modal(UIDInputModal())
 
 # 註冊持久化視圖
+_outbox_replayed = False
+
 @bot.event
 async def on_ready():
     print(f"Bot is ready. Logged in as {bot.user}")
@@ -549,6 +690,20 @@ async def on_ready():
     # 啟動定時任務
     fetch_unpublished_messages.start()
 
+    # 補發上次執行未完成的訊號（僅首次 ready）
+    global _outbox_replayed
+    if not _outbox_replayed:
+        _outbox_replayed = True
+        await outbox.replay({
+            "copy_signal": lambda data: process_copy_signal_discord(data, bot),
+            "scalp_update": lambda data: process_scalp_update_discord(data, bot),
+            "trade_summary": lambda data: process_trade_summary_discord(data, bot),
+            "holding_report": lambda data: process_holding_report_discord(data, bot),
+            "weekly_report": lambda data: process_weekly_report(data, bot),
+        }, submit=lambda kind, data, job: ingest_queues.submit(
+            kind, job, key=str(data["trader_uid"]) if kind in LANE_KINDS else None
+        ))
+
 # 權限檢查函數 - 根據設定的角色清單檢查權限
 def has_permission_to_create(ctx):
     # 設定允許使用指令的角色清單
@@ -961,121 +1116,150 @@ async def on_member_remove(member):
 #     except Exception as e:
 #         logging.error(f"Error in fetch_unpublished_messages: {e}")
 
+def _render_article_content(article: dict, lang: str) -> str:
+    """取得文章在指定語言的文案，失敗時退回原始內容"""
+    article_id = article.get("id")
+    try:
+        # 添加調試信息，查看原始內容的換行符
+        raw_content = article.get('content', '')
+        if raw_content:
+            logging.info(f"處理文章 {article_id} 的語言 {lang}，原始內容長度: {len(raw_content)}")
+            logging.info(f"原始內容中的換行符數量: {raw_content.count(chr(10))}")
+            logging.info(f"原始內容前100字符: {repr(raw_content[:100])}")
+
+        content = get_multilingual_content(article, lang)
+        if content:
+            logging.info(f"文章 {article_id} 處理完成，內容長度: {len(content)}")
+            logging.info(f"處理後內容中的換行符數量: {content.count(chr(10))}")
+            logging.info(f"處理後內容前100字符: {repr(content[:100])}")
+        return content
+    except Exception as e:
+        logging.error(f"處理文章 {article_id} 的多語言內容時出錯: {type(e).__name__} - {e}")
+        logging.error(f"文章 {article_id} 的詳細資料: content={article.get('content')}, translations={article.get('translations')}")
+        # 使用原始內容作為備用
+        return article.get("content", "No content available")
+
 @tasks.loop(minutes=1)
 async def fetch_unpublished_messages():
     """定時檢查未發布文章，並根據 topic_name 發送到對應頻道。"""
     try:
-        async with aiohttp.ClientSession() as session:
-            publisher = MessagePublisher(bot, session)
+        session = http_sessions.get(MESSAGE_API_URL)
+        publisher = MessagePublisher(bot)
 
-            # 獲取未發布的文章
-            async with session.get(MESSAGE_API_URL) as response:
-                if response.status != 200:
-                    logging.error(f"獲取未發布文章失敗: {response.status}")
-                    return
-
-                message_data = await response.json()
-                articles = message_data.get("data", {}).get("items", [])
-
-                # 添加調試信息，查看 API 返回的原始數據格式
-                if articles:
-                    first_article = articles[0]
-                    logging.info(f"API 返回的第一篇文章結構: {list(first_article.keys())}")
-                    if 'content' in first_article:
-                        content = first_article['content']
-                        logging.info(f"第一篇文章內容類型: {type(content)}")
-                        logging.info(f"第一篇文章內容長度: {len(content) if content else 0}")
-                        if content:
-                            logging.info(f"第一篇文章內容中的換行符: {content.count(chr(10))}")
-                            logging.info(f"第一篇文章內容前200字符: {repr(content[:200])}")
-
-                if not articles:
-                    return
-
-            await publisher.refresh_social_mapping()
+        # 先重試上一輪回報失敗的文章
+        await publish_acks.flush(publisher)
+
+        # 獲取未發布的文章
+        async with session.get(MESSAGE_API_URL, timeout=timeout(15)) as response:
+            if response.status != 200:
+                logging.error(f"獲取未發布文章失敗: {response.status}")
+                return
+
+            message_data = await response.json()
+            articles = message_data.get("data", {}).get("items", [])
+
+            # 添加調試信息，查看 API 返回的原始數據格式
+            if articles:
+                first_article = articles[0]
+                logging.info(f"API 返回的第一篇文章結構: {list(first_article.keys())}")
+                if 'content' in first_article:
+                    content = first_article['content']
+                    logging.info(f"第一篇文章內容類型: {type(content)}")
+                    logging.info(f"第一篇文章內容長度: {len(content) if content else 0}")
+                    if content:
+                        logging.info(f"第一篇文章內容中的換行符: {content.count(chr(10))}")
+                        logging.info(f"第一篇文章內容前200字符: {repr(content[:200])}")
+
+            if not articles:
+                return
+
+        await publisher.refresh_social_mapping()
             
-            # 添加調試信息，檢查頻道映射
-            for topic, channels in publisher.topic_to_channel_map.items():
-                logging.info(f"主題 '{topic}' 的頻道配置: {channels}")
-
-            # 處理每篇文章
-            for article in articles:
-                article_id = article.get("id")
-                topic_name = article.get("topic_name", "").strip()
-                logging.info(f"處理文章 ID: {article_id}, 主題: {topic_name}")
-                # 獲取與該主題匹配的頻道列表（含 lang）
-                channel_lang_list = publisher.topic_to_channel_map.get(topic_name)
-                if not channel_lang_list:
-                    logging.warning(f"未找到與主題 '{topic_name}' 匹配的頻道，跳過文章 {article_id}")
-                    continue
+        # 添加調試信息，檢查頻道映射
+        for topic, channels in publisher.topic_to_channel_map.items():
+            logging.info(f"主題 '{topic}' 的頻道配置: {channels}")
+
+        # 處理每篇文章
+        for article in articles:
+            article_id = article.get("id")
+            if publish_acks.is_pending(article_id):
+                # 已發送但尚未成功回報，不重複發送
+                continue
+            topic_name = article.get("topic_name", "").strip()
+            logging.info(f"處理文章 ID: {article_id}, 主題: {topic_name}")
+            # 獲取與該主題匹配的頻道列表（含 lang）
+            channel_lang_list = publisher.topic_to_channel_map.get(topic_name)
+            if not channel_lang_list:
+                logging.warning(f"未找到與主題 '{topic_name}' 匹配的頻道，跳過文章 {article_id}")
+                continue
                 
-                # 添加調試信息
-                logging.info(f"文章 {article_id} 的內容結構: content={article.get('content') is not None}, translations={article.get('translations') is not None}")
-                logging.info(f"文章 {article_id} 的頻道列表: {channel_lang_list}")
-                successful_sends = 0
-                temp_file_path = None
-                if article.get("image"):
-                    try:
-                        temp_file_path = await publisher.handle_image(article.get("image"), article_id)
-                    except Exception as e:
-                        logging.error(f"下載文章 {article_id} 的圖片時出錯: {e}")
-                for channel_info in channel_lang_list:
-                    channel_id = channel_info["channel_id"]
-                    lang = channel_info.get("lang", "en_US")
-                    logging.info(f"準備發送文章 {article_id} 到頻道 {channel_id}，語言: {lang}")
-                    try:
-                        channel = bot.get_channel(int(channel_id))
-                        if not channel:
-                            logging.warning(f"找不到頻道 ID {channel_id}，可能已被刪除或機器人已被踢出")
-                            continue
-                        guild_name = channel.guild.name if channel.guild else "Unknown"
-                        permissions = channel.permissions_for(channel.guild.me)
-                        if not permissions.send_messages:
-                            logging.warning(f"在伺服器 '{guild_name}' 的頻道 '{channel.name}' (ID: {channel_id}) 中沒有發送消息的權限")
-                            continue
-                        # 多語言文案
-                        try:
-                            # 添加調試信息，查看原始內容的換行符
-                            raw_content = article.get('content', '')
-                            if raw_content:
-                                logging.info(f"處理文章 {article_id} 的語言 {lang}，原始內容長度: {len(raw_content)}")
-                                logging.info(f"原始內容中的換行符數量: {raw_content.count(chr(10))}")
-                                logging.info(f"原始內容前100字符: {repr(raw_content[:100])}")
-                            
-                            content = get_multilingual_content(article, lang)
-                            if not content:
-                                logging.warning(f"文章 {article_id} 的內容為空，跳過發送")
-                                continue
-                            logging.info(f"文章 {article_id} 處理完成，內容長度: {len(content)}")
-                            logging.info(f"處理後內容中的換行符數量: {content.count(chr(10))}")
-                            logging.info(f"處理後內容前100字符: {repr(content[:100])}")
-                        except Exception as e:
-                            logging.error(f"處理文章 {article_id} 的多語言內容時出錯: {type(e).__name__} - {e}")
-                            logging.error(f"文章 {article_id} 的詳細資料: content={article.get('content')}, translations={article.get('translations')}")
-                            # 使用原始內容作為備用
-                            content = article.get("content", "No content available")
-                        
-                        if temp_file_path and permissions.attach_files:
-                            with open(temp_file_path, "rb") as image_file:
-                                await channel.send(content=content, file=discord.File(image_file))
+            # 添加調試信息
+            logging.info(f"文章 {article_id} 的內容結構: content={article.get('content') is not None}, translations={article.get('translations') is not None}")
+            logging.info(f"文章 {article_id} 的頻道列表: {channel_lang_list}")
+            image_bytes = None
+            if article.get("image"):
+                try:
+                    image_bytes = await publisher.download_image(article.get("image"))
+                except Exception as e:
+                    logging.error(f"下載文章 {article_id} 的圖片時出錯: {e}")
+            image_name = f"article_{article_id}.jpg"
+
+            # 每種語言的文案只處理一次，供同語言頻道共用
+            content_by_lang = {}
+
+            def content_for(lang):
+                if lang not in content_by_lang:
+                    content_by_lang[lang] = _render_article_content(article, lang)
+                return content_by_lang[lang]
+
+            semaphore = asyncio.Semaphore(ARTICLE_FANOUT_CONCURRENCY)
+
+            async def send_to_channel(channel_info) -> bool:
+                channel_id = channel_info["channel_id"]
+                lang = channel_info.get("lang", "en_US")
+                if channel_health.is_quarantined(channel_id):
+                    return False
+                try:
+                    access = channel_access.get(bot, channel_id)
+                    if not access:
+                        logging.warning(f"找不到頻道 ID {channel_id}，可能已被刪除或機器人已被踢出")
+                        return False
+                    channel = access.channel
+                    guild_name = channel.guild.name if channel.guild else "Unknown"
+                    if not access.can_send:
+                        logging.warning(f"在伺服器 '{guild_name}' 的頻道 '{channel.name}' (ID: {channel_id}) 中沒有發送消息的權限")
+                        return False
+                    content = content_for(lang)
+                    if not content:
+                        logging.warning(f"文章 {article_id} 的內容為空，跳過發送")
+                        return False
+
+                    async with semaphore:
+                        if image_bytes and access.can_attach:
+                            send = lambda: channel.send(content=content, file=discord.File(io.BytesIO(image_bytes), filename=image_name))
                         else:
-                            await channel.send(content=content)
-                        successful_sends += 1
-                        logging.info(f"成功發送文章 {article_id} 到伺服器 '{guild_name}' 的頻道 '{channel.name}' (ID: {channel_id})，語言: {lang}")
-                    except discord.Forbidden as e:
-                        logging.error(f"權限錯誤: 無法在頻道 {channel_id} 中發送消息: {e}")
-                    except Exception as e:
-                        logging.error(f"向頻道 {channel_id} 發送文章 {article_id} 時出錯: {type(e).__name__} - {e}")
-                if temp_file_path and os.path.exists(temp_file_path):
-                    try:
-                        os.remove(temp_file_path)
-                    except:
-                        pass
-                if successful_sends > 0:
-                    await publisher.mark_as_published(article_id)
-                    logging.info(f"文章 {article_id} 已被標記為已發布，成功發送到 {successful_sends} 個頻道")
-                else:
-                    logging.warning(f"文章 {article_id} 未成功發送到任何頻道，不標記為已發布")
+                            send = lambda: channel.send(content=content)
+                        await asyncio.wait_for(deliver(PRIORITY_BULK, channel.id, send), timeout=ARTICLE_SEND_TIMEOUT)
+                    logging.info(f"成功發送文章 {article_id} 到伺服器 '{guild_name}' 的頻道 '{channel.name}' (ID: {channel_id})，語言: {lang}")
+                    return True
+                except asyncio.TimeoutError:
+                    logging.error(f"向頻道 {channel_id} 發送文章 {article_id} 超時")
+                except discord.Forbidden as e:
+                    logging.error(f"權限錯誤: 無法在頻道 {channel_id} 中發送消息: {e}")
+                except Exception as e:
+                    logging.error(f"向頻道 {channel_id} 發送文章 {article_id} 時出錯: {type(e).__name__} - {e}")
+                return False
+
+            results = await asyncio.gather(*(send_to_channel(info) for info in channel_lang_list))
+            successful_sends = sum(1 for ok in results if ok)
+            if successful_sends > 0:
+                publish_acks.add(article_id)
+                logging.info(f"文章 {article_id} 成功發送到 {successful_sends} 個頻道，待標記為已發布")
+            else:
+                logging.warning(f"文章 {article_id} 未成功發送到任何頻道，不標記為已發布")
+
+        # 本輪發送完成的文章一次回報
+        await publish_acks.flush(publisher)
     except Exception as e:
         logging.error(f"fetch_unpublished_messages 任務中發生未處理的錯誤: {type(e).__name__} - {e}")
 
@@ -1127,16 +1311,42 @@ async def before_fetch_unpublished_messages():
 async def on_guild_channel_delete(channel):
     """Invalidate cache when a channel is deleted"""
     bot.channel_manager.invalidate_cache(channel.guild.id)
+    group_lang_cache.invalidate(channel.id)
+    webhook_registry.forget(channel.id)
+    channel_access.invalidate_channel(channel.id)
 
 @bot.event
 async def on_guild_channel_create(channel):
     """Invalidate cache when a channel is created"""
     bot.channel_manager.invalidate_cache(channel.guild.id)
+    channel_access.invalidate_guild(channel.guild.id)
 
 @bot.event
 async def on_guild_channel_update(before, after):
     """Invalidate cache when a channel is updated"""
     bot.channel_manager.invalidate_cache(before.guild.id)
+    group_lang_cache.invalidate(after.id)
+    # 分類的權限覆寫可能影響其下頻道，整個 guild 重新計算
+    channel_access.invalidate_guild(after.guild.id)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    """身分組權限變更時清除該 guild 的頻道權限快取"""
+    channel_access.invalidate_guild(after.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role):
+    channel_access.invalidate_guild(role.guild.id)
+
+@bot.event
+async def on_member_update(before, after):
+    """bot 自身的身分組變更時清除該 guild 的頻道權限快取"""
+    if bot.user and after.id == bot.user.id:
+        channel_access.invalidate_guild(after.guild.id)
+
+@bot.event
+async def on_guild_remove(guild):
+    channel_access.invalidate_guild(guild.id)
 
 # FastAPI endpoints
 @app.get("/api/discord/members")
@@ -1168,12 +1378,70 @@ async def get_members(id: Union[int, None] = Query(default=None, description="Di
         "data": guilds_data
     }
 
+@app.get("/api/discord/stats")
+async def get_runtime_stats():
+    """運行時統計（路由表命中率與新鮮度等）"""
+    return {
+        "success": True,
+        "message": "successful",
+        "data": {
+            "routing": routing_table.get_stats(),
+            "group_lang": group_lang_cache.get_stats(),
+            "delivery": delivery_scheduler.get_stats(),
+            "last_announcement": _last_announcement_report,
+            "attachments": attachment_stats(),
+            "webhooks": webhook_registry.get_stats(),
+            "outbox": outbox.get_stats(),
+            "dedup": dedup_window.get_stats(),
+            "scalp_coalesce": scalp_coalescer.get_stats(),
+            "holding_report_index": holding_report_index.get_stats(),
+            "channel_access": channel_access.get_stats(),
+            "channel_health": channel_health.get_stats(),
+            "publish_acks": publish_acks.get_stats(),
+            "ingest": ingest_queues.get_stats(),
+            "api_mode": "single_loop" if API_SINGLE_LOOP else "threaded",
+        }
+    }
+
+@app.get("/api/discord/quarantine")
+async def get_quarantined_channels():
+    """目前因連續失敗而被隔離的頻道"""
+    return {"success": True, "data": channel_health.quarantined()}
+
+@app.post("/api/discord/quarantine/release")
+async def release_quarantined_channel(id: int = Query(..., description="Channel ID")):
+    """手動解除頻道隔離（例如已重新授權 bot）"""
+    released = channel_health.release(id)
+    return {"success": True, "released": released}
+
+@app.post("/api/discord/verify_group/invalidate")
+async def invalidate_verify_group(id: int = Query(..., description="Verify group (channel) ID")):
+    """群組設定變更後清除其語言快取"""
+    group_lang_cache.invalidate(id)
+    return {"success": True, "message": "successful"}
+
 def html_to_discord_markdown(text):
     text = re.sub(r'<b>(.*?)</b>', r'**\1**', text, flags=re.IGNORECASE)
     text = re.sub(r'<i>(.*?)</i>', r'*\1*', text, flags=re.IGNORECASE)
     text = re.sub(r'<u>(.*?)</u>', r'__\1__', text, flags=re.IGNORECASE)
     return text
 
+def _render_announcement_content(content_dict: dict, lang: str) -> Optional[str]:
+    """渲染指定語言的公告文案（HTML 轉 Markdown 並附加 AI 提示詞），無該語言文案時回傳 None"""
+    channel_content = content_dict.get(lang)
+    if not channel_content:
+        return None
+    # 轉換 HTML 到 Discord Markdown
+    channel_content = html_to_discord_markdown(channel_content)
+    # 在文案最後加上對應語言的 AI 提示詞（英文不加：含 en 與 en_US）
+    api_lang_code = LANGUAGE_CODE_MAPPING.get(lang, lang)
+    if api_lang_code != "en_US":
+        channel_content += AI_TRANSLATE_HINT.get(api_lang_code, AI_TRANSLATE_HINT["en_US"])
+    return channel_content
+
+# 最近一次公告的各頻道發送結果
+_last_announcement_report: Optional[dict] = None
+
 @app.post("/api/discord/announcement")
 async def send_announcement_to_discord(request: Request):
     payload = await request.json()
@@ -1202,128 +1470,132 @@ async def send_announcement_to_discord(request: Request):
         logging.error(f"[DC] 內容格式錯誤: {e}")
         return {"status": "error", "message": "Invalid content format. Expected JSON object with language codes as keys."}
 
+    # 冪等：時間窗內的重複公告（上游重試）直接忽略
+    dedup_key = payload_digest(payload)
+    if dedup_window.seen("announcement", dedup_key):
+        logging.info("[DC] 重複的公告請求，已忽略")
+        return {"status": "success", "message": "Duplicate announcement ignored"}
+
     try:
         async def send_announcement_task():
             logging.info("[DC] 開始執行公告發送任務")
-            async with aiohttp.ClientSession() as session:
-                payload = {
-                    "brand": "BYD",
-                    "type": "DISCORD"
-                }
-                logging.info(f"[DC] 呼叫 SOCIAL_API: {SOCIAL_API}")
-                async with session.post(SOCIAL_API, data=payload) as response:
-                    logging.info(f"[DC] SOCIAL_API 響應狀態: {response.status}")
-                    if response.status != 200:
-                        raise Exception("Failed to fetch social data")
-                    social_data = await response.json()
-                    logging.info(f"[DC] SOCIAL_API 響應數據: {social_data}")
-
-                social_groups = social_data.get("data", [])
-                logging.info(f"[DC] 找到 {len(social_groups)} 個社交群組")
-
-                # 獲取 Announcements 頻道及其對應的語言
-                channel_lang_mapping = []
-                for group in social_groups:
-                    group_lang = group.get("lang", "en_US")  # 默認語言為 en_US
-                    if not group_lang:
-                        group_lang = "en_US"
-                    
-                    logging.info(f"[DC] 處理群組: uid={group.get('uid')}, lang={group_lang}")
-                    
-                    for chat in group.get("chats", []):
-                        if chat.get("enable", False) and chat["name"] == "Announcements":
-                            channel_info = {
-                                "channel_id": int(chat["chatId"]),
-                                "lang": group_lang
-                            }
-                            channel_lang_mapping.append(channel_info)
-                            logging.info(f"[DC] 找到 Announcements 頻道: {channel_info}")
-
-                logging.info(f"[DC] 總共找到 {len(channel_lang_mapping)} 個 Announcements 頻道")
-                if not channel_lang_mapping:
-                    raise Exception("No Discord channels with topic 'Announcements' found")
-
-                # 下載圖片（如果需要）
-                image_bytes = None
-                if image:
-                    logging.info(f"[DC] 開始下載圖片: {image}")
-                    async with session.get(image) as img_resp:
-                        logging.info(f"[DC] 圖片下載響應狀態: {img_resp.status}")
-                        if img_resp.status == 200:
-                            image_bytes = await img_resp.read()
-                            logging.info(f"[DC] 圖片下載成功，大小: {len(image_bytes)} bytes")
-                        else:
-                            logging.warning(f"[DC] 圖片下載失敗，狀態碼: {img_resp.status}")
+            # 與其他 SOCIAL_API 讀取者共用同一個進行中的請求
+            social_groups = await routing_table.get_groups()
+            logging.info(f"[DC] 找到 {len(social_groups)} 個社交群組")
 
-                # 發送到所有頻道，根據語言匹配對應的文案
-                logging.info(f"[DC] 開始發送公告到 {len(channel_lang_mapping)} 個頻道")
-                success_count = 0
-                failed_count = 0
-                
-                for i, channel_info in enumerate(channel_lang_mapping, 1):
-                    channel_id = channel_info["channel_id"]
-                    lang = channel_info["lang"]
-                    
-                    logging.info(f"[DC] 處理第 {i}/{len(channel_lang_mapping)} 個頻道: {channel_id}, 語言: {lang}")
+            # 獲取 Announcements 頻道及其對應的語言
+            channel_lang_mapping = []
+            for group in social_groups:
+                group_lang = group.get("lang", "en_US")  # 默認語言為 en_US
+                if not group_lang:
+                    group_lang = "en_US"
                     
-                    channel = bot.get_channel(channel_id)
-                    if not channel:
-                        logging.warning(f"[DC] 找不到頻道 {channel_id}")
-                        continue
-
-                    # 根據語言獲取對應的文案
-                    channel_content = content_dict.get(lang)
-                    if not channel_content:
-                        logging.warning(f"[DC] 找不到語言 {lang} 的文案，跳過頻道 {channel_id}")
-                        continue
-                    logging.info(f"[DC] 找到語言 {lang} 的文案，長度: {len(channel_content)}")
-
-                    # 轉換 HTML 到 Discord Markdown
-                    channel_content = html_to_discord_markdown(channel_content)
-                    logging.info(f"[DC] HTML 轉換後文案長度: {len(channel_content)}")
+                logging.info(f"[DC] 處理群組: uid={group.get('uid')}, lang={group_lang}")
                     
-                    # 在文案最後加上對應語言的 AI 提示詞（英文不加：含 en 與 en_US）
-                    api_lang_code = LANGUAGE_CODE_MAPPING.get(lang, lang)
-                    if api_lang_code != "en_US":
-                        ai_hint = AI_TRANSLATE_HINT.get(api_lang_code, AI_TRANSLATE_HINT["en_US"])
-                        channel_content += ai_hint
-                        logging.info(f"[DC] 添加 AI 提示詞: {api_lang_code}")
+                for chat in group.get("chats", []):
+                    if chat.get("enable", False) and chat["name"] == "Announcements":
+                        channel_info = {
+                            "channel_id": int(chat["chatId"]),
+                            "lang": group_lang
+                        }
+                        channel_lang_mapping.append(channel_info)
+                        logging.info(f"[DC] 找到 Announcements 頻道: {channel_info}")
+
+            logging.info(f"[DC] 總共找到 {len(channel_lang_mapping)} 個 Announcements 頻道")
+            if not channel_lang_mapping:
+                raise Exception("No Discord channels with topic 'Announcements' found")
+
+            # 下載圖片（如果需要）
+            image_bytes = None
+            if image:
+                logging.info(f"[DC] 開始下載圖片: {image}")
+                async with http_sessions.get(image).get(image, timeout=timeout(30)) as img_resp:
+                    logging.info(f"[DC] 圖片下載響應狀態: {img_resp.status}")
+                    if img_resp.status == 200:
+                        image_bytes = await img_resp.read()
+                        logging.info(f"[DC] 圖片下載成功，大小: {len(image_bytes)} bytes")
+                    else:
+                        logging.warning(f"[DC] 圖片下載失敗，狀態碼: {img_resp.status}")
+
+            # 每種語言只渲染一次：HTML 轉 Markdown 並附加 AI 提示詞
+            rendered_by_lang = {}
+            for lang in {info["lang"] for info in channel_lang_mapping}:
+                rendered = _render_announcement_content(content_dict, lang)
+                if rendered:
+                    rendered_by_lang[lang] = rendered
+            logging.info(f"[DC] 已預先渲染 {len(rendered_by_lang)} 種語言的公告文案")
+
+            # 並發發送到所有頻道，單一頻道超時不影響其他頻道
+            logging.info(f"[DC] 開始發送公告到 {len(channel_lang_mapping)} 個頻道")
+            semaphore = asyncio.Semaphore(ANNOUNCEMENT_CONCURRENCY)
+
+            async def send_to_channel(channel_info) -> str:
+                channel_id = channel_info["channel_id"]
+                lang = channel_info["lang"]
+
+                if channel_health.is_quarantined(channel_id):
+                    return "quarantined"
+                access = channel_access.get(bot, channel_id)
+                if not access:
+                    logging.warning(f"[DC] 找不到頻道 {channel_id}")
+                    return "not_found"
+                channel = access.channel
+                if not access.can_send:
+                    logging.warning(f"[DC] 在頻道 {channel_id} 中沒有發送消息的權限")
+                    return "forbidden"
+
+                channel_content = rendered_by_lang.get(lang)
+                if not channel_content:
+                    logging.warning(f"[DC] 找不到語言 {lang} 的文案，跳過頻道 {channel_id}")
+                    return "no_content"
+
+                if image_bytes:
+                    send = lambda: channel.send(
+                        content=channel_content,
+                        file=discord.File(fp=io.BytesIO(image_bytes), filename="announcement.jpg")
+                    )
+                else:
+                    send = lambda: channel.send(content=channel_content)
 
+                async with semaphore:
                     try:
-                        if image_bytes:
-                            file = discord.File(fp=io.BytesIO(image_bytes), filename="announcement.jpg")
-                            logging.info(f"[DC] 發送帶圖片的公告到頻道 {channel_id}")
-                            await asyncio.wait_for(
-                                channel.send(content=channel_content, file=file),
-                                timeout=15.0
-                            )
-                        else:
-                            logging.info(f"[DC] 發送純文字公告到頻道 {channel_id}")
-                            await asyncio.wait_for(
-                                channel.send(content=channel_content),
-                                timeout=15.0
-                            )
-                        logging.info(f"[DC] 成功發送到頻道 {channel_id}")
-                        success_count += 1
+                        await asyncio.wait_for(deliver(PRIORITY_BULK, channel_id, send), timeout=ANNOUNCEMENT_SEND_TIMEOUT)
                     except asyncio.TimeoutError:
                         logging.error(f"[DC] 發送到頻道 {channel_id} 超時")
-                        failed_count += 1
-                        continue
+                        return "timeout"
                     except Exception as e:
                         logging.error(f"[DC] 發送到頻道 {channel_id} 失敗: {e}")
-                        failed_count += 1
-                        continue
-
-                # 統計發送結果
-                logging.info(f"[DC] 公告發送完成: 成功 {success_count}/{len(channel_lang_mapping)} 個頻道")
+                        return "failed"
+                logging.info(f"[DC] 成功發送到頻道 {channel_id}")
+                return "sent"
+
+            started = time.monotonic()
+            outcomes = await asyncio.gather(*(send_to_channel(info) for info in channel_lang_mapping))
+
+            # 統計發送結果
+            report = {
+                "channels": {str(info["channel_id"]): outcome for info, outcome in zip(channel_lang_mapping, outcomes)},
+                "counts": {},
+                "elapsed_ms": round((time.monotonic() - started) * 1000, 1),
+            }
+            for outcome in outcomes:
+                report["counts"][outcome] = report["counts"].get(outcome, 0) + 1
+            global _last_announcement_report
+            _last_announcement_report = report
+            logging.info(
+                f"[DC] 公告發送完成: 成功 {report['counts'].get('sent', 0)}/{len(channel_lang_mapping)} 個頻道, "
+                f"統計 {report['counts']}, 耗時 {report['elapsed_ms']}ms"
+            )
+            return report
 
-        # 使用 run_coroutine_threadsafe 在 Discord 的事件循環中執行
+        # 在 Discord 的事件循環中執行（單一事件迴圈模式下直接建立 task）
         logging.info("[DC] 準備在 Discord 事件循環中執行發送任務")
-        asyncio.run_coroutine_threadsafe(send_announcement_task(), bot.loop)
+        call_on_loop(bot.loop, bot.loop.create_task, send_announcement_task())
 
         return {"status": "success", "message": "Announcement sent to Discord"}
 
     except Exception as e:
+        dedup_window.forget("announcement", dedup_key)
         logging.error(f"[DC] 發送公告失敗: {e}")
         import traceback
         logging.error(f"[DC] 詳細錯誤: {traceback.format_exc()}")
@@ -1343,11 +1615,32 @@ def run_api():
     uvicorn.run(app, host="0.0.0.0", port=5011, access_log=False)
     # uvicorn.run(app, host="172.25.183.177", port=5011)
 
+async def run_single_loop():
+    """單一事件迴圈模式：uvicorn 以 task 形式跑在 bot 的事件迴圈上，請求處理無需跨執行緒"""
+    server = uvicorn.Server(uvicorn.Config(app, host="0.0.0.0", port=5011, access_log=False))
+    async with bot:
+        api_task = asyncio.create_task(server.serve())
+        try:
+            await bot.start(TOKEN)
+        finally:
+            server.should_exit = True
+            await api_task
+
 # 在主函數中啟動 API 服務
 if __name__ == "__main__":
-    # 在新線程中啟動 API 服務
-    api_thread = Thread(target=run_api, daemon=True)
-    api_thread.start()
+    # 先載入本地路由快照，使重啟後的第一批訊號無需等待 SOCIAL_API
+    routing_table.load_snapshot()
+
+    if API_SINGLE_LOOP:
+        logging.info("[API] 單一事件迴圈模式：FastAPI 與 Discord bot 共用事件迴圈")
+        try:
+            asyncio.run(run_single_loop())
+        except KeyboardInterrupt:
+            pass
+    else:
+        # 在新線程中啟動 API 服務
+        api_thread = Thread(target=run_api, daemon=True)
+        api_thread.start()
 
-    # 運行 Discord bot
-    bot.run(TOKEN)
\ No newline at end of file
+        # 運行 Discord bot
+        bot.run(TOKEN)
\ No newline at end of file
@@ -0,0 +1,58 @@
+import pytest
+
+from handlers.copy_signal_handler import format_copy_signal_text
+from handlers.schemas import CopySignal, TradeSummary, WeeklyReport
+from handlers.trade_summary_handler import format_trade_summary_text, trade_summary_dedup_key
+from handlers.weekly_report_handler import format_weekly_report_text
+
+WEEKLY = dict(
+    trader_uid=1, trader_name="Alice", trader_url="https://example.com/a.png",
+    trader_detail_url="https://example.com/d", total_roi="0.12", total_pnl="3",
+    total_trades=10, win_trades="6", loss_trades=4, win_rate="0.6",
+)
+
+SUMMARY = dict(
+    trader_uid=123, trader_name="Alice", trader_detail_url="https://example.com/d", pair="BTCUSDT",
+    pair_side=1, pair_margin_type="1", pair_leverage="10", entry_price="1.20", exit_price="1.3",
+    realized_pnl="5", realized_pnl_percentage="0.025", close_time="1700000000000",
+)
+
+
+def test_weekly_counts_truncate_floats_like_int():
+    report = WeeklyReport.check({**WEEKLY, "total_trades": 10.5})
+    assert report.total_trades == 10
+    assert report.trader_uid == "1"
+
+
+@pytest.mark.parametrize("value", ["10.5", float("inf"), float("nan"), "x"])
+def test_weekly_counts_reject_non_integers(value):
+    with pytest.raises(ValueError, match="數值欄位必須為正確的數字格式"):
+        WeeklyReport.check({**WEEKLY, "total_trades": value})
+
+
+def test_weekly_text_uses_typed_fields():
+    text = format_weekly_report_text(WEEKLY, WeeklyReport.check(WEEKLY), False, "en")
+    assert "12%" in text and "60%" in text
+
+
+def test_trade_summary_key_and_text_use_typed_fields():
+    summary = TradeSummary.check(SUMMARY)
+    assert trade_summary_dedup_key(summary) == ("123", "BTCUSDT", 1700000000000)
+    assert trade_summary_dedup_key(summary) == trade_summary_dedup_key(
+        TradeSummary.check({**SUMMARY, "trader_uid": "123", "close_time": 1700000000000})
+    )
+    text = format_trade_summary_text(SUMMARY, summary, False, "en")
+    # 數值經模型轉型後格式化，價格保留原始字串
+    assert "2.5%" in text and "10X" in text and "$1.20" in text
+
+
+def test_copy_signal_text_uses_typed_fields():
+    data = dict(
+        trader_uid="123", trader_name="Alice", trader_pnl="12.5", trader_pnlpercentage="3.2",
+        trader_detail_url="https://example.com/d", pair="BTCUSDT", base_coin="BTC", quote_coin="USDT",
+        pair_leverage="10.0", pair_type="buy", price="65000.10", time=1700000000000,
+        trader_url="https://example.com/a.png", pair_side=1, pair_margin_type=2,
+    )
+    text = format_copy_signal_text(data, CopySignal.check(data), "2023-11-14 22:13:20", False, "en")
+    # 數字代碼經模型正規化為 '1' / '2'，槓桿經轉型後格式化，價格保留原始字串
+    assert "Long" in text and "Isolated" in text and "10X" in text and "65000.10" in text
@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+from aiohttp import web
+
+from handlers.delivery import delivery_scheduler, PRIORITY_SIGNAL
+from handlers.http_pool import http_sessions
+from handlers.webhooks import WebhookRegistry, WebhookError
+
+
+class FakeDiscord:
+    """本地假 Discord API：記錄 webhook 執行請求，回應可設定的狀態碼"""
+
+    def __init__(self, status: int = 204):
+        self.status = status
+        self.requests = []
+        self._runner = None
+        self.base_url = ""
+
+    async def _execute(self, request: web.Request) -> web.Response:
+        if request.content_type == "multipart/form-data":
+            form = await request.post()
+            body = {"payload": json.loads(form["payload_json"]), "file": form["files[0]"].filename}
+        else:
+            body = {"payload": await request.json()}
+        self.requests.append((request.match_info["webhook_id"], request.match_info["token"], body))
+        return web.Response(status=self.status, text="" if self.status < 300 else "Unknown Webhook")
+
+    async def __aenter__(self) -> "FakeDiscord":
+        app = web.Application()
+        app.router.add_post("/api/v10/webhooks/{webhook_id}/{token}", self._execute)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}/api/v10"
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await http_sessions.close()
+        await delivery_scheduler.stop()
+        await self._runner.cleanup()
+
+
+def test_execute_posts_to_overridden_base_url():
+    async def run():
+        async with FakeDiscord() as fake:
+            registry = WebhookRegistry(base_url=fake.base_url)
+            await registry.execute((123, "tok"), "hello")
+        assert fake.requests == [("123", "tok", {"payload": {"content": "hello", "allowed_mentions": {"parse": []}}})]
+
+    asyncio.run(run())
+
+
+def test_execute_uploads_image_as_multipart(tmp_path):
+    image = tmp_path / "summary.png"
+    image.write_bytes(b"\x89PNG fake")
+
+    async def run():
+        async with FakeDiscord() as fake:
+            registry = WebhookRegistry(base_url=fake.base_url)
+            await registry.execute((123, "tok"), "with image", str(image), "trade_summary.png")
+        (_, _, body), = fake.requests
+        assert body["payload"]["content"] == "with image"
+        assert body["file"] == "trade_summary.png"
+
+    asyncio.run(run())
+
+
+def test_send_uses_cached_credentials():
+    async def run():
+        async with FakeDiscord() as fake:
+            registry = WebhookRegistry(base_url=fake.base_url)
+            registry.remember(42, 123, "tok")
+            assert await registry.send(None, 42, PRIORITY_SIGNAL, "signal") is True
+        assert len(fake.requests) == 1
+        assert registry.get_stats()["sent"] == 1
+
+    asyncio.run(run())
+
+
+def test_send_evicts_deleted_webhook_and_falls_back():
+    async def run():
+        async with FakeDiscord(status=404) as fake:
+            registry = WebhookRegistry(base_url=fake.base_url)
+            registry.remember(42, 123, "tok")
+            assert await registry.send(None, 42, PRIORITY_SIGNAL, "signal") is False
+        assert registry.get_stats()["channels"] == 0
+        assert registry.get_stats()["fallbacks"] == 1
+
+    asyncio.run(run())
+
+
+def test_execute_raises_on_error_status():
+    async def run():
+        async with FakeDiscord(status=500) as fake:
+            registry = WebhookRegistry(base_url=fake.base_url)
+            try:
+                await registry.execute((123, "tok"), "hello")
+            except WebhookError as e:
+                return e.status
+        return None
+
+    assert asyncio.run(run()) == 500